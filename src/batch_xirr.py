@@ -0,0 +1,177 @@
+import numpy as np
+
+# pyxirr's day count for xnpv/xirr: actual days between cashflows / 365
+DAYS_IN_YEAR = 365.0
+# Rates searched for a sign change in the NPV, to bracket the IRRs Newton's method doesn't find
+BRACKET_RATES = np.concatenate([[-0.999, -0.99, -0.9], np.linspace(-0.8, 1.0, 19), [1.5, 2, 3, 5, 10, 100, 1000]])
+# A finer search for the rows whose NPV doesn't change sign on BRACKET_RATES, e.g. with two roots close together or
+# a rate within 0.001 of -1
+FINE_BRACKET_RATES = np.concatenate([np.logspace(-12, -3, 10)[:-1] - 1, np.linspace(-0.999, 1.0, 400)[:-1], BRACKET_RATES[-7:]])
+
+
+def year_fractions(dates):
+    '''function to calculate the year fraction of each date from the first date in its row (actual/365, as pyxirr).
+    dates is a datetime64 vector shared by every unit, or a units x periods matrix; NaT dates (padding) get 0.'''
+
+    dates = np.asarray(dates, dtype="datetime64[D]")
+    days = (dates - dates[..., :1]).astype(np.float64)
+    days[np.isnat(dates)] = 0.0
+    return days / DAYS_IN_YEAR
+
+
+def xnpv_batch(discount_rates, dates, cashflows):
+    '''Vectorised XNPV of every row of a cashflow matrix for every discount rate, in one broadcasted operation.
+
+    Parameters:
+        discount_rates: a single rate or an array of rates.
+        dates: datetime64 dates, shared (periods,) or per unit (units x periods). Padding dates can be NaT.
+        cashflows: units x periods cashflow matrix (or a single series), padding cashflows must be 0.
+
+    Returns an array of shape discount_rates.shape + units, e.g. (n_rates, n_units). Any leading axes of the
+    cashflows (e.g. scenarios x units) are kept.
+    '''
+    t = year_fractions(dates)
+    cashflows = np.nan_to_num(np.asarray(cashflows, dtype=float))
+    rates = np.asarray(discount_rates, dtype=float)
+    # The year-fraction exponents are computed once and broadcast against every rate
+    log_discount = np.log1p(rates).reshape(rates.shape + (1,) * cashflows.ndim)
+    return (cashflows * np.exp(-t * log_discount)).sum(axis=-1)
+
+
+def xnpv_rows(discount_rates, dates, cashflows):
+    '''Vectorised XNPV of each row of a cashflow matrix at its own discount rate, i.e. one rate per unit
+    (a single rate is used for every row)'''
+
+    t = year_fractions(dates)
+    cashflows = np.nan_to_num(np.asarray(cashflows, dtype=float))
+    rates = np.broadcast_to(np.asarray(discount_rates, dtype=float), cashflows.shape[:-1])
+    return (cashflows * np.exp(-t * np.log1p(rates)[..., None])).sum(axis=-1)
+
+
+def _npv_and_derivative(rate, t, cashflows):
+    '''function to calculate the NPV of each row at its own rate, and the derivative of the NPV with respect to the rate'''
+
+    discounted = cashflows * np.exp(-t * np.log1p(rate)[..., None])
+    npv = discounted.sum(axis=-1)
+    d_npv = -(t * discounted).sum(axis=-1) / (1 + rate)
+    return npv, d_npv
+
+
+def _bracket_roots(t, cashflows, rates, guess):
+    '''function to find, for every row, the pair of neighbouring rates on a grid between which the NPV changes sign,
+    taking the pair nearest guess where there's more than one'''
+
+    npv = (cashflows[..., None, :] * np.exp(-t[..., None, :] * np.log1p(rates)[:, None])).sum(axis=-1)
+    sign_change = (np.signbit(npv[..., :-1]) != np.signbit(npv[..., 1:])) | (npv[..., :-1] == 0)
+    found = sign_change.any(axis=-1)
+    # Distance of each bracket from guess (0 if it contains it), infinite where there's no sign change
+    distance = np.maximum(np.maximum(rates[:-1] - guess, guess - rates[1:]), 0.0)
+    nearest = np.argmin(np.where(sign_change, distance, np.inf), axis=-1)
+    return found, rates[nearest], rates[nearest + 1]
+
+
+def _sign_changes(cashflows):
+    '''function to count the sign changes along each row of cashflows, skipping zeros'''
+
+    signs = np.sign(cashflows)
+    nonzero = np.where(signs != 0, np.arange(signs.shape[-1]), -1)
+    # Index of the last non-zero cashflow before each one (-1 if there isn't one)
+    previous = np.concatenate([np.full(signs.shape[:-1] + (1,), -1), np.maximum.accumulate(nonzero, axis=-1)[..., :-1]], axis=-1)
+    previous_sign = np.where(previous >= 0, np.take_along_axis(signs, np.maximum(previous, 0), axis=-1), 0)
+    return ((signs != 0) & (previous_sign != 0) & (signs != previous_sign)).sum(axis=-1)
+
+
+def _is_root(rate, t, cashflows, rtol=1e-6):
+    '''function to check that each row's NPV at its rate is 0, to within rtol of the sum of its discounted
+    cashflows' sizes'''
+
+    with np.errstate(over="ignore", invalid="ignore"):
+        discounted = cashflows * np.exp(-t * np.log1p(rate)[..., None])
+        return np.abs(discounted.sum(axis=-1)) <= rtol * np.abs(discounted).sum(axis=-1)
+
+
+def xirr_batch(dates, cashflows, guess=0.1, tol=1e-10, max_iter=100):
+    '''Vectorised XIRR of every row of a cashflow matrix, solving all rows at once.
+
+    Each row starts with Newton's method from guess (as pyxirr does). Rows that don't converge, or that leave the
+    valid range (rate <= -1), are solved again with a safeguarded Newton/bisection hybrid on a bracketed root (the
+    bracket nearest guess if the NPV changes sign more than once). Per-row convergence masks mean finished rows are no
+    longer updated. Every rate is checked to be a root (NPV 0 to within 1e-6 of the discounted cashflows), rows
+    without one, e.g. with no sign change in their cashflows, get NaN.
+
+    Parameters:
+        dates: datetime64 dates, shared (periods,) or per unit (units x periods). Padding dates can be NaT.
+        cashflows: units x periods cashflow matrix (or a single series), padding cashflows must be 0.
+    '''
+    cashflows = np.nan_to_num(np.asarray(cashflows, dtype=float))
+    rows = cashflows.shape[:-1]
+    t = np.broadcast_to(year_fractions(dates), cashflows.shape).reshape(-1, cashflows.shape[-1])
+    cashflows = cashflows.reshape(-1, cashflows.shape[-1])
+    # Like pyxirr, an IRR needs at least one negative and one positive cashflow
+    solvable = (cashflows < 0).any(axis=-1) & (cashflows > 0).any(axis=-1)
+
+    # Newton's method for all rows from the same guess
+    rate = np.full(len(cashflows), float(guess))
+    active = solvable.copy()
+    converged = np.zeros(len(cashflows), dtype=bool)
+    for _ in range(max_iter):
+        if not active.any():
+            break
+        index = np.flatnonzero(active)
+        npv, d_npv = _npv_and_derivative(rate[index], t[index], cashflows[index])
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            step = npv / d_npv
+        new_rate = rate[index] - step
+        done = np.abs(step) <= tol * np.maximum(1.0, np.abs(new_rate))
+        failed = ~np.isfinite(new_rate) | (new_rate <= -1)
+        rate[index] = np.where(failed, rate[index], new_rate)
+        converged[index[done & ~failed]] = True
+        active[index[done | failed]] = False
+
+    # Cashflows that change sign more than once can have several IRRs. Newton's root is the one nearest guess if the
+    # NPV keeps its sign at guess on every BRACKET_RATES rate nearer guess than the root, otherwise the row is retried.
+    newton_root = converged.copy()
+    multiple = np.flatnonzero(converged & (_sign_changes(cashflows) > 1))
+    if len(multiple):
+        unit, point = np.nonzero(np.abs(BRACKET_RATES - guess) < np.abs(rate[multiple, None] - guess))
+        at_guess, _ = _npv_and_derivative(np.full(len(multiple), float(guess)), t[multiple], cashflows[multiple])
+        at_point, _ = _npv_and_derivative(BRACKET_RATES[point], t[multiple[unit]], cashflows[multiple[unit]])
+        converged[multiple[unit[np.signbit(at_point) != np.signbit(at_guess[unit])]]] = False
+
+    # Rows that Newton couldn't solve (or whose root isn't the nearest) fall back to a bracketed Newton/bisection hybrid
+    retry = np.flatnonzero(solvable & ~converged)
+    if len(retry):
+        t_retry, cf_retry = t[retry], cashflows[retry]
+        found, lo, hi = _bracket_roots(t_retry, cf_retry, BRACKET_RATES, float(guess))
+        missed = np.flatnonzero(~found & ~newton_root[retry])
+        if len(missed):
+            found[missed], lo[missed], hi[missed] = _bracket_roots(t_retry[missed], cf_retry[missed], FINE_BRACKET_RATES, float(guess))
+        npv_lo, _ = _npv_and_derivative(lo, t_retry, cf_retry)
+        x = (lo + hi) / 2
+        active = found.copy()
+        for _ in range(max_iter * 2):
+            if not active.any():
+                break
+            npv, d_npv = _npv_and_derivative(x, t_retry, cf_retry)
+            # Shrink each bracket to the side that still contains the sign change
+            same_side = np.signbit(npv) == np.signbit(npv_lo)
+            lo, npv_lo = np.where(same_side, x, lo), np.where(same_side, npv, npv_lo)
+            hi = np.where(same_side, hi, x)
+            with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                newton = x - npv / d_npv
+            # Take the Newton step where it stays inside the bracket, otherwise bisect
+            inside = np.isfinite(newton) & (newton >= lo) & (newton <= hi)
+            new_x = np.where(inside, newton, (lo + hi) / 2)
+            # x is kept where it's an exact root, where the bracket has closed on it the step is 0
+            root = npv == 0
+            done = root | (np.abs(new_x - x) <= tol * np.maximum(1.0, np.abs(new_x)))
+            x = np.where(active & ~root, new_x, x)
+            active &= ~done
+        # Newton's root stands where no bracket is found, e.g. two roots between neighbouring BRACKET_RATES
+        rate[retry] = np.where(found, x, np.where(newton_root[retry], rate[retry], np.nan))
+
+    rate[~solvable] = np.nan
+    # Rates that aren't roots, e.g. a bracket that ran out of iterations, get NaN rather than a wrong IRR
+    checked = np.flatnonzero(np.isfinite(rate))
+    rate[checked[~_is_root(rate[checked], t[checked], cashflows[checked])]] = np.nan
+    return rate.reshape(rows)
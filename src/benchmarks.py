@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+
+from npv_irr_calculations import (
+    add_months,
+    calculate_irr,
+    calculate_npv,
+    create_cashflow,
+    rent_review_yp,
+    rent_yp,
+    reversion_yp,
+)
+from lease import Lease
+from pipeline import stream_portfolio
+from portfolio import create_portfolio_cashflows
+from runner import run_portfolio
+from segments import cashflow_segments, segments_npv
+
+# Baseline of the benchmark suite, compared against by `python benchmarks.py --check`
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+# Modules a pool worker or CLI batch job starts by importing, and the cold import time (ms) each should stay under
+IMPORT_TARGETS_MS = {
+    "npv_irr_calculations": 200,
+    "portfolio": 200,
+    "runner": 250,
+    "pipeline": 200,
+}
+
+
+def synthetic_portfolio(n_units, cashflow_term=60, seed=0):
+    '''function to build a reproducible portfolio table of n_units leases with a spread of lease events'''
+
+    rng = np.random.default_rng(seed)
+    cashflow_start = date(2025, 1, 1)
+    lease_termination = [add_months(cashflow_start, int(m)) for m in rng.integers(1, cashflow_term, n_units)]
+    review_date = [add_months(lt, -int(m)) for lt, m in zip(lease_termination, rng.integers(0, 36, n_units))]
+    unit_area = rng.integers(1000, 20000, n_units).astype(float)
+    return pd.DataFrame({
+        "cashflow_start": [cashflow_start] * n_units,
+        "cashflow_term": np.full(n_units, cashflow_term),
+        "unit_area": unit_area,
+        "lease_start": [date(2020, 1, 1)] * n_units,
+        "current_rent": unit_area * rng.uniform(10, 25, n_units),
+        "review_date": review_date,
+        "lease_termination": lease_termination,
+        "headline_erv": rng.uniform(15, 30, n_units).round(2),
+        "ner_discount": rng.choice([0.6, 0.7, 0.8, 1.0], n_units),
+        "refurb_cost": rng.choice([0.0, 10.0, 20.0], n_units),
+        "refurb_duration": rng.integers(0, 6, n_units),
+        "void_period": rng.integers(0, 18, n_units),
+        "rf": rng.integers(0, 12, n_units),
+        "relet_term": np.full(n_units, 5),
+        "exit_cap": np.full(n_units, 0.06),
+        "vacant_rates_percent": np.full(n_units, 0.5),
+        "rates_relief": np.full(n_units, 3),
+        "vacant_sc": np.full(n_units, 2.0),
+        "entry_price": unit_area * 150,
+        "exit_price": unit_area * 180,
+    })
+
+
+def synthetic_leases(n_units, cashflow_term=60, chunk_size=1000):
+    '''function to generate n_units synthetic leases one dict at a time, building only chunk_size of them at once'''
+
+    for seed, start in enumerate(range(0, n_units, chunk_size)):
+        yield from synthetic_portfolio(min(chunk_size, n_units - start), cashflow_term, seed).to_dict("records")
+
+
+def loop_portfolio(leases, discount_rate):
+    '''function to value a portfolio the old way, calling create_cashflow once per unit'''
+
+    irr, npv = [], []
+    for lease in leases.to_dict("records"):
+        cashflow = create_cashflow(**lease)
+        irr.append(calculate_irr(cashflow['period_start'], cashflow['cashflow']))
+        npv.append(calculate_npv(discount_rate, cashflow['period_start'], cashflow['cashflow']))
+    return np.array(irr), np.array(npv)
+
+
+def benchmark_portfolio(n_units, cashflow_term=60, discount_rate=0.1, loop_units=200):
+    '''function to time create_portfolio_cashflows against the per-unit loop, returning throughput in units/second.
+    The loop is only timed on the first loop_units units as it is slow.'''
+
+    leases = synthetic_portfolio(n_units, cashflow_term)
+
+    t0 = time.perf_counter()
+    create_portfolio_cashflows(leases, discount_rate)
+    batch_seconds = time.perf_counter() - t0
+
+    sample = leases.iloc[:loop_units]
+    t0 = time.perf_counter()
+    loop_portfolio(sample, discount_rate)
+    loop_seconds = time.perf_counter() - t0
+
+    return {
+        "units": n_units,
+        "cashflow_term": cashflow_term,
+        "batch_units_per_second": n_units / batch_seconds,
+        "loop_units_per_second": len(sample) / loop_seconds,
+    }
+
+
+def benchmark_runner(n_units, worker_counts=(1, 2, 4, 8), cashflow_term=120, chunk_size=250, discount_rate=0.1):
+    '''function to time run_portfolio over a range of worker counts, returning throughput in units/second per count'''
+
+    leases = synthetic_portfolio(n_units, cashflow_term)
+    results = {}
+    for workers in worker_counts:
+        t0 = time.perf_counter()
+        run_portfolio(leases, discount_rate, workers=workers, chunk_size=chunk_size)
+        results[workers] = n_units / (time.perf_counter() - t0)
+    return results
+
+
+def peak_rss_mb(n_units, streaming, cashflow_term=300, discount_rate=0.1):
+    '''function to value n_units synthetic leases and return the process's peak RSS in MB, either streamed through
+    stream_portfolio or as one create_portfolio_cashflows batch. Run in a fresh process per measurement.'''
+
+    if streaming:
+        stream_portfolio(synthetic_leases(n_units, cashflow_term), discount_rate).irr()
+    else:
+        create_portfolio_cashflows(synthetic_portfolio(n_units, cashflow_term), discount_rate)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def benchmark_streaming_memory(unit_counts=(1000, 10000, 50000), cashflow_term=300):
+    '''function to measure the peak RSS of streaming vs batch valuation over a range of portfolio sizes, each in a
+    fresh process so the peaks don't carry over. Streaming should stay flat as the unit count grows.'''
+
+    results = {}
+    for n_units in unit_counts:
+        for streaming in [True, False]:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                results[(n_units, "streaming" if streaming else "batch")] = pool.submit(
+                    peak_rss_mb, n_units, streaming, cashflow_term).result()
+    return results
+
+
+def example_lease(cashflow_term=60, quarterly_in_advance=True):
+    '''function to return the create_cashflow inputs of the example unit used by the __main__ blocks'''
+
+    return dict(
+        cashflow_start=date(2025, 1, 1),
+        cashflow_term=cashflow_term,
+        unit_area=10000,
+        lease_start=date(2020, 1, 1),
+        current_rent=50000,
+        review_date=date(2025, 7, 31),
+        lease_termination=date(2025, 12, 31),
+        headline_erv=20,
+        ner_discount=0.70,
+        refurb_cost=20,
+        refurb_duration=3,
+        void_period=12,
+        rf=8,
+        relet_term=6,
+        exit_cap=0.06,
+        vacant_rates_percent=0.5,
+        rates_relief=3,
+        vacant_sc=2,
+        entry_price=1000000,
+        exit_price=2000000,
+        quarterly_in_advance=quarterly_in_advance)
+
+
+def benchmark_cases():
+    '''function to build the benchmark suite, a dict of case name -> function to time. Inputs are built here so
+    only the call itself is timed.'''
+
+    cases = {}
+    for term in [60, 120, 300]:
+        for quarterly in [True, False]:
+            lease = example_lease(term, quarterly)
+            cases[f"create_cashflow[{term}m,{'quarterly' if quarterly else 'monthly'}]"] = lambda lease=lease: create_cashflow(**lease)
+        cashflow = create_cashflow(**example_lease(term))
+        dates, flows = cashflow["period_start"], cashflow["cashflow"]
+        cases[f"calculate_irr[{term}m]"] = lambda dates=dates, flows=flows: calculate_irr(dates, flows)
+        cases[f"calculate_npv[{term}m]"] = lambda dates=dates, flows=flows: calculate_npv(0.1, dates, flows)
+        lease = Lease(**example_lease(term))
+        cases[f"segments_npv[{term}m]"] = lambda lease=lease: segments_npv(cashflow_segments(lease), 0.1)
+
+    # The YP functions over 100 valuation dates, as the date helpers are cached
+    valuation_dates = [add_months(date(2024, 1, 1), months) for months in range(100)]
+    review, termination = date(2029, 6, 7), date(2034, 5, 27)
+    cases["rent_yp[100 dates]"] = lambda: [rent_yp(0.0705, start, review, termination) for start in valuation_dates]
+    cases["rent_review_yp[100 dates]"] = lambda: [
+        rent_review_yp(0.0705, start, date(2019, 6, 7), review, termination, 0, 0, 0, 12) for start in valuation_dates]
+    cases["reversion_yp[100 dates]"] = lambda: [
+        reversion_yp(0.0705, start, date(2019, 6, 7), review, termination, 0, 0, 0, 12) for start in valuation_dates]
+
+    for n_units in [100, 1000, 10000]:
+        leases = synthetic_portfolio(n_units, cashflow_term=120)
+        cases[f"create_portfolio_cashflows[{n_units} units]"] = lambda leases=leases: create_portfolio_cashflows(leases, 0.1)
+    return cases
+
+
+def measure(function, min_seconds=0.2, repeat=5):
+    '''function to time one benchmark case, returning the best and median seconds per call over repeat rounds
+    (each round long enough to last min_seconds), and the peak memory traced during a single call in MB'''
+
+    function()  # warm up
+    t0 = time.perf_counter()
+    function()
+    calls = max(1, int(min_seconds / max(time.perf_counter() - t0, 1e-9)))
+    rounds = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(calls):
+            function()
+        rounds.append((time.perf_counter() - t0) / calls)
+
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"min_seconds": min(rounds), "median_seconds": float(np.median(rounds)), "peak_mb": peak / 2 ** 20}
+
+
+def run_suite(cases=None, pattern=None):
+    '''function to run the benchmark suite (or the cases whose name contains pattern), returning case -> measure'''
+
+    cases = benchmark_cases() if cases is None else cases
+    return {name: measure(function) for name, function in cases.items() if pattern is None or pattern in name}
+
+
+def save_baseline(results, path=BASELINE_PATH):
+    with open(path, "w") as file:
+        json.dump({"machine": platform.platform(), "python": platform.python_version(), "results": results}, file, indent=2)
+
+
+def compare_to_baseline(results, path=BASELINE_PATH, tolerance=0.25):
+    '''function to compare benchmark results against the saved baseline, returning the regressions: cases whose
+    best time or peak memory is more than tolerance (a fraction) above the baseline, and cases missing from the
+    baseline (mapped to None), which can't be checked until it's saved again'''
+
+    with open(path) as file:
+        baseline = json.load(file)["results"]
+    regressions = {}
+    for name, result in results.items():
+        if name not in baseline:
+            regressions[name] = None
+            continue
+        for metric in ["min_seconds", "peak_mb"]:
+            before, after = baseline[name][metric], result[metric]
+            if after > before * (1 + tolerance) and after - before > (1e-6 if metric == "min_seconds" else 0.1):
+                regressions[f"{name} {metric}"] = (before, after)
+    return regressions
+
+
+def import_time_ms(module, runs=5):
+    '''function to time a cold import of module in a fresh interpreter (as a new pool worker or CLI job would),
+    returning the best of runs in ms and whether pandas was imported along the way'''
+
+    code = (
+        "import sys, time; t0 = time.perf_counter(); import " + module + "; "
+        "print((time.perf_counter() - t0) * 1e3, 'pandas' in sys.modules)"
+    )
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                capture_output=True, text=True, check=True).stdout.split()
+        timings.append(float(output[0]))
+    return min(timings), output[1] == "True"
+
+
+def check_import_times(targets=IMPORT_TARGETS_MS, runs=5):
+    '''function to time the cold import of each module in targets, returning module -> (ms, target ms, pandas imported)'''
+
+    return {module: (*import_time_ms(module, runs), target) for module, target in targets.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for the cashflow and valuation functions")
+    parser.add_argument("--suite", action="store_true", help="run the benchmark suite and print the results")
+    parser.add_argument("--save", action="store_true", help="run the suite and save it as the baseline")
+    parser.add_argument("--check", action="store_true", help="run the suite and fail on regressions against the baseline")
+    parser.add_argument("-k", dest="pattern", help="only run the suite cases whose name contains this")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown/memory growth, as a fraction")
+    parser.add_argument("--imports", action="store_true", help="time cold imports and fail if any is over its target")
+    args = parser.parse_args()
+
+    if args.imports:
+        results = check_import_times()
+        for module, (ms, pandas_loaded, target) in results.items():
+            print(f"{module:<25} {ms:>8.1f} ms (target {target} ms){'  [imports pandas]' if pandas_loaded else ''}")
+        raise SystemExit(1 if any(ms > target for ms, _, target in results.values()) else 0)
+
+    if not (args.suite or args.save or args.check):
+        for n_units in [100, 1000, 8000]:
+            result = benchmark_portfolio(n_units)
+            print(f"{n_units:>6} units: batch {result['batch_units_per_second']:>10,.0f} units/s, "
+                  f"loop {result['loop_units_per_second']:>8,.0f} units/s")
+        for workers, units_per_second in benchmark_runner(20000).items():
+            print(f"{workers:>2} workers: {units_per_second:>10,.0f} units/s")
+        for (n_units, mode), peak in benchmark_streaming_memory().items():
+            print(f"{n_units:>6} units {mode:>9}: peak RSS {peak:>8,.0f} MB")
+        return
+
+    results = run_suite(pattern=args.pattern)
+    for name, result in results.items():
+        print(f"{name:<45} {result['min_seconds'] * 1e3:>10.3f} ms {result['peak_mb']:>9.2f} MB")
+    if args.save:
+        save_baseline(results)
+        print(f"Saved baseline to {BASELINE_PATH}")
+    if args.check:
+        regressions = compare_to_baseline(results, tolerance=args.tolerance)
+        for name, change in regressions.items():
+            if change is None:
+                print(f"MISSING {name}: not in the baseline, save it again with --save")
+            else:
+                print(f"REGRESSION {name}: {change[0]:.6g} -> {change[1]:.6g}")
+        raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+from lease import DATE_FIELDS
+from npv_irr_calculations import CATEGORIES
+from portfolio import create_portfolio_cashflows
+
+# Output schemas: one row per unit per month for the cashflows, and one row per unit for the metrics
+CASHFLOW_SCHEMA = pa.schema(
+    [
+        ("unit_id", pa.int64()),
+        ("month", pa.int32()),
+        ("period_start", pa.date32()),
+        ("category", pa.dictionary(pa.int8(), pa.string())),
+        ("cashflow", pa.float64()),
+    ]
+    + [(cat, pa.float64()) for cat in CATEGORIES + ["total_rent"]]
+)
+METRICS_SCHEMA = pa.schema([
+    ("unit_id", pa.int64()),
+    ("entry_date", pa.date32()),
+    ("entry_cashflow", pa.float64()),
+    ("exit_date", pa.date32()),
+    ("exit_cashflow", pa.float64()),
+    ("irr", pa.float64()),
+    ("npv", pa.float64()),
+])
+
+
+def lease_batches(path, batch_size=10000):
+    '''function to stream a lease schedule from a Parquet or CSV file (one row per unit, with the create_cashflow
+    parameters as columns and an optional unit_id) as dicts of NumPy arrays of at most batch_size units, ready
+    for portfolio_cashflow_matrix. Only one batch is held in memory at a time.'''
+
+    path = str(path)
+    if path.endswith(".parquet"):
+        batches = pq.ParquetFile(path).iter_batches(batch_size=batch_size)
+    elif path.endswith(".csv"):
+        # Dates are read as dates rather than timestamps and empty cells as missing, block_size bounds the rows
+        # held per batch
+        convert_options = pa_csv.ConvertOptions(
+            column_types={field: pa.date32() for field in DATE_FIELDS}, strings_can_be_null=True)
+        read_options = pa_csv.ReadOptions(block_size=1 << 22)
+        batches = _rebatch(pa_csv.open_csv(path, read_options=read_options, convert_options=convert_options), batch_size)
+    else:
+        raise ValueError(f"Expected a .parquet or .csv lease schedule, got '{path}'")
+
+    first_unit = 0
+    for batch in batches:
+        columns = {name: column.to_numpy(zero_copy_only=False) for name, column in zip(batch.schema.names, batch.columns)}
+        if "unit_id" not in columns:
+            columns["unit_id"] = np.arange(first_unit, first_unit + batch.num_rows)
+        first_unit += batch.num_rows
+        yield columns
+
+
+def _rebatch(reader, batch_size):
+    '''function to re-chunk a stream of record batches into batches of batch_size rows'''
+
+    pending, pending_rows = [], 0
+    for batch in reader:
+        pending.append(batch)
+        pending_rows += batch.num_rows
+        while pending_rows >= batch_size:
+            table = pa.Table.from_batches(pending)
+            yield from table.slice(0, batch_size).to_batches(max_chunksize=batch_size)
+            rest = table.slice(batch_size)
+            pending, pending_rows = rest.to_batches(), rest.num_rows
+    if pending_rows:
+        yield from pa.Table.from_batches(pending).to_batches(max_chunksize=pending_rows)
+
+
+def cashflow_record_batch(unit_id, result):
+    '''function to flatten portfolio_cashflow_matrix output to one row per unit per month (dropping the padding
+    after each unit's term) as a record batch in CASHFLOW_SCHEMA'''
+
+    valid = np.arange(result["cashflow"].shape[1]) < result["term"][:, None]
+    unit_index, month = np.nonzero(valid)
+    category = result["category"][valid]
+    arrays = [
+        pa.array(np.asarray(unit_id)[unit_index], pa.int64()),
+        pa.array(month + 1, pa.int32()),
+        pa.array(result["period_start"][valid], pa.date32()),
+        pa.DictionaryArray.from_arrays(
+            pa.array(category, pa.int8(), mask=category < 0), pa.array(CATEGORIES, pa.string())),
+        pa.array(result["cashflow"][valid], pa.float64()),
+    ] + [pa.array(result["components"][cat][valid], pa.float64()) for cat in CATEGORIES + ["total_rent"]]
+    return pa.RecordBatch.from_arrays(arrays, schema=CASHFLOW_SCHEMA)
+
+
+def metrics_record_batch(unit_id, result):
+    '''function to build the per-unit entry/exit rows, IRR and NPV as a record batch in METRICS_SCHEMA'''
+
+    return pa.RecordBatch.from_arrays([
+        pa.array(np.asarray(unit_id), pa.int64()),
+        pa.array(result["entry_date"], pa.date32()),
+        pa.array(result["entry_cashflow"], pa.float64()),
+        pa.array(result["exit_date"], pa.date32()),
+        pa.array(result["exit_cashflow"], pa.float64()),
+        pa.array(result["irr"], pa.float64()),
+        pa.array(result["npv"], pa.float64()),
+    ], schema=METRICS_SCHEMA)
+
+
+def revalue_file(leases_path, metrics_path, cashflows_path=None, discount_rate=0.1, batch_size=10000):
+    '''Revalue a portfolio lease schedule file batch by batch, writing each batch's results to Parquet as a row
+    group before reading the next, so memory is bounded by batch_size rather than the size of the portfolio.
+
+    Parameters:
+        leases_path: .parquet or .csv lease schedule, see lease_batches.
+        metrics_path: Parquet file for the per-unit IRR, NPV and entry/exit rows (METRICS_SCHEMA).
+        cashflows_path: Optional; Parquet file for the units x months cashflows, one row per unit per month
+            (CASHFLOW_SCHEMA). Skipped if None, as it's by far the larger output.
+        discount_rate: discount rate for the NPVs.
+
+    Returns the number of units and cashflow rows written.
+    '''
+    units = rows = 0
+    metrics_writer = pq.ParquetWriter(str(metrics_path), METRICS_SCHEMA)
+    cashflow_writer = pq.ParquetWriter(str(cashflows_path), CASHFLOW_SCHEMA) if cashflows_path is not None else None
+    try:
+        for leases in lease_batches(leases_path, batch_size):
+            result = create_portfolio_cashflows(leases, discount_rate)
+
+            metrics_writer.write_batch(metrics_record_batch(leases["unit_id"], result))
+            if cashflow_writer is not None:
+                cashflows = cashflow_record_batch(leases["unit_id"], result)
+                cashflow_writer.write_batch(cashflows)
+                rows += cashflows.num_rows
+            units += len(leases["unit_id"])
+    finally:
+        metrics_writer.close()
+        if cashflow_writer is not None:
+            cashflow_writer.close()
+    return {"units": units, "cashflow_rows": rows}
+
+
+def write_leases(leases, path):
+    '''function to write a portfolio table (e.g. a DataFrame) to a Parquet or CSV lease schedule'''
+
+    table = pa.Table.from_pandas(leases, preserve_index=False)
+    if str(path).endswith(".csv"):
+        pa_csv.write_csv(table, str(path))
+    else:
+        pq.write_table(table, str(path))
+
+
+if __name__ == "__main__":
+    import os
+    import resource
+    import tempfile
+    import time
+
+    from benchmarks import synthetic_portfolio
+
+    with tempfile.TemporaryDirectory() as folder:
+        leases_path = os.path.join(folder, "leases.parquet")
+        write_leases(synthetic_portfolio(200000, cashflow_term=120), leases_path)
+        t0 = time.perf_counter()
+        summary = revalue_file(leases_path, os.path.join(folder, "metrics.parquet"), os.path.join(folder, "cashflows.parquet"))
+        elapsed = time.perf_counter() - t0
+        print(f"{summary['units']:,} units, {summary['cashflow_rows']:,} cashflow rows in {elapsed:.1f}s")
+        print(f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
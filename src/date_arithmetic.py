@@ -0,0 +1,72 @@
+import calendar
+from functools import lru_cache
+
+import numpy as np
+
+# Maximum number of (date, offset) results held by each cached helper, least recently used are evicted first
+DATE_CACHE_SIZE = 65536
+DAYS_IN_YEAR = 365.25
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def add_months(d, months):
+    # Simple function to add months to a date
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    day = min(d.day, calendar.monthrange(year, month)[1])
+    return d.replace(year=year, month=month, day=day)
+
+
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def years_between(start, end):
+    '''function to calculate the years from start to end (actual days / 365.25), negative if end is before start'''
+
+    return (end - start).days / DAYS_IN_YEAR
+
+
+CACHED_FUNCTIONS = [add_months, years_between]
+
+
+def cache_stats():
+    '''function to report the hits, misses and size of each cached date helper, e.g. to check the hit rate after a run'''
+
+    stats = {}
+    for function in CACHED_FUNCTIONS:
+        info = function.cache_info()
+        lookups = info.hits + info.misses
+        stats[function.__name__] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+            "hit_rate": info.hits / lookups if lookups else 0.0,
+        }
+    return stats
+
+
+def clear_cache():
+    '''function to empty the date caches and reset their statistics'''
+
+    for function in CACHED_FUNCTIONS:
+        function.cache_clear()
+
+
+def add_months_array(d, months):
+    '''Array version of add_months, d is a datetime64[D] array (or scalar) and months an integer array (or scalar).
+    The day of month is clamped to the length of the target month in the same way as add_months.'''
+    d = np.asarray(d, dtype="datetime64[D]")
+    start_month = d.astype("datetime64[M]")
+    day = (d - start_month.astype("datetime64[D]")).astype(np.int64) + 1
+    target_month = start_month + np.asarray(months, dtype=np.int64)
+    target_first = target_month.astype("datetime64[D]")
+    month_length = ((target_month + 1).astype("datetime64[D]") - target_first).astype(np.int64)
+    return target_first + (np.minimum(day, month_length) - 1)
+
+
+def years_between_array(start, end):
+    '''Array version of years_between for datetime64[D] arrays (or scalars) that broadcast against each other'''
+
+    start = np.asarray(start, dtype="datetime64[D]")
+    end = np.asarray(end, dtype="datetime64[D]")
+    return (end - start).astype(np.int64) / DAYS_IN_YEAR
@@ -0,0 +1,93 @@
+import numpy as np
+
+from batch_xirr import xirr_batch, xnpv_batch
+from npv_irr_calculations import CATEGORIES
+
+FUND_COLUMNS = ["cashflow"] + CATEGORIES + ["total_rent"]
+
+
+def month_offsets(start_months, origin=None):
+    '''function to map each unit's first month onto a common datetime64[M] axis, returning the axis origin and each
+    unit's integer offset from it (its first month's position on the axis)'''
+
+    start_months = np.asarray(start_months, dtype="datetime64[M]")
+    if origin is None:
+        origin = start_months.min()
+    return origin, (start_months - origin).astype(np.int64)
+
+
+def fund_cashflow(result):
+    '''Aggregate the units of a portfolio_cashflow_matrix result into a fund cashflow on a shared monthly axis.
+    Every unit's months are placed on the axis by integer offset (the unit's first month minus the axis origin)
+    and summed with one bincount per column, so no dates are compared or joined.
+
+    Entry and exit rows sit a day off each unit's grid, so they are kept in their own entry/exit columns on the
+    month of the unit's first period and the month after its last period respectively (see fund_metrics).
+
+    Returns a dict of:
+        months: datetime64[M] axis, from the earliest unit start to the latest exit
+        entry, exit: entry and exit cashflows per month
+        cashflow, each category, total_rent: monthly totals of all units
+        units: number of units aggregated
+    '''
+    term = result["term"]
+    first_month = result["entry_date"] + np.timedelta64(1, "D")
+    origin, offsets = month_offsets(first_month)
+    n_months = int((offsets + term).max()) + 1 if len(term) else 0
+
+    # Flat position of every unit month on the axis, padding months (beyond the unit's term) dropped
+    valid = np.arange(result["cashflow"].shape[1]) < term[:, None]
+    position = (offsets[:, None] + np.arange(result["cashflow"].shape[1]))[valid]
+    columns = {"cashflow": result["cashflow"], **result["components"]}
+    fund = {"months": origin + np.arange(n_months)}
+    fund["entry"] = np.bincount(offsets, weights=result["entry_cashflow"], minlength=n_months)
+    for name in FUND_COLUMNS:
+        fund[name] = np.bincount(position, weights=columns[name][valid], minlength=n_months)
+    fund["exit"] = np.bincount(offsets + term, weights=result["exit_cashflow"], minlength=n_months)
+    fund["units"] = len(term)
+    return fund
+
+
+def fund_cashflow_from_units(cashflows):
+    '''function to aggregate a list of single-unit create_cashflow results (DataFrames or output="arrays" dicts)
+    onto a shared monthly axis, as fund_cashflow does for a portfolio batch'''
+
+    terms = np.array([len(cashflow["cashflow"]) - 2 for cashflow in cashflows], dtype=np.int64)
+    width = terms.max() if len(terms) else 0
+    padded = lambda column: np.array([
+        np.pad(np.asarray(cashflow[column], dtype=float)[1:-1], (0, width - term))
+        for cashflow, term in zip(cashflows, terms)
+    ]).reshape(len(cashflows), width)
+    edge = lambda column, row: np.array([np.asarray(cashflow[column])[row] for cashflow in cashflows])
+
+    result = {
+        "term": terms,
+        "cashflow": padded("cashflow"),
+        "components": {cat: padded(cat) for cat in CATEGORIES + ["total_rent"]},
+        "entry_date": edge("period_start", 0).astype("datetime64[D]"),
+        "entry_cashflow": edge("cashflow", 0).astype(float),
+        "exit_cashflow": edge("cashflow", -1).astype(float),
+    }
+    return fund_cashflow(result)
+
+
+def fund_series(fund):
+    '''function to turn a fund cashflow into dated net cashflows for the IRR and NPV. Each month's cashflow and exits
+    are dated on the 1st and its entries the day before, which are the exact dates for units starting on the 1st of
+    a month (the usual case); units starting mid-month are moved to the 1st.'''
+
+    month_start = fund["months"].astype("datetime64[D]")
+    dates = np.concatenate([month_start - 1, month_start])
+    flows = np.concatenate([fund["entry"], fund["cashflow"] + fund["exit"]])
+    order = np.argsort(dates, kind="stable")
+    keep = flows[order] != 0
+    return dates[order][keep], flows[order][keep]
+
+
+def fund_metrics(fund, discount_rate):
+    '''function to calculate the fund IRR and NPV (discounted to the fund's first cashflow) from a fund cashflow'''
+
+    dates, flows = fund_series(fund)
+    if not len(flows):
+        return {"irr": np.nan, "npv": 0.0}
+    return {"irr": float(xirr_batch(dates, flows)), "npv": float(xnpv_batch(discount_rate, dates, flows))}
@@ -0,0 +1,154 @@
+import numpy as np
+
+from batch_xirr import xirr_batch, xnpv_rows, year_fractions
+from lease import LeaseArray
+from npv_irr_calculations import initial_yield_valuation
+from portfolio import exit_rent, portfolio_cashflow_matrix, unit_cashflow_series
+
+# Inputs goal_seek can solve for. Entry and exit price (and exit cap, through the exit price) only move the entry and
+# exit rows, so they're solved analytically on the generated cashflow. ERV moves the monthly rows, so it's solved
+# with a bracketed root finder.
+SOLVE_FOR = ["entry_price", "exit_price", "exit_cap", "headline_erv"]
+
+
+def goal_seek(leases, solve_for, target_irr=None, target_npv=None, discount_rate=None, bracket=None, xtol=1e-6, max_iter=100):
+    '''Solve, for every unit of a portfolio at once, the entry price, exit price, exit cap or ERV that gives a target
+    IRR or NPV, e.g. "what can we pay for a 12% IRR?":
+        goal_seek(leases, "entry_price", target_irr=0.12)
+
+    A target IRR is the rate at which the NPV is 0, so both targets solve NPV(rate) = target, where rate is
+    target_irr (target 0) or discount_rate (target target_npv).
+
+    Parameters:
+        leases: a LeaseArray or portfolio table, as for create_portfolio_cashflows. Units without an exit_price
+            (None/NaN) have it valued on their exit rent and exit_cap, so exit_cap and ERV feed through to it.
+        solve_for: one of SOLVE_FOR.
+        target_irr, target_npv: the target, a single value or one per unit. Give one of them.
+        discount_rate: discount rate for a target_npv, a single rate or one per unit.
+        bracket: Optional; (low, high) headline_erv range to search when solving for ERV, single values or one per
+            unit. Defaults to 0 to 4x each unit's headline_erv, doubled until the target is inside it.
+        xtol, max_iter: convergence tolerance on the ERV and the iteration limit of the root finder.
+
+    Returns a dict of per unit arrays:
+        value: the solved input (NaN where the target can't be reached, e.g. a negative exit price for exit_cap)
+        irr: IRR of the unit with the solved input (NaN where it isn't solved)
+        npv: NPV at the target's rate with the solved input (about 0 for a target IRR, NaN where it isn't solved)
+    Exit prices valued on the exit rent are rounded to the nearest 10,000 (see initial_yield_valuation), so irr and
+    npv show how close the rounded exit gets: the exit cap is solved on the unrounded exit value, and where the
+    rounded exit steps past the target as the ERV changes, the ERV at the step is returned.
+    '''
+    if solve_for not in SOLVE_FOR:
+        raise ValueError(f"solve_for must be one of {SOLVE_FOR}, got '{solve_for}'")
+    if (target_irr is None) == (target_npv is None):
+        raise ValueError("Give one of target_irr or target_npv")
+    if target_npv is not None and discount_rate is None:
+        raise ValueError("A target_npv needs a discount_rate")
+    if not isinstance(leases, LeaseArray):
+        leases = LeaseArray(leases)
+    n_units = len(leases)
+    rate = np.broadcast_to(np.asarray(target_irr if target_npv is None else discount_rate, dtype=float), (n_units,))
+    target = np.broadcast_to(np.asarray(0.0 if target_npv is None else target_npv, dtype=float), (n_units,))
+
+    if solve_for == "headline_erv":
+        value, result = _solve_erv(leases, rate, target, bracket, xtol, max_iter)
+        dates, flows = unit_cashflow_series(result)
+    else:
+        result = portfolio_cashflow_matrix(leases)
+        dates, flows = unit_cashflow_series(result)
+        npv = xnpv_rows(rate, dates, flows)
+        flows = flows.copy()
+        if solve_for == "entry_price":
+            # The entry row is the first cashflow, so it isn't discounted
+            value = leases["entry_price"] + npv - target
+            flows[:, 0] = -value
+        else:
+            exit_discount = np.exp(-year_fractions(dates)[:, -1] * np.log1p(rate))
+            required_exit = result["exit_cashflow"] + (target - npv) / exit_discount
+            if solve_for == "exit_price":
+                value = required_exit
+                flows[:, -1] = value
+            else:
+                rent = exit_rent(result)
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    value = np.where((required_exit > 0) & (rent > 0), rent / (required_exit * (1 + leases["purchasers_costs"])), np.nan)
+                flows[:, -1] = np.where(np.isnan(value), flows[:, -1], initial_yield_valuation(rent, value, leases["purchasers_costs"]))
+
+    solved = ~np.isnan(value)
+    return {
+        "value": value,
+        "irr": np.where(solved, xirr_batch(dates, flows), np.nan),
+        "npv": np.where(solved, xnpv_rows(rate, dates, flows), np.nan),
+    }
+
+
+def _solve_erv(leases, rate, target, bracket, xtol, max_iter):
+    '''function to solve each unit's headline_erv for NPV(rate) = target with a vectorised Illinois (modified
+    regula falsi) root finder, regenerating the cashflows of the units that haven't converged on each iteration.
+    Returns the solved ERVs and the portfolio_cashflow_matrix result at them.'''
+
+    def gap(units, erv):
+        result = portfolio_cashflow_matrix(leases[units].replace(headline_erv=erv))
+        dates, flows = unit_cashflow_series(result)
+        return xnpv_rows(rate[units], dates, flows) - target[units]
+
+    n_units = len(leases)
+    every_unit = np.arange(n_units)
+    if bracket is None:
+        lo, hi = np.zeros(n_units), 4 * leases["headline_erv"]
+    else:
+        lo, hi = (np.broadcast_to(np.asarray(bound, dtype=float), (n_units,)).copy() for bound in bracket)
+    hi = np.where(hi > lo, hi, lo + 1.0)
+    f_lo, f_hi = gap(every_unit, lo), gap(every_unit, hi)
+
+    # Widen the top of the bracket until the target is inside it
+    for _ in range(10):
+        outside = np.flatnonzero(np.signbit(f_lo) == np.signbit(f_hi))
+        if not len(outside):
+            break
+        hi[outside] = lo[outside] + 2 * (hi[outside] - lo[outside])
+        f_hi[outside] = gap(outside, hi[outside])
+    found = np.signbit(f_lo) != np.signbit(f_hi)
+    value = np.where(f_lo == 0, lo, np.where(f_hi == 0, hi, np.nan))
+
+    active = found & (f_lo != 0) & (f_hi != 0)
+    side = np.zeros(n_units, dtype=np.int8)  # the end of the bracket kept on the last iteration, -1 low, 1 high
+    for _ in range(max_iter):
+        units = np.flatnonzero(active)
+        if not len(units):
+            break
+        x = (lo[units] * f_hi[units] - hi[units] * f_lo[units]) / (f_hi[units] - f_lo[units])
+        f_x = gap(units, x)
+        low_side = np.signbit(f_x) == np.signbit(f_lo[units])
+        # Move the end on the same side as x, and halve the other end's value if it was kept last time too
+        keep_hi, keep_lo = low_side & (side[units] == 1), ~low_side & (side[units] == -1)
+        f_hi[units[keep_hi]] /= 2
+        f_lo[units[keep_lo]] /= 2
+        lo[units[low_side]], f_lo[units[low_side]] = x[low_side], f_x[low_side]
+        hi[units[~low_side]], f_hi[units[~low_side]] = x[~low_side], f_x[~low_side]
+        side[units] = np.where(low_side, 1, -1)
+
+        done = (f_x == 0) | (hi[units] - lo[units] <= xtol * np.maximum(1.0, np.abs(x)))
+        value[units] = np.where(done, x, value[units])
+        active[units[done]] = False
+
+    # Units that ran out of iterations take the end of their bracket nearest the target
+    unfinished = np.flatnonzero(active)
+    value[unfinished] = np.where(np.abs(f_lo[unfinished]) <= np.abs(f_hi[unfinished]), lo[unfinished], hi[unfinished])
+    solved = ~np.isnan(value)
+    result = portfolio_cashflow_matrix(leases.replace(headline_erv=np.where(solved, value, leases["headline_erv"])))
+    return value, result
+
+
+if __name__ == "__main__":
+    import time
+
+    from benchmarks import synthetic_portfolio
+
+    # Exit prices valued on the exit rent, so that the exit cap and ERV feed through to them
+    leases = LeaseArray(synthetic_portfolio(10000, cashflow_term=120)).replace(exit_price=np.nan)
+    for solve_for in SOLVE_FOR:
+        t0 = time.perf_counter()
+        solved = goal_seek(leases, solve_for, target_irr=0.12)
+        elapsed = time.perf_counter() - t0
+        hit = np.nanmax(np.abs(solved["irr"] - 0.12))
+        print(f"{solve_for:<13} 10,000 units in {elapsed:.2f}s, max |irr - 12%| {hit:.2e}, unsolved {np.isnan(solved['value']).sum()}")
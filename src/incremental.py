@@ -0,0 +1,247 @@
+import inspect
+
+import numpy as np
+
+from batch_xirr import xirr_batch, xnpv_batch
+from npv_irr_calculations import (
+    CATEGORIES,
+    annual_exit_rent,
+    cashflow_components,
+    cashflow_dataframe,
+    create_cashflow,
+    initial_yield_valuation,
+    lease_phase_dates,
+    month_grid,
+    valuation_timeseries,
+)
+from rent_timing import payment_groups, retime_rent
+
+# The phase boundary from which each input changes the monthly cashflow, months before it are unaffected
+# (cashflow_start means every month). A change is recomputed from the earlier of the old and new boundary.
+INPUT_BOUNDARIES = {
+    "unit_area": ["cashflow_start"],
+    "current_rent": ["cashflow_start"],
+    "review_date": ["review_date"],
+    "ner_discount": ["review_date"],
+    "headline_erv": ["review_date", "lease_termination"],
+    "lease_termination": ["review_date", "lease_termination"],
+    "refurb_cost": ["lease_termination"],
+    "refurb_duration": ["lease_termination"],
+    "void_period": ["refurb_end"],
+    "vacant_rates_percent": ["refurb_end"],
+    "rates_relief": ["refurb_end"],
+    "vacant_sc": ["refurb_end"],
+    "rf": ["void_end"],
+    "relet_rent": ["void_end", "relet_date"],
+}
+# Inputs that change the month grid or the payment dates, so everything is regenerated
+GRID_INPUTS = ["cashflow_start", "cashflow_term", "quarterly_in_advance", "rent_convention"]
+# Every create_cashflow input with its default (if any), the lease's inputs are checked against these
+CASHFLOW_DEFAULTS = {
+    name: parameter.default
+    for name, parameter in inspect.signature(create_cashflow).parameters.items() if name != "output"
+}
+
+
+class IncrementalCashflow:
+    '''A unit's cashflow that can be updated in place for interactive what-if sessions. The phase boundaries
+    (review_date, lease_termination, refurb_end, void_end, rf_end, relet_date) are kept, so an update only
+    recomputes the months from the earliest boundary the changed inputs affect (see INPUT_BOUNDARIES), re-times
+    the rent from the payment period containing that month, and patches the cached arrays and IRR.
+
+    Takes the same inputs as create_cashflow, e.g.
+        cashflow = IncrementalCashflow(**inputs)
+        cashflow.update(rf=6)
+        cashflow.irr, cashflow.arrays()
+    '''
+
+    def __init__(self, **inputs):
+        self.inputs = {}
+        self.phases = None
+        self.flows = None
+        self._irr = None
+        self._previous_irr = 0.1
+        self.update(**inputs)
+
+    def update(self, **changes):
+        '''function to apply changed inputs and recompute only the months they affect, returning self.
+        last_update records the first recomputed month (None when only the entry/exit rows changed).'''
+
+        unknown = set(changes) - set(CASHFLOW_DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown cashflow inputs: {sorted(unknown)}")
+        changed = {name: value for name, value in changes.items()
+                   if name not in self.inputs or not _same_value(self.inputs[name], value)}
+        previous_phases = self.phases
+        self.inputs.update(changed)
+        missing = [name for name, default in CASHFLOW_DEFAULTS.items()
+                   if name not in self.inputs and default is inspect.Parameter.empty]
+        if missing:
+            raise TypeError(f"Missing cashflow inputs: {missing}")
+        self.inputs = dict({name: default for name, default in CASHFLOW_DEFAULTS.items()}, **self.inputs)
+
+        if previous_phases is None or any(name in GRID_INPUTS for name in changed):
+            self._build_grid()
+            first_month = 0
+        else:
+            self._set_phases()
+            first_month = self._first_affected_month(changed, previous_phases)
+        if first_month is not None:
+            self._recompute_months(first_month)
+        self._set_terminal_rows()
+        self.last_update = {"first_month": first_month, "months_recomputed": 0 if first_month is None else len(self.months) - first_month}
+        return self
+
+    def _build_grid(self):
+        '''function to build the month grid and the payment groups, which only change with the GRID_INPUTS'''
+
+        self.months, self.period_start, self.period_end = month_grid(self.inputs["cashflow_start"], self.inputs["cashflow_term"])
+        convention = self.inputs["rent_convention"]
+        if convention is None:
+            convention = "quarterly_in_advance" if self.inputs["quarterly_in_advance"] else "monthly_in_advance"
+        self.convention = convention
+        self.group_starts = payment_groups(self.months, convention)
+        n_months = len(self.months)
+        self.columns = {cat: np.zeros(n_months) for cat in CATEGORIES}
+        self.category = np.full(n_months, -1, dtype=np.int8)
+        self.monthly_rents = np.zeros(n_months)
+        self.total_rent = np.zeros(n_months)
+        self.cashflow = np.zeros(n_months)
+        entry_date = np.datetime64(self.inputs["cashflow_start"], "D") - 1
+        exit_date = self.period_end[-1] + 1
+        self.dates = np.concatenate([[entry_date], self.period_start, [exit_date]])
+        self._set_phases()
+
+    def _set_phases(self):
+        refurb_end, void_end, rf_end, relet_date = lease_phase_dates(
+            self.inputs["lease_termination"], self.inputs["refurb_duration"], self.inputs["void_period"], self.inputs["rf"])
+        self.phases = {
+            name: np.datetime64(value, "D") for name, value in [
+                ("cashflow_start", self.inputs["cashflow_start"]),
+                ("review_date", self.inputs["review_date"]),
+                ("lease_termination", self.inputs["lease_termination"]),
+                ("refurb_end", refurb_end),
+                ("void_end", void_end),
+                ("rf_end", rf_end),
+                ("relet_date", relet_date),
+            ]
+        }
+
+    def _first_affected_month(self, changed, previous_phases):
+        '''function to find the first month whose cashflow the changed inputs can affect, from the earlier of the
+        old and new phase boundaries (None if only the entry/exit rows are affected)'''
+
+        boundaries = [phases[boundary] for name in changed for boundary in INPUT_BOUNDARIES.get(name, [])
+                      for phases in [previous_phases, self.phases]]
+        if not boundaries:
+            return None
+        return int(np.searchsorted(self.period_start, min(boundaries), side="left"))
+
+    def _recompute_months(self, first_month):
+        '''function to recompute the monthly columns from first_month onwards, and the re-timed rent from the start
+        of the payment period containing it'''
+
+        inputs, phases = self.inputs, self.phases
+        columns, category = cashflow_components(
+            self.period_start[first_month:],
+            lease_termination=phases["lease_termination"],
+            review_date=phases["review_date"],
+            refurb_end=phases["refurb_end"],
+            void_end=phases["void_end"],
+            rf_end=phases["rf_end"],
+            relet_date=phases["relet_date"],
+            unit_area=inputs["unit_area"],
+            current_rent=inputs["current_rent"],
+            headline_erv=inputs["headline_erv"],
+            ner_discount=inputs["ner_discount"],
+            refurb_cost=inputs["refurb_cost"],
+            refurb_duration=inputs["refurb_duration"],
+            vacant_rates_percent=inputs["vacant_rates_percent"],
+            rates_relief=inputs["rates_relief"],
+            vacant_sc=inputs["vacant_sc"],
+            relet_rent=inputs["relet_rent"]
+        )
+        for cat in CATEGORIES:
+            self.columns[cat][first_month:] = columns[cat]
+        self.category[first_month:] = category
+        self.monthly_rents[first_month:] = (
+            columns["contracted_rent"] + columns["reviewed_rent"] + columns["rf_period"] + columns["relet_rent"])
+
+        # Payment groups are anchored on calendar months, so re-timing from a group start gives the same payments
+        group_start = self.group_starts[np.searchsorted(self.group_starts, first_month, side="right") - 1] if first_month else 0
+        self.total_rent[group_start:] = retime_rent(self.monthly_rents[group_start:], self.months[group_start:], self.convention)
+        self.cashflow[group_start:] = (
+            self.total_rent[group_start:]
+            + self.columns["refurbishment_period"][group_start:]
+            + self.columns["void_period"][group_start:]
+        )
+
+    def _set_terminal_rows(self):
+        '''function to set the entry and exit rows, valuing the exit on the final month's rent if exit_price is None'''
+
+        inputs = self.inputs
+        exit_price = inputs["exit_price"]
+        if exit_price is None:
+            exit_rent = annual_exit_rent(
+                self.columns["contracted_rent"][-1], self.columns["reviewed_rent"][-1], self.columns["relet_rent"][-1])
+            exit_price = initial_yield_valuation(exit_rent, inputs["exit_cap"], inputs["purchasers_costs"])
+        flows = np.concatenate([[-inputs["entry_price"]], self.cashflow, [exit_price]])
+        if self.flows is None or not np.array_equal(flows, self.flows):
+            self._irr = None
+        self.flows = flows
+        self.exit_price = exit_price
+
+    @property
+    def irr(self):
+        '''IRR of the cashflow, re-solved after an update starting from the previous IRR (as the cashflow has
+        usually only changed in its later months this converges in a few iterations)'''
+
+        if self._irr is None:
+            guess = self._previous_irr if np.isfinite(self._previous_irr) else 0.1
+            self._irr = float(xirr_batch(self.dates, self.flows, guess=guess))
+            self._previous_irr = self._irr
+        return self._irr
+
+    def npv(self, discount_rate):
+        return float(xnpv_batch(discount_rate, self.dates, self.flows))
+
+    def arrays(self):
+        '''function to return the cashflow rows in the same form as create_cashflow(output="arrays")'''
+
+        no_value = np.array([np.nan])
+        rows = {
+            'month': np.arange(len(self.flows)),
+            'cashflow': self.flows.copy(),
+            'period_start': self.dates.copy(),
+            'period_end': np.concatenate([self.dates[:1], self.period_end, self.dates[-1:]]),
+        }
+        for cat in CATEGORIES:
+            rows[cat] = np.concatenate([no_value, self.columns[cat], no_value])
+        rows['total_rent'] = np.concatenate([no_value, self.total_rent, no_value])
+        return rows
+
+    def dataframe(self):
+        '''function to return the cashflow in the same form as create_cashflow (the valuation column covers every
+        row, so it's recalculated in full)'''
+
+        inputs = self.inputs
+        valuation = valuation_timeseries(
+            self.dates,
+            inputs["exit_cap"] if inputs["valuation_yield"] is None else inputs["valuation_yield"],
+            inputs["lease_start"],
+            inputs["review_date"],
+            inputs["lease_termination"],
+            inputs["current_rent"],
+            inputs["headline_erv"] * inputs["unit_area"],
+            inputs["ner_discount"],
+            inputs["refurb_duration"],
+            inputs["void_period"],
+            inputs["rf"]
+        )
+        return cashflow_dataframe(self.arrays(), self.category, valuation)
+
+
+def _same_value(old, new):
+    if old is None or new is None:
+        return old is new
+    return np.array_equal(old, new)
@@ -0,0 +1,295 @@
+import functools
+import inspect
+from collections.abc import Mapping
+from datetime import date, datetime
+
+import numpy as np
+
+from rent_timing import get_convention
+
+# Fields of a lease record, i.e. the create_cashflow parameters (the columns of a portfolio table), and the
+# defaults of the optional ones
+LEASE_FIELDS = [
+    "cashflow_start",
+    "cashflow_term",
+    "unit_area",
+    "lease_start",
+    "current_rent",
+    "review_date",
+    "lease_termination",
+    "headline_erv",
+    "ner_discount",
+    "refurb_cost",
+    "refurb_duration",
+    "void_period",
+    "rf",
+    "relet_term",
+    "exit_cap",
+    "vacant_rates_percent",
+    "rates_relief",
+    "vacant_sc",
+    "relet_rent",
+    "entry_price",
+    "exit_price",
+    "quarterly_in_advance",
+    "rent_convention",
+    "purchasers_costs",
+]
+LEASE_DEFAULTS = {
+    "relet_rent": None,
+    "entry_price": 0.0,
+    "exit_price": 0.0,
+    "quarterly_in_advance": True,
+    "rent_convention": None,
+    "purchasers_costs": 0.068,
+}
+DATE_FIELDS = ["cashflow_start", "lease_start", "review_date", "lease_termination"]
+# Fields counted in whole months after the lease ends, they can't be negative
+MONTH_FIELDS = ["refurb_duration", "void_period", "rf"]
+# Fields that are None (a single lease) or NaN (a portfolio) when not given
+OPTIONAL_FIELDS = ["relet_rent", "exit_price"]
+
+
+class Lease(Mapping):
+    '''Compact record of one unit's lease, holding the create_cashflow inputs in __slots__. The inputs are
+    validated and converted once here (dates to datetime.date, amounts to float, the rent convention resolved from
+    quarterly_in_advance), so passing a Lease on doesn't repeat the checks.
+
+    A Lease is a read-only mapping of its fields, so create_cashflow(**lease) works, as does
+    create_cashflow(lease=lease) and e.g. rent_yp(0.0705, lease=lease) (see accepts_lease).
+    '''
+
+    __slots__ = tuple(LEASE_FIELDS)
+
+    def __init__(self, **inputs):
+        unknown = set(inputs) - set(LEASE_FIELDS)
+        if unknown:
+            raise TypeError(f"Unknown lease inputs: {sorted(unknown)}")
+        missing = [field for field in LEASE_FIELDS if field not in inputs and field not in LEASE_DEFAULTS]
+        if missing:
+            raise TypeError(f"Missing lease inputs: {missing}")
+
+        for field in LEASE_FIELDS:
+            value = inputs.get(field, LEASE_DEFAULTS.get(field))
+            if field in DATE_FIELDS:
+                value = _as_date(field, value)
+            elif field in OPTIONAL_FIELDS:
+                value = None if _missing(value) else float(value)
+            elif field == "quarterly_in_advance":
+                value = bool(value)
+            elif field == "rent_convention":
+                value = None if _missing(value) else str(value)
+            else:
+                value = float(value)
+            object.__setattr__(self, field, value)
+
+        term = self.cashflow_term
+        if term < 1 or term != int(term):
+            raise ValueError("cashflow_term must be a whole number of months, at least 1")
+        object.__setattr__(self, "cashflow_term", int(term))
+        for field in MONTH_FIELDS:
+            if getattr(self, field) < 0:
+                raise ValueError(f"{field} can't be negative")
+        if self.rent_convention is None:
+            object.__setattr__(self, "rent_convention", "quarterly_in_advance" if self.quarterly_in_advance else "monthly_in_advance")
+        get_convention(self.rent_convention)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Lease is read-only, use replace() for a changed copy")
+
+    def __getitem__(self, field):
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __iter__(self):
+        return iter(self.__slots__)
+
+    def __len__(self):
+        return len(self.__slots__)
+
+    def __repr__(self):
+        return f"Lease({', '.join(f'{field}={getattr(self, field)!r}' for field in self.__slots__)})"
+
+    def __reduce__(self):
+        return (_lease_from_fields, (tuple(getattr(self, field) for field in self.__slots__),))
+
+    def replace(self, **changes):
+        '''function to return a copy of the lease with some inputs changed (validated as for a new lease)'''
+
+        return Lease(**dict(self, **changes))
+
+    # The void inputs of the YP functions at the cashflow start, derived as valuation_timeseries does
+    @property
+    def end_void(self):
+        return int(self.refurb_duration + self.void_period)
+
+    @property
+    def relet_rf(self):
+        return int(self.rf)
+
+    @property
+    def initial_void(self):
+        '''months from the cashflow start until the relet rent starts, 0 while that's still after the lease ends'''
+
+        rent_start = np.datetime64(self.lease_termination, "M") + self.end_void + self.relet_rf
+        return max(0, int((rent_start - np.datetime64(self.cashflow_start, "M")).astype(np.int64)))
+
+    @property
+    def initial_rf(self):
+        return 0
+
+
+def _lease_from_fields(values):
+    '''function to rebuild a pickled Lease without re-validating it'''
+
+    lease = Lease.__new__(Lease)
+    for field, value in zip(Lease.__slots__, values):
+        object.__setattr__(lease, field, value)
+    return lease
+
+
+def _as_date(field, value):
+    '''function to convert a date input (datetime.date, datetime, pandas Timestamp or numpy datetime64) to a datetime.date'''
+
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, np.datetime64) and not np.isnat(value):
+        return value.astype("datetime64[D]").item()
+    raise TypeError(f"{field} must be a datetime.date instance")
+
+
+def _missing(value):
+    return value is None or (isinstance(value, (float, np.floating)) and np.isnan(value))
+
+
+def _missing_array(values):
+    '''function to flag the None/NaN entries of an input column'''
+
+    if values.dtype.kind == "f":
+        return np.isnan(values)
+    if values.dtype.kind == "O":
+        return np.frompyfunc(_missing, 1, 1)(values).astype(bool)
+    return np.zeros(values.shape, dtype=bool)
+
+
+# Names a lease can fill in when passed to a function decorated with accepts_lease
+LEASE_INPUTS = set(LEASE_FIELDS) | {"end_void", "relet_rf", "initial_void", "initial_rf"}
+
+
+def accepts_lease(function):
+    '''decorator to let a function take its inputs from a Lease, passed as lease=. Parameters that aren't given
+    positionally or by keyword are filled in from the lease's fields of the same name (and the YP void inputs), e.g.
+        rent_yp(0.0705, lease=lease)
+        create_cashflow(lease=lease, output="arrays")'''
+
+    # Position of each parameter the lease can fill in, it's given positionally if there are more args than that
+    positions = {name: index for index, name in enumerate(inspect.signature(function).parameters) if name in LEASE_INPUTS}
+
+    @functools.wraps(function)
+    def wrapper(*args, lease=None, **kwargs):
+        if lease is not None:
+            for name, position in positions.items():
+                if position >= len(args) and name not in kwargs:
+                    kwargs[name] = getattr(lease, name)
+        return function(*args, **kwargs)
+
+    return wrapper
+
+
+class LeaseArray:
+    '''Struct-of-arrays container for a portfolio of leases: one NumPy array per lease field (dates as
+    datetime64[D], missing relet rents and exit prices as NaN, every unit's rent convention filled in), validated
+    once at construction. The batch engines take a LeaseArray as they take a portfolio table, without converting
+    it again.
+
+    Build one from a columnar table (a DataFrame or a dict of equal length columns, one row per unit) or with
+    LeaseArray.from_leases from Lease records or dicts. leases[i] gives unit i as a Lease, leases[field] a column
+    and leases[start:stop] (or a mask or index array) a LeaseArray of those units.
+    '''
+
+    __slots__ = ("columns",)
+
+    def __init__(self, leases):
+        if isinstance(leases, LeaseArray):
+            self.columns = dict(leases.columns)
+            return
+
+        n_units = len(leases[LEASE_FIELDS[0]])
+        columns = {}
+        for field in LEASE_FIELDS:
+            if field in leases:
+                values = np.asarray(leases[field])
+            elif field in LEASE_DEFAULTS:
+                values = np.full(n_units, LEASE_DEFAULTS[field], dtype=object)
+            else:
+                raise KeyError(f"Portfolio table is missing the '{field}' column")
+
+            if field in DATE_FIELDS:
+                columns[field] = values.astype("datetime64[D]")
+            elif field in OPTIONAL_FIELDS:
+                columns[field] = np.where(_missing_array(values), np.nan, values).astype(float)
+            elif field == "rent_convention":
+                columns[field] = values.astype(object)
+            elif field == "quarterly_in_advance":
+                columns[field] = values.astype(bool)
+            else:
+                columns[field] = values.astype(float)
+
+        # Fill in each unit's rent convention from quarterly_in_advance where one isn't given
+        default_convention = np.where(columns["quarterly_in_advance"], "quarterly_in_advance", "monthly_in_advance")
+        missing = _missing_array(columns["rent_convention"])
+        columns["rent_convention"] = np.where(missing, default_convention, columns["rent_convention"])
+
+        for field in DATE_FIELDS:
+            if np.isnat(columns[field]).any():
+                raise ValueError(f"Portfolio table has missing dates in the '{field}' column")
+        term = columns["cashflow_term"]
+        if ((term < 1) | (term != np.floor(term))).any():
+            raise ValueError("cashflow_term must be a whole number of months, at least 1")
+        for field in MONTH_FIELDS:
+            if (columns[field] < 0).any():
+                raise ValueError(f"Portfolio table has negative values in the '{field}' column")
+        for convention in np.unique(columns["rent_convention"]):
+            get_convention(convention)
+        self.columns = columns
+
+    @classmethod
+    def from_leases(cls, leases):
+        '''function to build a LeaseArray from a sequence of Lease records (or dicts of lease inputs)'''
+
+        leases = list(leases)
+        return cls({field: [lease.get(field, LEASE_DEFAULTS.get(field)) for lease in leases] for field in LEASE_FIELDS})
+
+    def replace(self, **columns):
+        '''function to return a copy of the portfolio with some columns changed, e.g. leases.replace(headline_erv=erv)
+        (a single value is used for every unit), validated as for a new LeaseArray'''
+
+        unknown = set(columns) - set(LEASE_FIELDS)
+        if unknown:
+            raise KeyError(f"Unknown lease fields: {sorted(unknown)}")
+        columns = {field: np.broadcast_to(values, (len(self),)) for field, values in columns.items()}
+        return LeaseArray(dict(self.columns, **columns))
+
+    def __len__(self):
+        return len(self.columns["cashflow_start"])
+
+    def __contains__(self, field):
+        return field in self.columns
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.columns[key]
+        if isinstance(key, (int, np.integer)):
+            return Lease(**{field: values[key] for field, values in self.columns.items()})
+        subset = LeaseArray.__new__(LeaseArray)
+        subset.columns = {field: values[key] for field, values in self.columns.items()}
+        return subset
+
+    def __iter__(self):
+        return (self[unit] for unit in range(len(self)))
+
+    def __repr__(self):
+        return f"LeaseArray({len(self)} units)"
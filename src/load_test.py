@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from benchmarks import example_lease
+
+
+def request_bodies(n_requests, cashflow_term=60, seed=0):
+    '''function to build n_requests /valuation bodies for the example unit, each with its own current rent and ERV
+    so that no two requests are the same'''
+
+    rng = np.random.default_rng(seed)
+    lease = {name: value.isoformat() if hasattr(value, "isoformat") else value
+             for name, value in example_lease(cashflow_term).items()}
+    bodies = []
+    for rent, erv in zip(rng.uniform(30000, 80000, n_requests), rng.uniform(15, 30, n_requests)):
+        bodies.append(json.dumps({"lease": dict(lease, current_rent=rent, headline_erv=erv), "discount_rate": 0.1}).encode())
+    return bodies
+
+
+async def client(host, port, bodies, latencies, statuses):
+    '''function to send bodies one after another over a single keep-alive connection, recording each latency and status'''
+
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for body in bodies:
+            t0 = time.perf_counter()
+            writer.write(f"POST /valuation HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b""):
+                    break
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":")[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - t0)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+async def load_test(host, port, n_requests, concurrency, cashflow_term=60):
+    '''function to send n_requests single-unit valuations from concurrency keep-alive clients at once, returning the
+    throughput, latency percentiles (ms) and a count of the response statuses'''
+
+    bodies = request_bodies(n_requests, cashflow_term)
+    latencies, statuses = [], {}
+    t0 = time.perf_counter()
+    await asyncio.gather(*[client(host, port, bodies[i::concurrency], latencies, statuses) for i in range(concurrency)])
+    elapsed = time.perf_counter() - t0
+    latencies = np.array(latencies) * 1e3
+    return {
+        "requests": n_requests,
+        "seconds": elapsed,
+        "requests_per_second": n_requests / elapsed,
+        **{f"p{q}_ms": float(np.percentile(latencies, q)) for q in [50, 95, 99]},
+        "max_ms": float(latencies.max()),
+        "statuses": statuses,
+    }
+
+
+async def wait_until_up(host, port, timeout=30):
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(host, port)
+            writer.close()
+            return
+        except OSError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency/throughput load test of the valuation service on localhost")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=256, help="number of keep-alive client connections")
+    parser.add_argument("--term", type=int, default=60, help="cashflow term of the valued unit, in months")
+    parser.add_argument("--spawn", action="store_true", help="start the service (python service.py) for the test")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes of a spawned service")
+    args = parser.parse_args()
+
+    server = None
+    if args.spawn:
+        command = [sys.executable, "service.py", "--host", args.host, "--port", str(args.port)]
+        if args.workers is not None:
+            command += ["--workers", str(args.workers)]
+        server = subprocess.Popen(command, cwd=sys.path[0])
+    try:
+        asyncio.run(wait_until_up(args.host, args.port))
+        # A short warm-up, so the worker processes have started before the timed run
+        asyncio.run(load_test(args.host, args.port, min(args.requests, 1000), args.concurrency, args.term))
+        result = asyncio.run(load_test(args.host, args.port, args.requests, args.concurrency, args.term))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"{result['requests']:,} requests in {result['seconds']:.2f}s: {result['requests_per_second']:,.0f} req/s")
+    print(f"latency p50 {result['p50_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, max {result['max_ms']:.1f} ms")
+    print(f"statuses {result['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,174 @@
 import streamlit as st
 st.set_page_config(layout="wide")
-import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 import itertools
+import os
 from datetime import date
 
-from npv_irr_calculations import *
+import numpy as np
+import pandas as pd
+
+from npv_irr_calculations import annual_exit_rent, calculate_irr, calculate_npv, initial_yield_valuation
+from incremental import IncrementalCashflow
+import profiling
+from result_cache import cache_stats, canonical_key, cashflow_cache, figure_cache, metrics_cache
+from result_store import ResultStore
 from dateutil.relativedelta import relativedelta
+from goal_seek import goal_seek
+
+# Inputs the goal seek can solve for, and their labels on the page
+GOAL_SEEK_LABELS = {
+    "entry_price": "Entry Price",
+    "exit_price": "Exit Price",
+    "exit_cap": "Exit Initial Yield",
+    "headline_erv": "Headline ERV (£ per sq ft)",
+}
+
+
+def cashflow_figures(cashflow):
+    '''function to build the page's Plotly figures for a cashflow, returning the category shading chart, the income
+    components chart and the refurbishment chart'''
+    
+    # Plotly is only imported once the first figures are built, so the page's first render isn't held up by it
+    import plotly.graph_objects as go
+
+    # Old chart format
+    # Plot the cashflows without clearing the previous output
+    chart_data = cashflow.iloc[1:-1]
+    fig = go.Figure()
+
+    colors = {
+        "contracted_rent": "green",
+        "reviewed_rent": "lightgreen",
+        "refurbishment_period": "orange",
+        "void_period": "red",
+        "rf_period": "yellow",
+        "relet_rent": "blue"
+    }
+    for category, color in colors.items():
+        cat_months = chart_data[chart_data["category"] == category]["month"].tolist()
+        if not cat_months:
+            continue
+
+        segs = []
+        for k, g in itertools.groupby(enumerate(cat_months), key=lambda ix: ix[1] - ix[0]):
+            group = list(g)
+            segs.append((group[0][1], group[-1][1]))
+
+        for start, end in segs:
+            fig.add_shape(
+                type="rect",
+                x0=start,
+                x1=end + 1,
+                y0=chart_data["cashflow_line"].min(),
+                y1=chart_data["cashflow_line"].max(),
+                fillcolor=color,
+                opacity=0.3,
+                layer="below",
+                line_width=0,
+            )
+        fig.add_trace(
+            {
+                "type": "scatter",
+                "x": [None],
+                "y": [None],
+                "mode": "markers",
+                "marker": {"size": 10, "color": color},
+                "name": category,
+                "showlegend": True,
+            }
+        )
+
+    fig.add_trace(
+        go.Scatter(
+            x=chart_data["month"],
+            y=chart_data["cashflow_line"],
+            mode="lines",
+            line=dict(color="black", width=2),
+            name="Cashflow",
+        )
+    )
+
+    fig.update_layout(
+        title="Cashflow Over Time with Full-Row Category Shading",
+        xaxis_title="Month",
+        yaxis_title="Cashflow",
+        showlegend=True,
+    )
+
+    # st.plotly_chart(fig)
+
+
+
+    # Present the rent components over time using a multi-line chart
+    df = cashflow
+    fig2 = go.Figure()
+
+    fig2.add_trace(go.Scatter(
+    x=df["period_start"],
+    y=df["contracted_rent"],
+    mode="lines+markers",
+    name="Contracted Rent",
+    line=dict(color="green")
+    ))
+
+    fig2.add_trace(go.Scatter(
+    x=df["period_start"],
+    y=df["reviewed_rent"],
+    mode="lines+markers",
+    name="Reviewed Rent",
+    line=dict(color="lightgreen")
+    ))
+
+    fig2.add_trace(go.Scatter(
+    x=df["period_start"],
+    y=df["rf_period"],
+    mode="lines+markers",
+    name="Rent Free Period",
+    line=dict(color="orange")
+    ))
+
+    fig2.add_trace(go.Scatter(
+    x=df["period_start"],
+    y=df["relet_rent"],
+    mode="lines+markers",
+    name="Relet Rent",
+    line=dict(color="blue")
+    ))
+
+    fig2.add_trace(go.Scatter(
+    x=df["period_start"],
+    y=df["void_period"],
+    mode="lines+markers",
+    name="Void Costs",
+    line=dict(color="red")
+    ))
+
+    fig2.update_layout(
+    title="Income Components over Time",
+    xaxis_title="Period Start",
+    yaxis_title="Rent (£)"
+    )
+    # st.plotly_chart(fig2)
+
+
+    fig3 = go.Figure(
+        go.Scatter(
+            x=df["period_start"],
+            y=df["refurbishment_period"],
+            name="Refurbishment Period",
+            mode="lines",
+            line=dict(color="red"),
+            fill="tozeroy"
+        )
+    )
+    fig3.update_layout(
+        title="Refurbishment Period Over Time",
+        xaxis_title="Period Start",
+        yaxis_title="Refurbishment Period"
+    )
+    # st.plotly_chart(fig3)
+    return fig, fig2, fig3
+
 
 def main():
     st.sidebar.title("Model Inputs")
@@ -63,45 +224,26 @@ def main():
     
     exit_initial_yield = st.sidebar.number_input("Exit Initial Yield (%)", value=12.00)
     
-    # Initialize with default values
-    exit_rent = 0
-    exit_price = 2000000  # default until cashflow is generated
-    
-    # Create a placeholder for the exit rent display
+    # Placeholders for the exit rent and price, filled in once the cashflow (which values the exit) is generated
     exit_rent_placeholder = st.sidebar.empty()
-    # Create a placeholder for the exit price display
     exit_price_placeholder = st.sidebar.empty()
     
-    # if "cashflow" in st.session_state and st.session_state["cashflow"] is not None:
-    #     # Use the second-to-last row of the cashflow table
-    #     second_last_row = st.session_state["cashflow"].iloc[-2]
-    #     # Extract rents from the different rent option columns and determine the maximum
-    #     max_rent = max(
-    #         second_last_row["contracted_rent"],
-    #         second_last_row["reviewed_rent"],
-    #         second_last_row["relet_rent"]
-    #     )
-    #     # Annualise the maximum rent to get exit rent
-    #     exit_rent = max_rent * 12
-    #     # Compute exit price using the initial yield valuation formula
-    #     exit_price = initial_yield_valuation(exit_rent, exit_initial_yield / 100, purchasers_costs / 100)
-    
-    # # Update the placeholders with current values
-    # exit_rent_placeholder.write(f"Exit Rent (Annualised): £{exit_rent:,.2f}" if exit_rent > 0 else "Computed Exit Rent will appear here once cashflow is generated.")
-    # exit_price_placeholder.markdown(
-    #     f"<div style='background-color:#f0f0f0; padding:10px; border-radius:5px; font-size:18px; font-weight:bold;'>Exit Valuation: £{exit_price:,.0f}</div>" if exit_rent > 0 else "Computed Exit Price will appear here once cashflow is generated.",
-    #     unsafe_allow_html=True
-    # )
-    
     st.sidebar.markdown("---")
     st.sidebar.subheader("Misc Assumptions")
     vacant_rates_percent = st.sidebar.number_input("Vacant Rates Percent (%)", value=50)
     rates_relief = st.sidebar.number_input("Rates Relief (months)", value=3)
     vacant_sc = st.sidebar.number_input("Vacant Service Charge (£ per sq ft)", value=2)
     
-    exit_price = st.session_state.get("exit_price", initial_val)  # default to initial valuation for exit price
+    # Stage timings of the model functions, shown in the profiling panel at the bottom of the page. The flag and
+    # the timings are kept in the session, so only this session's model calls are timed
+    st.sidebar.checkbox("Profile model stages", value=False, key="profile_stages")
+    if "stage_collector" not in st.session_state:
+        st.session_state["stage_collector"] = profiling.StageCollector()
+    def profiled():
+        return profiling.recording(st.session_state["stage_collector"], enabled=st.session_state["profile_stages"])
+    
     # if st.button("Calculate Cashflow"):
-    cashflow = create_cashflow(
+    cashflow_inputs = dict(
         cashflow_start=cashflow_start,
         cashflow_term=cashflow_term,
         unit_area=unit_area,
@@ -121,30 +263,30 @@ def main():
         rates_relief=rates_relief,
         vacant_sc=vacant_sc,
         entry_price=initial_val,
-        exit_price=exit_price
+        exit_price=None,  # valued on the exit rent at exit_cap in the same pass
+        purchasers_costs=purchasers_costs/100
     )
+    # Reuse the cashflow (and everything derived from it) when only e.g. the discount rate has changed
+    cashflow_key = canonical_key(cashflow_inputs)
+    # On a cache miss, this session's incremental cashflow only recomputes the months the changed inputs affect
+    def update_cashflow():
+        if "incremental_cashflow" not in st.session_state:
+            st.session_state["incremental_cashflow"] = IncrementalCashflow(**cashflow_inputs)
+        return st.session_state["incremental_cashflow"].update(**cashflow_inputs).dataframe()
+    with profiled():
+        cashflow = cashflow_cache.get_or_compute(cashflow_key, update_cashflow)
     st.session_state["cashflow"] = cashflow
 
 
-    # Use the second-to-last row of the cashflow table
-    second_last_row = st.session_state["cashflow"].iloc[-2]
-    # Extract rents from the different rent option columns and determine the maximum
-    max_rent = max(
-        second_last_row["contracted_rent"],
-        second_last_row["reviewed_rent"],
-        second_last_row["relet_rent"]
-    )
-    # Annualise the maximum rent to get exit rent
-    exit_rent = max_rent * 12
-    # Compute exit price using the initial yield valuation formula
-    exit_price_new = initial_yield_valuation(exit_rent, exit_initial_yield / 100, purchasers_costs / 100)
-    
-    st.session_state["exit_price"] = exit_price_new
+    # Exit rent from the final month of the cashflow, and the exit price it was valued at
+    final_month = cashflow.iloc[-2]
+    exit_rent = annual_exit_rent(final_month["contracted_rent"], final_month["reviewed_rent"], final_month["relet_rent"])
+    exit_price = cashflow.iloc[-1]["cashflow"]
     
     # Update the placeholders with current values
     exit_rent_placeholder.write(f"Exit Rent (Annualised): £{exit_rent:,.2f}" if exit_rent > 0 else "Computed Exit Rent will appear here once cashflow is generated.")
     exit_price_placeholder.markdown(
-        f"<div style='background-color:#f0f0f0; padding:10px; border-radius:5px; font-size:18px; font-weight:bold;'>Exit Valuation: £{exit_price_new:,.0f}</div>" if exit_rent > 0 else "Computed Exit Price will appear here once cashflow is generated.",
+        f"<div style='background-color:#f0f0f0; padding:10px; border-radius:5px; font-size:18px; font-weight:bold;'>Exit Valuation: £{exit_price:,.0f}</div>" if exit_rent > 0 else "Computed Exit Price will appear here once cashflow is generated.",
         unsafe_allow_html=True
     )
                     
@@ -155,154 +297,45 @@ def main():
         discount_rate_input = st.number_input("Discount Rate %", value=10.00, key="discount_rate", min_value=0.00, max_value=100.00, step=0.25)
         col4, col5 = st.columns(2)
         with col4:
-            irr = calculate_irr(st.session_state["cashflow"]['period_start'], st.session_state["cashflow"]['cashflow'])
+            with profiled():
+                irr = metrics_cache.get_or_compute(("irr", cashflow_key), lambda: calculate_irr(cashflow['period_start'], cashflow['cashflow']))
             st.write(f"IRR (Monthly): {irr * 100:.2f}%")    
             
         with col5:
-            npv = calculate_npv(discount_rate_input/100, st.session_state["cashflow"]['period_start'], st.session_state["cashflow"]['cashflow'])
+            with profiled():
+                npv = metrics_cache.get_or_compute(("npv", cashflow_key, discount_rate_input), lambda: calculate_npv(discount_rate_input/100, cashflow['period_start'], cashflow['cashflow']))
             st.write(f"NPV: £{npv:,.2f}")
             
-        
-        # Old chart format
-        # Plot the cashflows without clearing the previous output
-        import plotly.graph_objects as go
-        chart_data = st.session_state["cashflow"].iloc[1:-1]
-        fig = go.Figure()
-
-        colors = {
-            "contracted_rent": "green",
-            "reviewed_rent": "lightgreen",
-            "refurbishment_period": "orange",
-            "void_period": "red",
-            "rf_period": "yellow",
-            "relet_rent": "blue"
-        }
-        for category, color in colors.items():
-            cat_months = chart_data[chart_data["category"] == category]["month"].tolist()
-            if not cat_months:
-                continue
-
-            segs = []
-            for k, g in itertools.groupby(enumerate(cat_months), key=lambda ix: ix[1] - ix[0]):
-                group = list(g)
-                segs.append((group[0][1], group[-1][1]))
-
-            for start, end in segs:
-                fig.add_shape(
-                    type="rect",
-                    x0=start,
-                    x1=end + 1,
-                    y0=chart_data["cashflow_line"].min(),
-                    y1=chart_data["cashflow_line"].max(),
-                    fillcolor=color,
-                    opacity=0.3,
-                    layer="below",
-                    line_width=0,
-                )
-            fig.add_trace(
-                {
-                    "type": "scatter",
-                    "x": [None],
-                    "y": [None],
-                    "mode": "markers",
-                    "marker": {"size": 10, "color": color},
-                    "name": category,
-                    "showlegend": True,
-                }
+        # Goal seek: solve one input for a target IRR or NPV, e.g. the entry price for a 12% IRR
+        st.subheader("Goal Seek")
+        col6, col7, col8 = st.columns(3)
+        with col6:
+            solve_for = st.selectbox("Solve For", list(GOAL_SEEK_LABELS), format_func=GOAL_SEEK_LABELS.get)
+        with col7:
+            target_type = st.radio("Target", ["IRR", "NPV"], horizontal=True)
+        with col8:
+            if target_type == "IRR":
+                target_value = st.number_input("Target IRR %", value=12.00, step=0.25)
+            else:
+                target_value = st.number_input("Target NPV (£)", value=0.0, step=10000.0)
+        target = dict(target_irr=target_value/100) if target_type == "IRR" else dict(target_npv=target_value, discount_rate=discount_rate_input/100)
+        with profiled():
+            solved = metrics_cache.get_or_compute(
+                ("goal_seek", cashflow_key, solve_for, target_type, target_value, discount_rate_input),
+                lambda: goal_seek({name: [value] for name, value in cashflow_inputs.items()}, solve_for, **target)
             )
-
-        fig.add_trace(
-            go.Scatter(
-                x=chart_data["month"],
-                y=chart_data["cashflow_line"],
-                mode="lines",
-                line=dict(color="black", width=2),
-                name="Cashflow",
-            )
-        )
-
-        fig.update_layout(
-            title="Cashflow Over Time with Full-Row Category Shading",
-            xaxis_title="Month",
-            yaxis_title="Cashflow",
-            showlegend=True,
-        )
-        
-        # st.plotly_chart(fig)
+        value = solved["value"][0]
+        if np.isnan(value):
+            st.write(f"The target can't be reached by changing the {GOAL_SEEK_LABELS[solve_for]}.")
+        else:
+            formatted = f"{value * 100:.2f}%" if solve_for == "exit_cap" else f"£{value:,.2f}"
+            st.write(f"{GOAL_SEEK_LABELS[solve_for]}: {formatted} (IRR {solved['irr'][0] * 100:.2f}%, NPV £{solved['npv'][0]:,.2f})")
         
-
-
-        import plotly.express as px
+        # The figures only depend on the cashflow, so they're rebuilt only when it changes
+        fig, fig2, fig3 = figure_cache.get_or_compute(cashflow_key, lambda: cashflow_figures(cashflow))
 
         # Present the rent components over time using a multi-line chart
         if "cashflow" in st.session_state and st.session_state["cashflow"] is not None:
-            df = st.session_state["cashflow"]
-            fig2 = go.Figure()
-            
-            fig2.add_trace(go.Scatter(
-            x=df["period_start"],
-            y=df["contracted_rent"],
-            mode="lines+markers",
-            name="Contracted Rent",
-            line=dict(color="green")
-            ))
-            
-            fig2.add_trace(go.Scatter(
-            x=df["period_start"],
-            y=df["reviewed_rent"],
-            mode="lines+markers",
-            name="Reviewed Rent",
-            line=dict(color="lightgreen")
-            ))
-            
-            fig2.add_trace(go.Scatter(
-            x=df["period_start"],
-            y=df["rf_period"],
-            mode="lines+markers",
-            name="Rent Free Period",
-            line=dict(color="orange")
-            ))
-            
-            fig2.add_trace(go.Scatter(
-            x=df["period_start"],
-            y=df["relet_rent"],
-            mode="lines+markers",
-            name="Relet Rent",
-            line=dict(color="blue")
-            ))
-            
-            fig2.add_trace(go.Scatter(
-            x=df["period_start"],
-            y=df["void_period"],
-            mode="lines+markers",
-            name="Void Costs",
-            line=dict(color="red")
-            ))
-            
-            fig2.update_layout(
-            title="Income Components over Time",
-            xaxis_title="Period Start",
-            yaxis_title="Rent (£)"
-            )
-            # st.plotly_chart(fig2)
-            
-            
-            fig3 = go.Figure(
-                go.Scatter(
-                    x=df["period_start"],
-                    y=df["refurbishment_period"],
-                    name="Refurbishment Period",
-                    mode="lines",
-                    line=dict(color="red"),
-                    fill="tozeroy"
-                )
-            )
-            fig3.update_layout(
-                title="Refurbishment Period Over Time",
-                xaxis_title="Period Start",
-                yaxis_title="Refurbishment Period"
-            )
-            # st.plotly_chart(fig3)
             col1, col2 = st.columns(2)
 
             with col1:
@@ -319,5 +352,44 @@ def main():
             display_df.style.format(format_dict)
         )
 
+    # Portfolio results written by result_store.write_portfolio. The store is memory mapped, so only the months and
+    # units shown are read from the file, however large the portfolio.
+    st.subheader("Portfolio Results")
+    store_path = st.text_input("Result Store File", value="", help="e.g. written with: python result_store.py portfolio.cfstore 100000")
+    if store_path and not os.path.exists(store_path):
+        st.write(f"No result store at {store_path}.")
+    elif store_path:
+        store = ResultStore(store_path)
+        month_labels = [str(month) for month in store.months]
+        col9, col10 = st.columns(2)
+        with col9:
+            series = st.selectbox("Series", store.series)
+        with col10:
+            first_month, last_month = st.select_slider("Months", options=month_labels, value=(month_labels[0], month_labels[-1]))
+        start, end = np.datetime64(first_month, "M"), np.datetime64(last_month, "M") + 1
+        months, totals = store.monthly_totals(series, start, end)
+        st.write(f"{len(store):,} units, portfolio {series} by month")
+        st.line_chart(pd.DataFrame({series: totals}, index=months.astype("datetime64[ns]")))
+
+        unit_id = st.text_input("Unit ID", value=str(store.unit_ids[0]))
+        try:
+            unit = store.unit(unit_id, start, end)
+        except KeyError as error:
+            st.write(error.args[0])
+        else:
+            fields = store.unit_fields(unit_id)
+            st.write(f"Unit {unit_id}: IRR {fields['irr'] * 100:.2f}%, NPV £{fields['npv']:,.2f}, from {fields['cashflow_start']} for {fields['term']:.0f} months")
+            st.dataframe(pd.DataFrame(unit, index=months.astype(str)))
+
+    with st.expander("Debug: cache statistics"):
+        st.dataframe(pd.DataFrame(cache_stats()).T)
+
+    with st.expander("Debug: profiling"):
+        if not st.session_state["profile_stages"]:
+            st.write("Tick 'Profile model stages' in the sidebar to record stage timings (cached results aren't recomputed, so aren't timed).")
+        if st.button("Reset timings"):
+            st.session_state["stage_collector"].reset()
+        st.dataframe(st.session_state["stage_collector"].summary())
+
 if __name__ == "__main__":
     main()
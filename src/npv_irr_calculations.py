@@ -1,33 +1,29 @@
 import numpy as np
-import numpy_financial as npf
 from datetime import date
 from typing import Optional
-import calendar
-from datetime import timedelta
-import pandas as pd
-import itertools
-from pyxirr import xirr, xnpv
+from lease import accepts_lease
+from rent_timing import retime_rent
+from profiling import stage
+from date_arithmetic import add_months, add_months_array, years_between, years_between_array
 
 def calculate_irr(dates, cashflows):
     """
     Uses the pyXIRR package to calculate the IRR of a series of cashflows
     with corresponding dates."""
 
-    return xirr(dates,cashflows)
+    from pyxirr import xirr
+
+    with stage("calculate_irr.pyxirr"):
+        return xirr(dates,cashflows)
 
 def calculate_npv(discount_rate, dates, cashflows):
     """
     Uses the pyXIRR package to calculate the NPV of a series of cashflows with corresponding dates."""
     
-    return xnpv(discount_rate, dates, cashflows)
+    from pyxirr import xnpv
 
-def add_months(d, months):
-    # Simple function to add months to a date
-    month = d.month - 1 + months
-    year = d.year + month // 12
-    month = month % 12 + 1
-    day = min(d.day, calendar.monthrange(year, month)[1])
-    return d.replace(year=year, month=month, day=day)
+    with stage("calculate_npv.pyxirr"):
+        return xnpv(discount_rate, dates, cashflows)
 
 def yrs_to_review(cashflow_start, review_date):
     '''function to calculate the years to review, whereby:
@@ -37,7 +33,7 @@ def yrs_to_review(cashflow_start, review_date):
     if cashflow_start > review_date:
         yrs_to_review = 0
     else:
-        yrs_to_review = (review_date - cashflow_start).days / 365.25
+        yrs_to_review = years_between(cashflow_start, review_date)
     return yrs_to_review
 
 def yrs_to_reversion(cashflow_start, lease_termination, initial_void, initial_rf, end_void, relet_rf):
@@ -46,15 +42,16 @@ def yrs_to_reversion(cashflow_start, lease_termination, initial_void, initial_rf
     - if the cashflow start date is before the lease_termination date, it's the time from the lease_termination date + relet void+rf period from the cashflow start date'''
     
     if cashflow_start > lease_termination:
-        yrs_reversion = (add_months(cashflow_start, int(initial_void + initial_rf)) - cashflow_start).days / 365.25
+        yrs_reversion = years_between(cashflow_start, add_months(cashflow_start, int(initial_void + initial_rf)))
     else:
-        yrs_reversion = (add_months(lease_termination, int(end_void + relet_rf)) - cashflow_start).days / 365.25
+        yrs_reversion = years_between(cashflow_start, add_months(lease_termination, int(end_void + relet_rf)))
     return yrs_reversion
 
 
 # print(yrs_to_review(date(2024, 12, 31), date(2029, 6, 7)))
 
 
+@accepts_lease
 def rent_yp(discount_rate, cashflow_start, review_date, lease_termination):
     '''function to calculate the rent years purchase, i.e. the amount to multiply the current rent by to get the PV of the remaining rent roll'''
     
@@ -66,7 +63,7 @@ def rent_yp(discount_rate, cashflow_start, review_date, lease_termination):
     if cashflow_start > lease_termination:
         remaining_term = 0
     else:
-        remaining_term = (lease_termination - cashflow_start).days / 365.25
+        remaining_term = years_between(cashflow_start, lease_termination)
         
     rent_yp = (1-(discount_factor)**(-min(yrs_review, remaining_term)))/discount_rate
     
@@ -75,13 +72,14 @@ def rent_yp(discount_rate, cashflow_start, review_date, lease_termination):
 #print(rent_yp(0.0705, date(2024, 12, 31), date(2029, 6, 7), date(2034, 5, 27)))
 
 
+@accepts_lease
 def rent_review_yp(discount_rate, cashflow_start, lease_start, review_date, lease_termination, initial_void, initial_rf, end_void, relet_rf):
     '''function to calculate the rent review years purchase, i.e. the amount to multiply any uplift from a rent review by to get the PV of the uplift in rent expected'''
     
     discount_factor = (1+discount_rate)
     
     yrs_reversion = yrs_to_reversion(cashflow_start, lease_termination, initial_void, initial_rf, end_void, relet_rf)
-    remaining_term = (lease_termination - cashflow_start).days / 365.25
+    remaining_term = years_between(cashflow_start, lease_termination)
     yrs_review = yrs_to_review(cashflow_start, review_date)
     
     if review_date == lease_termination:
@@ -96,6 +94,7 @@ def rent_review_yp(discount_rate, cashflow_start, lease_start, review_date, leas
 # print(rent_review_yp(0.0705, date(2024, 12, 31), date(2019, 6, 7), date(2029, 6, 7), date(2034, 5, 27), 0, 0, 0, 12))
         
         
+@accepts_lease
 def reversion_yp(discount_rate, cashflow_start, lease_start, review_date, lease_termination, initial_void, initial_rf, end_void, relet_rf):
     '''function to calculate the reversion years purchase, i.e. the amount to multiply the reversionary rent by to get the PV of the ERV'''
 
@@ -106,8 +105,8 @@ def reversion_yp(discount_rate, cashflow_start, lease_start, review_date, lease_
     
     yrs_reversion = yrs_to_reversion(cashflow_start, lease_termination, initial_void, initial_rf, end_void, relet_rf)
     
-    void_yp_rent_start = ((1-(discount_factor) ** -((lease_termination-rent_date).days / 365.25))/discount_rate) * (1/discount_factor) ** yrs_to_review(cashflow_start, rent_date)        
-    void_yp_to_expiry = (1/discount_rate) * (1/discount_factor) ** ((reversion_rent_start-cashflow_start).days / 365.25)
+    void_yp_rent_start = ((1-(discount_factor) ** -years_between(rent_date, lease_termination))/discount_rate) * (1/discount_factor) ** yrs_to_review(cashflow_start, rent_date)        
+    void_yp_to_expiry = (1/discount_rate) * (1/discount_factor) ** years_between(cashflow_start, reversion_rent_start)
     
     let_rev_yp = (1/discount_rate) * ((1/discount_factor) ** yrs_reversion)
     
@@ -116,15 +115,74 @@ def reversion_yp(discount_rate, cashflow_start, lease_start, review_date, lease_
     else:
         return let_rev_yp
 
-rentyp = rent_yp(0.0705, date(2024, 12, 31), date(2029, 6, 7), date(2034, 5, 27))
-rr_yp = rent_review_yp(0.0705, date(2024, 12, 31), date(2019, 6, 7), date(2029, 6, 7), date(2034, 5, 27), 0, 0, 0, 12)
-rev_yp = reversion_yp(0.0705, date(2024, 12, 31), date(2019, 6, 7), date(2029, 6, 7), date(2034, 5, 27), 0, 0, 0, 12)
+def yrs_to_review_array(cashflow_start, review_date):
+    '''Array version of yrs_to_review for datetime64[D] arrays (or scalars) that broadcast against each other'''
+    
+    return np.where(cashflow_start > review_date, 0.0, years_between_array(cashflow_start, review_date))
+
+
+def yrs_to_reversion_array(cashflow_start, lease_termination, initial_void, initial_rf, end_void, relet_rf):
+    '''Array version of yrs_to_reversion, any of the inputs can be arrays that broadcast against each other'''
+    
+    void_end_initial = add_months_array(cashflow_start, np.asarray(initial_void + initial_rf).astype(np.int64))
+    void_end_relet = add_months_array(lease_termination, np.asarray(end_void + relet_rf).astype(np.int64))
+    return np.where(
+        cashflow_start > lease_termination,
+        years_between_array(cashflow_start, void_end_initial),
+        years_between_array(cashflow_start, void_end_relet)
+    )
+
+
+def rent_yp_array(discount_rate, cashflow_start, review_date, lease_termination):
+    '''Array version of rent_yp, e.g. for a datetime64[D] array of cashflow_start dates'''
+    
+    discount_factor = (1+discount_rate)
+    yrs_review = yrs_to_review_array(cashflow_start, review_date)
+    remaining_term = np.where(cashflow_start > lease_termination, 0.0, years_between_array(cashflow_start, lease_termination))
+    return (1-(discount_factor)**(-np.minimum(yrs_review, remaining_term)))/discount_rate
+
+
+def rent_review_yp_array(discount_rate, cashflow_start, lease_start, review_date, lease_termination, initial_void, initial_rf, end_void, relet_rf):
+    '''Array version of rent_review_yp, e.g. for a datetime64[D] array of cashflow_start dates'''
+    
+    discount_factor = (1+discount_rate)
+    remaining_term = years_between_array(cashflow_start, lease_termination)
+    yrs_review = yrs_to_review_array(cashflow_start, review_date)
+    rr_val = ((1 - (1/discount_factor)**(remaining_term - yrs_review)) / discount_rate) * ((1/discount_factor)**yrs_review)
+    rr_val = np.where(review_date == lease_termination, 0.0, rr_val)
+    return np.maximum(0, rr_val)
+
+
+def reversion_yp_array(discount_rate, cashflow_start, lease_start, review_date, lease_termination, initial_void, initial_rf, end_void, relet_rf):
+    '''Array version of reversion_yp, e.g. for a datetime64[D] array of cashflow_start dates'''
+    
+    discount_factor = (1+discount_rate)
+    rent_date = add_months_array(lease_start, np.asarray(initial_rf).astype(np.int64))
+    reversion_rent_start = add_months_array(lease_termination, np.asarray(end_void+relet_rf).astype(np.int64))
+    yrs_reversion = yrs_to_reversion_array(cashflow_start, lease_termination, initial_void, initial_rf, end_void, relet_rf)
+    
+    void_yp_rent_start = ((1-(discount_factor) ** -years_between_array(rent_date, lease_termination))/discount_rate) * (1/discount_factor) ** yrs_to_review_array(cashflow_start, rent_date)
+    void_yp_to_expiry = (1/discount_rate) * (1/discount_factor) ** years_between_array(cashflow_start, reversion_rent_start)
+    let_rev_yp = (1/discount_rate) * ((1/discount_factor) ** yrs_reversion)
+    
+    return np.where(lease_start > cashflow_start, void_yp_rent_start + void_yp_to_expiry, let_rev_yp)
+
+# rentyp = rent_yp(0.0705, date(2024, 12, 31), date(2029, 6, 7), date(2034, 5, 27))
+# rr_yp = rent_review_yp(0.0705, date(2024, 12, 31), date(2019, 6, 7), date(2029, 6, 7), date(2034, 5, 27), 0, 0, 0, 12)
+# rev_yp = reversion_yp(0.0705, date(2024, 12, 31), date(2019, 6, 7), date(2029, 6, 7), date(2034, 5, 27), 0, 0, 0, 12)
 
 def initial_yield_valuation(current_rent, net_initial_yield, purchasers_costs=0.068):
     '''function to calculate the valuation of a property based on the initial yield'''
     
     value = current_rent / net_initial_yield / (1 + purchasers_costs)
-    return round(value, -4)
+    # arrays of rents/yields (e.g. a sensitivity grid) are rounded element-wise
+    return round(value, -4) if np.ndim(value) == 0 else np.round(value, -4)
+
+
+def annual_exit_rent(contracted_rent, reviewed_rent, relet_rent):
+    '''function to calculate the annualised exit rent from the final month's monthly rents, i.e. the highest of the contracted, reviewed and relet rent'''
+    
+    return np.maximum(np.maximum(contracted_rent, reviewed_rent), relet_rent) * 12
 
 
 def valuation(current_rent, rent_yp, headline_erv, ner_discount, rent_review_yp, reversion_yp):
@@ -145,10 +203,158 @@ def valuation(current_rent, rent_yp, headline_erv, ner_discount, rent_review_yp,
 
 # print(valuation(220816, rentyp, 325286, 1, rr_yp, rev_yp))
 
+def valuation_array(current_rent, rent_yp, headline_erv, ner_discount, rent_review_yp, reversion_yp):
+    '''Array version of valuation, for arrays of YPs (e.g. one per cashflow month)'''
+    
+    net_effective_rent = headline_erv * ner_discount
+    review_val = np.where(current_rent > net_effective_rent, current_rent, net_effective_rent) * rent_review_yp
+    return current_rent * rent_yp + review_val + headline_erv * reversion_yp
+
+
+def valuation_timeseries(valuation_dates, valuation_yield, lease_start, review_date, lease_termination, current_rent, headline_erv, ner_discount, refurb_duration, void_period, rf):
+    '''function to calculate the term and reversion valuation at every date of a datetime64[D] array of valuation dates
+    (e.g. each period start of a cashflow) in one vectorised pass, whereby:
+    - headline_erv is the annual ERV of the unit (not per sq ft)
+    - the relet void is the refurb plus void period, followed by the rent free period
+    - once the lease has ended, the initial void is the months left until the relet rent starts'''
+    
+    valuation_dates = np.asarray(valuation_dates, dtype="datetime64[D]")
+    lease_start = np.datetime64(lease_start, "D")
+    review_date = np.datetime64(review_date, "D")
+    lease_termination = np.datetime64(lease_termination, "D")
+    end_void = int(refurb_duration + void_period)
+    relet_rf = int(rf)
+    
+    rent_start = add_months_array(lease_termination, end_void + relet_rf)
+    initial_void = np.maximum(0, (rent_start.astype("datetime64[M]") - valuation_dates.astype("datetime64[M]")).astype(np.int64))
+    
+    yp_inputs = (valuation_yield, valuation_dates, lease_start, review_date, lease_termination, initial_void, 0, end_void, relet_rf)
+    return valuation_array(
+        current_rent,
+        rent_yp_array(valuation_yield, valuation_dates, review_date, lease_termination),
+        headline_erv,
+        ner_discount,
+        rent_review_yp_array(*yp_inputs),
+        reversion_yp_array(*yp_inputs)
+    )
+
 ### Valuation function works in this one unit example. Work needs to be done in making the calling of this function more efficient (i.e. done while inputting the rest of the stuff for the cashflow..).
 ### Can we make this valuation function work so that it get's applied on each cashflow month, showing value change over time. 
+### -> valuation_timeseries does this for every period start, create_cashflow adds it as the 'valuation' column.
+
+
+CATEGORIES = [
+    "contracted_rent",
+    "reviewed_rent",
+    "refurbishment_period",
+    "void_period",
+    "rf_period",
+    "relet_rent"
+]
 
 
+def month_grid(cashflow_start, cashflow_term):
+    '''function to build the monthly grid of a cashflow once, returning:
+    - months: the datetime64[M] month of each period
+    - period_start: the cashflow start date rolled forward i months (datetime64[D], as add_months(cashflow_start, i))
+    - period_end: the last day of each period's month (datetime64[D])'''
+    
+    start = np.datetime64(cashflow_start, "D")
+    months = start.astype("datetime64[M]") + np.arange(int(cashflow_term))
+    period_start = add_months_array(start, np.arange(int(cashflow_term)))
+    period_end = (months + 1).astype("datetime64[D]") - 1
+    return months, period_start, period_end
+
+
+def lease_phase_dates(lease_termination, refurb_duration, void_period, rf):
+    '''function to calculate the phase boundaries after lease termination, i.e. the refurb end, void end, rent free end and relet dates'''
+    
+    refurb_end = add_months(lease_termination, int(refurb_duration))
+    void_end = add_months(refurb_end, int(void_period))
+    rf_end = add_months(void_end, int(rf))
+    # relet_date is lease_termination plus refurb_duration and void_period (in months)
+    relet_date = add_months(lease_termination, int(refurb_duration + void_period))
+    return refurb_end, void_end, rf_end, relet_date
+
+
+def cashflow_components(
+    period_start,
+    lease_termination,
+    review_date,
+    refurb_end,
+    void_end,
+    rf_end,
+    relet_date,
+    unit_area,
+    current_rent,
+    headline_erv,
+    ner_discount,
+    refurb_cost,
+    refurb_duration,
+    vacant_rates_percent,
+    rates_relief,
+    vacant_sc,
+    relet_rent=None
+    ):
+    '''Vectorised monthly cashflow by category. period_start is a datetime64[D] array and the phase dates are
+    datetime64[D] values; the remaining inputs are scalars (or arrays that broadcast against period_start).
+    
+    Returns a dict of category -> monthly amount arrays, and an integer array holding the index into CATEGORIES
+    of each month's category (-1 where no category applies).'''
+    
+    ps = period_start
+    reviewed_rent = (headline_erv * unit_area) * ner_discount
+    annual_new_rent = headline_erv * unit_area if relet_rent is None else relet_rent
+    monthly_new_rent = annual_new_rent / 12
+    
+    # Monthly refurb cost per month (as a negative cashflow)
+    monthly_refurb_cost = np.where(refurb_duration == 0, 0.0, -(refurb_cost * unit_area) / np.where(refurb_duration == 0, 1, refurb_duration))
+    
+    # Masks for each phase, the later phases override the earlier ones in the same order as the monthly rules
+    let = ps < lease_termination
+    reviewed = let & (review_date < lease_termination) & (ps >= review_date) & (reviewed_rent > current_rent)
+    refurb = (lease_termination <= ps) & (ps < refurb_end)
+    void = (refurb_end <= ps) & (ps < void_end)
+    rent_free = (void_end <= ps) & (ps < rf_end)
+    relet = ~rent_free & (ps >= relet_date)
+    
+    # Rental income from current rent until lease termination (current_rent is annual; convert to monthly)
+    rent_amount = np.where(let, current_rent / 12, 0.0)
+    rent_amount = np.where(reviewed, reviewed_rent / 12, rent_amount)
+    
+    # Void period costs: vacant service charge, plus vacant rates once beyond the rates relief period
+    vacant_sc_amount = -(unit_area * vacant_sc / 12)
+    vacant_rates_amount = -(vacant_rates_percent * (headline_erv * unit_area) / 12)
+    void_month = (ps - refurb_end).astype(np.int64) // 30 + 1
+    void_amount = np.where(void_month > rates_relief, vacant_sc_amount + vacant_rates_amount, vacant_sc_amount)
+    rent_amount = np.where(void, void_amount, rent_amount)
+    
+    rent_amount = np.where(rent_free, -monthly_new_rent, rent_amount)
+    rent_amount = np.where(relet, monthly_new_rent, rent_amount)
+    refurb_cost_amount = np.where(refurb, monthly_refurb_cost, 0.0)
+    
+    category = np.full(ps.shape, -1, dtype=np.int8)
+    for code, mask in enumerate([let, reviewed, refurb, void, rent_free, relet]):
+        category[mask] = code
+    
+    # Assign the computed cashflow to the corresponding category series
+    amount = rent_amount + refurb_cost_amount
+    columns = {cat: np.where(category == code, amount, 0.0) for code, cat in enumerate(CATEGORIES)}
+    
+    # Rent free months also carry the relet rent (the inverse of the rf_period value)
+    columns["relet_rent"] = np.where(columns["rf_period"] < 0, -columns["rf_period"], columns["relet_rent"])
+    
+    return columns, category
+
+
+def category_labels(category):
+    '''function to map the integer category codes from cashflow_components back to their names (NaN where no category applies)'''
+    
+    labels = np.array(CATEGORIES + [np.nan], dtype=object)
+    return labels[category]
+
+
+@accepts_lease
 def create_cashflow(
     cashflow_start: date,
     cashflow_term: float,
@@ -170,8 +376,12 @@ def create_cashflow(
     vacant_sc: float,
     relet_rent: Optional[float] = None,
     entry_price: float = 0.0,
-    exit_price: float = 0.0,
-    quarterly_in_advance: bool = True
+    exit_price: Optional[float] = 0.0,
+    quarterly_in_advance: bool = True,
+    rent_convention: Optional[str] = None,
+    valuation_yield: Optional[float] = None,
+    output: str = "dataframe",
+    purchasers_costs: float = 0.068
     ):
     '''Input unit and lease details to calculate a cashflow for X inputted months,
     plus an initial entry price and a final exit price.
@@ -180,186 +390,140 @@ def create_cashflow(
         relet_rent: Optional; if not provided, defaults to None.
         review_date and lease_termination: Must be datetime.date objects.
         entry_price: Cashflow amount added at the start (a day before the first period).
-        exit_price: Cashflow amount added at the end (a day after the final period).
+        exit_price: Cashflow amount added at the end (a day after the final period). If None, it's calculated in the same
+            pass from the final month's rent (see annual_exit_rent) capitalised at exit_cap, net of purchasers_costs.
+        quarterly_in_advance: If True rent is paid quarterly in advance, otherwise monthly in advance.
+        rent_convention: Optional; a rent payment convention from rent_timing.RENT_CONVENTIONS, overrides quarterly_in_advance.
+        valuation_yield: Optional; the yield for the term and reversion valuation at each period start, defaults to exit_cap.
+        output: "dataframe" (default) for the full DataFrame used by the Streamlit page, with the category, cashflow_line
+            and valuation columns. "arrays" for batch/API use, returning a dict of NumPy arrays (month, cashflow,
+            period_start, period_end as datetime64[D], each category and total_rent) with the same rows, without pandas.
+        purchasers_costs: Purchasers' costs for the exit valuation when exit_price is None.
+        lease: Optional; a lease.Lease record to take the inputs from instead of passing them one by one, e.g.
+            create_cashflow(lease=lease, output="arrays"). Inputs passed as well override the lease's.
     '''
     if not isinstance(review_date, date):
         raise TypeError("review_date must be a datetime.date instance")
     if not isinstance(lease_termination, date):
         raise TypeError("lease_termination must be a datetime.date instance")
     
-    cashflows = []
-    # Define the distinct categories you want cashflow series for
-    categories = [
-        "contracted_rent",
-        "reviewed_rent",
-        "refurbishment_period",
-        "void_period",
-        "rf_period",
-        "relet_rent"
-    ]
-    # Calculate relet_date as lease_termination plus refurb_duration and void_period (in months)
-    relet_months = int(refurb_duration + void_period)
-    relet_date = add_months(lease_termination, relet_months)
-    # print(relet_date)
-
-    # Monthly refurb cost per month (as a negative cashflow)
-    if refurb_duration == 0:
-        monthly_refurb_cost = 0
-    else:
-        monthly_refurb_cost = -(refurb_cost * unit_area) / refurb_duration
-
-    for i in range(int(cashflow_term)):
-        # Initialize a row with zero for each category
-        row = {cat: 0.0 for cat in categories}
-
-        period_start = add_months(cashflow_start, i)
-        period_end = add_months(cashflow_start, i + 1)
-        days_in_period = (period_end - period_start).days
-
-        rent_amount = 0.0
-        category = None
-
-        # Rental income from current rent until lease termination
-        if period_start < lease_termination:
-            # current_rent is annual; convert to monthly
-            monthly_rent = current_rent / 12
-            rent_amount = monthly_rent
-            category = "contracted_rent"
-            if review_date < lease_termination and period_start >= review_date and ((headline_erv * unit_area) * ner_discount) > current_rent:
-                reviewed_monthly_rent = ((headline_erv * unit_area) * ner_discount) / 12
-                rent_amount = reviewed_monthly_rent
-                category = "reviewed_rent"
-
-        refurb_cost_amount = 0.0
-        refurb_end = add_months(lease_termination, int(refurb_duration))
-        # Refurbishment costs apply for the refurb period (starting at lease_termination)
-        if lease_termination <= period_start < refurb_end:
-            refurb_cost_amount = monthly_refurb_cost
-            category = "refurbishment_period"
-
-        void_end = add_months(refurb_end, int(void_period))
-        # Void period after refurbishment and before relet
-        if refurb_end <= period_start < void_end:
-            category = "void_period"
-            # Calculate vacant service charge
-            vacant_sc_amount = -(unit_area * vacant_sc / 12)
-            rent_amount = vacant_sc_amount
-
-            # Calculate vacant rates if beyond rates relief period
-            void_month = (period_start - refurb_end).days // 30 + 1
-            if void_month > rates_relief:
-                vacant_rates_amount = -(vacant_rates_percent * (headline_erv * unit_area) / 12)
-                rent_amount = vacant_sc_amount + vacant_rates_amount
-
-        rf_end = add_months(void_end, int(rf))
-        annual_new_rent = relet_rent if relet_rent is not None else headline_erv * unit_area
-        monthly_new_rent = annual_new_rent / 12
-        if void_end <= period_start < rf_end:
-            rent_amount = -monthly_new_rent
-            category = "rf_period"
-        elif period_start >= relet_date:
-            rent_amount = monthly_new_rent
-            category = "relet_rent"
-
-        # Assign the computed cashflow to the corresponding category series
-        if category:
-            row[category] = rent_amount + refurb_cost_amount
-            row["category"] = category
-
-        # If rf_period is less than 0, update the relet_rent value in that row to be the inverse of the rf_period value
-        if row.get("rf_period", 0) < 0:
-            row["relet_rent"] = -row["rf_period"]
-            
-        cashflows.append(row)
-    
-    # Convert the list of cashflows to a DataFrame
-    cashflows_df = pd.DataFrame(cashflows)
-    # Set up a month index starting at 0 for the computed cashflows
-    cashflows_df['month'] = range(len(cashflows))
-    
-    cashflows_df['period_start'] = cashflows_df['month'].apply(lambda m: add_months(cashflow_start, m))
-    cashflows_df['period_end'] = cashflows_df['period_start'].apply(lambda d: d.replace(day=calendar.monthrange(d.year, d.month)[1]))
-    
-    # Transform rent columns to quarterly in advance
-    if quarterly_in_advance==True:
-        quarter_months = {4, 7, 10, 1} # offset quarters by one month (assuming rent received on day 1 of month following quarter date)
-        # Identify rent columns that need quarterly treatment
-        rent_columns = ["contracted_rent", "reviewed_rent", "rf_period", "relet_rent"]
-
-        # First sum all rent columns into a total_rent column
-        cashflows_df['total_rent'] = cashflows_df[rent_columns].sum(axis=1)
-        
-        # Create a copy to store the original monthly rents
-        monthly_rents = cashflows_df['total_rent'].copy()
-        
-        # Apply quarterly-in-advance logic
-        for i in range(len(cashflows_df)):
-            if cashflows_df.iloc[i]["period_start"].month in quarter_months:
-                # For a quarter-starting month, sum this month and the next two (if they exist)
-                quarter_sum = monthly_rents.iloc[i]
-                if i+1 < len(monthly_rents):
-                    quarter_sum += monthly_rents.iloc[i+1]
-                    cashflows_df.loc[cashflows_df.index[i+1], 'total_rent'] = 0
-                if i+2 < len(monthly_rents):
-                    quarter_sum += monthly_rents.iloc[i+2]
-                    cashflows_df.loc[cashflows_df.index[i+2], 'total_rent'] = 0
-                
-                # Set the quarterly payment at the quarter-starting month
-                cashflows_df.loc[cashflows_df.index[i], 'total_rent'] = quarter_sum
-        
-        # # Set individual rent columns to 0 to avoid double counting
-        # for rc in rent_columns:
-        #     if rc in cashflows_df.columns:
-        #         cashflows_df[rc] = 0
-                
+    # Calculate the phase boundaries once, they don't change from month to month
+    with stage("create_cashflow.phase_dates"):
+        refurb_end, void_end, rf_end, relet_date = lease_phase_dates(lease_termination, refurb_duration, void_period, rf)
+
+    # Build the monthly grid once and derive every category column from it with boolean masks
+    with stage("create_cashflow.components"):
+        months, period_start, period_end = month_grid(cashflow_start, cashflow_term)
+        columns, category = cashflow_components(
+            period_start,
+            lease_termination=np.datetime64(lease_termination, "D"),
+            review_date=np.datetime64(review_date, "D"),
+            refurb_end=np.datetime64(refurb_end, "D"),
+            void_end=np.datetime64(void_end, "D"),
+            rf_end=np.datetime64(rf_end, "D"),
+            relet_date=np.datetime64(relet_date, "D"),
+            unit_area=unit_area,
+            current_rent=current_rent,
+            headline_erv=headline_erv,
+            ner_discount=ner_discount,
+            refurb_cost=refurb_cost,
+            refurb_duration=refurb_duration,
+            vacant_rates_percent=vacant_rates_percent,
+            rates_relief=rates_relief,
+            vacant_sc=vacant_sc,
+            relet_rent=relet_rent
+        )
+
+    # Transform rent columns to their payment dates (quarterly in advance by default)
+    if rent_convention is None:
+        rent_convention = "quarterly_in_advance" if quarterly_in_advance else "monthly_in_advance"
+
+    # First sum all rent columns into a total rent, then move each payment period's rent to its payment month
+    with stage("create_cashflow.retime_rent"):
+        monthly_rents = columns["contracted_rent"] + columns["reviewed_rent"] + columns["rf_period"] + columns["relet_rent"]
+        total_rent = retime_rent(monthly_rents, months, rent_convention)
     
     # Calculate the total cashflow for each month
-    cashflows_df['cashflow'] = cashflows_df[['total_rent', 'refurbishment_period', 'void_period']].sum(axis=1)
-    # print(cashflows_df)
-    
-    # Incorporate entry_price and exit_price. Create an entry row one day before cashflow_start
-    entry_row = pd.DataFrame({
-        'month': [0],
-        'cashflow': [-entry_price],
-        'period_start': [cashflow_start - timedelta(days=1)],
-        'period_end': [cashflow_start - timedelta(days=1)],
-        'category': ['entry']
-    })
-    
-    # Shift main cashflows by 1 month index so they come after the entry row
-    cashflows_df['month'] = cashflows_df['month'] + 1
-    
-    # Create an exit row one day after the final period_end of the main cashflows
-    exit_row = pd.DataFrame({
-        'month': [cashflows_df['month'].max() + 1],
-        'cashflow': [exit_price],
-        'period_start': [cashflows_df.iloc[-1]['period_end'] + timedelta(days=1)],
-        'period_end': [cashflows_df.iloc[-1]['period_end'] + timedelta(days=1)],
-        'category': ['exit']
-    })
-    
-    # Concatenate entry row, main cashflows, and exit row
-    cashflows_df = pd.concat([entry_row, cashflows_df, exit_row], ignore_index=True)
-    
-
-    # First compute the basic cashflow line with entry/exit adjustments
-    cashflows_df['cashflow_line'] = cashflows_df.apply(
-        lambda row: row['cashflow'] + entry_price if row['category'] == 'entry' else 
-                    (row['cashflow'] - exit_price if row['category'] == 'exit' else row['cashflow']),
-        axis=1
-    )
-
-    # Smooth rent categories with zero cashflow
-    for i in range(1, len(cashflows_df)):
-        current_cat = str(cashflows_df.iloc[i].get('category', ''))
-        if 'rent' in current_cat.lower() and cashflows_df.iloc[i]['cashflow'] == 0:
-            cashflows_df.at[i, 'cashflow_line'] = cashflows_df.at[i-1, 'cashflow_line']
-    # Reorder columns if necessary
-    print(cashflows_df)
+    cashflow = total_rent + columns["refurbishment_period"] + columns["void_period"]
+    
+    # Exit price from the final month's rent, so the cashflow, exit value and IRR are consistent in one pass
+    if exit_price is None:
+        exit_rent = annual_exit_rent(columns["contracted_rent"][-1], columns["reviewed_rent"][-1], columns["relet_rent"][-1])
+        exit_price = initial_yield_valuation(exit_rent, exit_cap, purchasers_costs)
+    
+    # Incorporate entry_price and exit_price, as an entry row one day before cashflow_start
+    # and an exit row one day after the final period_end
+    with stage("create_cashflow.rows"):
+        entry_date = np.datetime64(cashflow_start, "D") - 1
+        exit_date = period_end[-1] + 1
+        dates = np.concatenate([[entry_date], period_start, [exit_date]])
+        no_value = np.array([np.nan])
+        rows = {
+            'month': np.arange(len(cashflow) + 2),
+            'cashflow': np.concatenate([[-entry_price], cashflow, [exit_price]]),
+            'period_start': dates,
+            'period_end': np.concatenate([[entry_date], period_end, [exit_date]]),
+        }
+        for cat in CATEGORIES:
+            rows[cat] = np.concatenate([no_value, columns[cat], no_value])
+        rows['total_rent'] = np.concatenate([no_value, total_rent, no_value])
+    
+    if output == "arrays":
+        return rows
+    if output != "dataframe":
+        raise ValueError("output must be 'dataframe' or 'arrays'")
+
+    # Mark-to-model term and reversion value at each period start
+    with stage("create_cashflow.valuation"):
+        valuation = valuation_timeseries(
+            dates,
+            exit_cap if valuation_yield is None else valuation_yield,
+            lease_start,
+            review_date,
+            lease_termination,
+            current_rent,
+            headline_erv * unit_area,
+            ner_discount,
+            refurb_duration,
+            void_period,
+            rf
+        )
+    return cashflow_dataframe(rows, category, valuation)
+
+
+def cashflow_dataframe(rows, category, valuation):
+    '''function to build the display DataFrame from the output="arrays" rows of create_cashflow, the monthly category
+    codes from cashflow_components and the valuation at each row'''
+    
+    # pandas is only imported for the DataFrame output, so batch callers and worker processes don't pay for it
+    import pandas as pd
+
+    with stage("create_cashflow.dataframe"):
+        cashflows_df = pd.DataFrame({
+            'month': rows['month'],
+            'cashflow': rows['cashflow'],
+            'period_start': rows['period_start'].astype(object),
+            'period_end': rows['period_end'].astype(object),
+            'category': np.concatenate([['entry'], category_labels(category), ['exit']]),
+            **{col: rows[col] for col in CATEGORIES + ['total_rent']}
+        })
+
+    # Cashflow line with entry/exit removed, and rent months with zero cashflow (e.g. between quarterly payments)
+    # smoothed by carrying the previous month's value forward
+    with stage("create_cashflow.cashflow_line"):
+        cashflow_line = rows['cashflow'].copy()
+        cashflow_line[[0, -1]] = 0.0
+        rent_codes = [CATEGORIES.index(cat) for cat in CATEGORIES if 'rent' in cat]
+        smooth = np.concatenate([[False], np.isin(category, rent_codes) & (cashflow_line[1:-1] == 0), [False]])
+        carry_from = np.maximum.accumulate(np.where(smooth, 0, np.arange(len(cashflow_line))))
+        cashflows_df['cashflow_line'] = cashflow_line[carry_from]
+    cashflows_df['valuation'] = valuation
     return cashflows_df
 
 # Test the function
 if __name__ == "__main__":
+    import itertools
+
     cashflow = create_cashflow(
         cashflow_start=date(2025, 1, 1),
         cashflow_term=60,
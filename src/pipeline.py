@@ -0,0 +1,145 @@
+import itertools
+
+import numpy as np
+
+from batch_xirr import xirr_batch, xnpv_batch
+from npv_irr_calculations import CATEGORIES
+from portfolio import create_portfolio_cashflows, unit_cashflow_series
+
+
+def lease_chunks(leases, chunk_size=1000):
+    '''function to group an iterator of leases (one dict of create_cashflow inputs per unit) into columnar chunks of
+    at most chunk_size units, without reading ahead any further than the current chunk'''
+
+    leases = iter(leases)
+    while True:
+        chunk = list(itertools.islice(leases, chunk_size))
+        if not chunk:
+            return
+        yield {field: [lease[field] for lease in chunk] for field in chunk[0]}
+
+
+def cashflow_batches(chunks, discount_rate=0.1):
+    '''Generator of portfolio cashflows, one chunk of units at a time. chunks is an iterable of columnar portfolio
+    tables (e.g. from lease_chunks, bulk_io.lease_batches or DataFrames), and each is modelled with
+    create_portfolio_cashflows and yielded with its per-unit irr and npv before the next chunk is read.'''
+
+    for leases in chunks:
+        yield create_portfolio_cashflows(leases, discount_rate)
+
+
+def unit_cashflows(batches):
+    '''Generator of per-unit cashflow arrays from cashflow_batches, for consumers that handle one unit at a time.
+    Each unit is a dict of its dates and cashflows (entry, months and exit rows), category components and metrics.'''
+
+    for result in batches:
+        dates, flows = unit_cashflow_series(result)
+        for unit, term in enumerate(result["term"]):
+            rows = slice(0, term + 1)
+            yield {
+                "dates": np.append(dates[unit, rows], dates[unit, -1]),
+                "cashflow": np.append(flows[unit, rows], flows[unit, -1]),
+                "components": {cat: values[unit, :term] for cat, values in result["components"].items()},
+                "irr": result["irr"][unit],
+                "npv": result["npv"][unit],
+            }
+
+
+class FundAccumulator:
+    '''Running fund-level totals of a stream of cashflow batches, held on dense date axes that only grow with the
+    span of dates seen (not the number of units), so memory stays flat however large the portfolio:
+    - net cashflow per day (entry and exit rows included), for the fund IRR and NPV
+    - cashflow and each category per month
+    - count, NPV total and IRR range of the units
+    '''
+
+    def __init__(self):
+        self.units = 0
+        self.unit_npv_total = 0.0
+        self.unit_irr_min = np.inf
+        self.unit_irr_max = -np.inf
+        self.day_origin = None
+        self.daily = np.zeros(0)
+        self.month_origin = None
+        self.monthly = {name: np.zeros(0) for name in ["cashflow"] + CATEGORIES + ["total_rent"]}
+
+    def add(self, result):
+        '''function to add a batch from cashflow_batches to the running totals'''
+
+        dates, flows = unit_cashflow_series(result)
+        valid = ~np.isnat(dates)
+        self._add_daily(dates[valid], flows[valid])
+
+        months = result["period_start"].astype("datetime64[M]")
+        in_term = ~np.isnat(months)
+        self._add_monthly(months[in_term], {"cashflow": result["cashflow"][in_term],
+                                            **{cat: values[in_term] for cat, values in result["components"].items()}})
+
+        self.units += len(result["term"])
+        self.unit_npv_total += float(np.sum(result["npv"]))
+        if np.isfinite(result["irr"]).any():
+            self.unit_irr_min = min(self.unit_irr_min, float(np.nanmin(result["irr"])))
+            self.unit_irr_max = max(self.unit_irr_max, float(np.nanmax(result["irr"])))
+        return self
+
+    def _add_daily(self, dates, flows):
+        self.day_origin, (self.daily,) = _grow(self.day_origin, [self.daily], dates)
+        np.add.at(self.daily, (dates - self.day_origin).astype(np.int64), flows)
+
+    def _add_monthly(self, months, values):
+        names = list(self.monthly)
+        self.month_origin, grown = _grow(self.month_origin, [self.monthly[name] for name in names], months)
+        self.monthly = dict(zip(names, grown))
+        index = (months - self.month_origin).astype(np.int64)
+        for name, amounts in values.items():
+            self.monthly[name] += np.bincount(index, weights=amounts, minlength=len(self.monthly[name]))
+
+    def daily_cashflow(self):
+        '''function to return the fund's net cashflow on each day that has one, as (dates, cashflows)'''
+
+        days = np.flatnonzero(self.daily)
+        return self.day_origin + days, self.daily[days]
+
+    def monthly_totals(self):
+        '''function to return the fund's monthly cashflow and category subtotals, as (months, dict of arrays)'''
+
+        months = self.month_origin + np.arange(len(self.monthly["cashflow"]))
+        return months, dict(self.monthly)
+
+    def irr(self):
+        dates, flows = self.daily_cashflow()
+        return float(xirr_batch(dates, flows)) if len(flows) else np.nan
+
+    def npv(self, discount_rate):
+        '''function to calculate the fund NPV at discount_rate, discounted to the fund's first cashflow date'''
+
+        dates, flows = self.daily_cashflow()
+        return float(xnpv_batch(discount_rate, dates, flows)) if len(flows) else 0.0
+
+
+def _grow(origin, series, dates):
+    '''function to extend dense date-indexed arrays (sharing one origin) with zeros so they cover dates'''
+
+    if len(dates) == 0:
+        return origin, series
+    first, last = dates.min(), dates.max()
+    if origin is None:
+        return first, [np.zeros(int((last - first).astype(np.int64)) + 1) for _ in series]
+    new_origin = min(origin, first)
+    before = int((origin - new_origin).astype(np.int64))
+    after = max(int((last - new_origin).astype(np.int64)) + 1 - before - len(series[0]), 0)
+    if before or after:
+        series = [np.concatenate([np.zeros(before), values, np.zeros(after)]) for values in series]
+    return new_origin, series
+
+
+def stream_portfolio(leases, discount_rate=0.1, chunk_size=1000):
+    '''Value a portfolio of any size from a lease iterator (one dict per unit) with bounded memory: the leases are
+    modelled chunk_size units at a time and folded into a FundAccumulator, so only one chunk is held at once.
+
+    Returns the FundAccumulator, e.g. .irr(), .npv(rate), .monthly_totals() and .unit_npv_total.'''
+
+    fund = FundAccumulator()
+    for result in cashflow_batches(lease_chunks(leases, chunk_size), discount_rate):
+        fund.add(result)
+    return fund
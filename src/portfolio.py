@@ -0,0 +1,144 @@
+import numpy as np
+
+from batch_xirr import xirr_batch, xnpv_rows
+from date_arithmetic import add_months_array
+from lease import LeaseArray
+from npv_irr_calculations import annual_exit_rent, cashflow_components, initial_yield_valuation
+from rent_timing import retime_rent
+
+
+def portfolio_columns(leases):
+    '''function to turn a portfolio of leases (a LeaseArray, or a DataFrame or dict of equal length columns, one row per
+    unit) into a dict of NumPy arrays, with dates as datetime64[D] and missing relet rents and exit prices as NaN.
+    A table is validated by converting it to a LeaseArray, a LeaseArray already has been.'''
+
+    if not isinstance(leases, LeaseArray):
+        leases = LeaseArray(leases)
+    return dict(leases.columns)
+
+
+def portfolio_cashflow_matrix(leases):
+    '''function to model every unit of a portfolio at once on a units x months grid (padded to the longest
+    cashflow_term), returning the dict described in create_portfolio_cashflows without the irr and npv'''
+
+    lease = portfolio_columns(leases)
+    n_units = len(lease["cashflow_start"])
+    term = lease["cashflow_term"].astype(np.int64)
+    offsets = np.arange(term.max() if n_units else 0)
+    valid = offsets < term[:, None]
+
+    # Monthly grid for every unit, each starting at its own cashflow_start
+    start = lease["cashflow_start"][:, None]
+    months = start.astype("datetime64[M]") + offsets
+    period_start = add_months_array(start, offsets)
+
+    # Phase boundaries per unit, as lease_phase_dates does for a single unit
+    lease_termination = lease["lease_termination"]
+    refurb_end = add_months_array(lease_termination, lease["refurb_duration"].astype(np.int64))
+    void_end = add_months_array(refurb_end, lease["void_period"].astype(np.int64))
+    rf_end = add_months_array(void_end, lease["rf"].astype(np.int64))
+    relet_date = add_months_array(lease_termination, (lease["refurb_duration"] + lease["void_period"]).astype(np.int64))
+    relet_rent = np.where(np.isnan(lease["relet_rent"]), lease["headline_erv"] * lease["unit_area"], lease["relet_rent"])
+
+    column = lambda values: values[:, None]
+    columns, category = cashflow_components(
+        period_start,
+        lease_termination=column(lease_termination),
+        review_date=column(lease["review_date"]),
+        refurb_end=column(refurb_end),
+        void_end=column(void_end),
+        rf_end=column(rf_end),
+        relet_date=column(relet_date),
+        unit_area=column(lease["unit_area"]),
+        current_rent=column(lease["current_rent"]),
+        headline_erv=column(lease["headline_erv"]),
+        ner_discount=column(lease["ner_discount"]),
+        refurb_cost=column(lease["refurb_cost"]),
+        refurb_duration=column(lease["refurb_duration"]),
+        vacant_rates_percent=column(lease["vacant_rates_percent"]),
+        rates_relief=column(lease["rates_relief"]),
+        vacant_sc=column(lease["vacant_sc"]),
+        relet_rent=column(relet_rent),
+    )
+    columns = {cat: np.where(valid, values, 0.0) for cat, values in columns.items()}
+    category = np.where(valid, category, -1)
+
+    # Re-time the rent to each unit's payment convention
+    monthly_rents = columns["contracted_rent"] + columns["reviewed_rent"] + columns["rf_period"] + columns["relet_rent"]
+    total_rent = np.zeros_like(monthly_rents)
+    for convention in np.unique(lease["rent_convention"]):
+        units = lease["rent_convention"] == convention
+        total_rent[units] = retime_rent(monthly_rents[units], months[units], convention, term[units])
+    columns["total_rent"] = total_rent
+    cashflow = total_rent + columns["refurbishment_period"] + columns["void_period"]
+
+    # Entry a day before the cashflow start, exit a day after the final period end
+    entry_date = lease["cashflow_start"] - np.timedelta64(1, "D")
+    exit_date = (lease["cashflow_start"].astype("datetime64[M]") + term).astype("datetime64[D]")
+    entry_cashflow = -lease["entry_price"]
+    exit_cashflow = lease["exit_price"]
+    # Units without an exit price are valued on their exit rent, as create_cashflow does when exit_price is None
+    derive_exit = np.isnan(exit_cashflow)
+    if derive_exit.any():
+        result = {"term": term, "components": columns}
+        exit_value = initial_yield_valuation(exit_rent(result), lease["exit_cap"], lease["purchasers_costs"])
+        exit_cashflow = np.where(derive_exit, exit_value, exit_cashflow)
+
+    return {
+        "period_start": np.where(valid, period_start, np.datetime64("NaT")),
+        "cashflow": cashflow,
+        "components": columns,
+        "category": category,
+        "term": term,
+        "entry_date": entry_date,
+        "entry_cashflow": entry_cashflow,
+        "exit_date": exit_date,
+        "exit_cashflow": exit_cashflow,
+    }
+
+
+def create_portfolio_cashflows(leases, discount_rate):
+    '''Batch version of create_cashflow for a whole portfolio. Every unit is modelled at once on a units x months
+    grid (padded to the longest cashflow_term) without building a DataFrame per unit.
+
+    Parameters:
+        leases: a LeaseArray, or a columnar table of unit/lease details, one row per unit, with the create_cashflow
+            parameters as columns (relet_rent, entry_price, exit_price, purchasers_costs, quarterly_in_advance and rent_convention are
+            optional). A missing (None/NaN) exit_price is calculated from the unit's exit rent and exit_cap.
+        discount_rate: discount rate for the NPVs, a single rate or one per unit.
+
+    Returns a dict of:
+        period_start: datetime64[D] units x months period start dates (NaT after a unit's term)
+        cashflow: units x months net cashflow, i.e. create_cashflow's cashflow without the entry and exit rows
+        components: dict of category -> units x months monthly amounts, plus total_rent
+        category: units x months index into CATEGORIES (-1 where no category applies)
+        entry_date, entry_cashflow, exit_date, exit_cashflow: per unit entry and exit rows
+        term: per unit number of months
+        irr, npv: per unit IRR and NPV of entry + monthly cashflows + exit
+    '''
+    result = portfolio_cashflow_matrix(leases)
+
+    # IRR and NPV of entry + monthly cashflows + exit for every unit at once, padding months are NaT with 0 cashflow
+    dates, flows = unit_cashflow_series(result)
+    result["irr"] = xirr_batch(dates, flows)
+    result["npv"] = xnpv_rows(discount_rate, dates, flows)
+    return result
+
+
+def unit_cashflow_series(result):
+    '''function to line up each unit's entry row, monthly cashflows and exit row from portfolio_cashflow_matrix as
+    units x (months + 2) date and cashflow matrices, ready for the batch XIRR/XNPV functions'''
+
+    dates = np.column_stack([result["entry_date"], result["period_start"], result["exit_date"]])
+    flows = np.column_stack([result["entry_cashflow"], result["cashflow"], result["exit_cashflow"]])
+    return dates, flows
+
+
+def exit_rent(result):
+    '''function to calculate each unit's annualised exit rent from portfolio_cashflow_matrix output (see annual_exit_rent)'''
+
+    last_month = np.maximum(result["term"] - 1, 0)[:, None]
+    components = result["components"]
+    final_rents = [np.take_along_axis(components[cat], last_month, axis=1)[:, 0]
+                   for cat in ["contracted_rent", "reviewed_rent", "relet_rent"]]
+    return annual_exit_rent(*final_rents)
@@ -0,0 +1,128 @@
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+
+# Stage timing is off by default. When off, stage() hands back a shared no-op context manager, so instrumented
+# code only pays for a flag check.
+_enabled = False
+_NO_OP = nullcontext()
+# Where the stages run in the current context (thread or task) are recorded, set by recording(): a StageCollector,
+# False for none, or None to follow the process-wide flag (enable/disable)
+_recording = ContextVar("profiling_recording", default=None)
+
+
+class StageCollector:
+    '''Collects the number of calls and total wall time of each named stage, e.g. "create_cashflow.retime_rent".
+    Locked as Streamlit sessions run in separate threads.'''
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.seconds[name] = self.seconds.get(name, 0.0) + seconds
+
+    def summary(self):
+        '''function to summarise the recorded stages as a DataFrame, slowest first'''
+
+        import pandas as pd
+
+        with self._lock:
+            rows = [(name, self.calls[name], self.seconds[name]) for name in self.calls]
+        summary = pd.DataFrame(rows, columns=["stage", "calls", "total_seconds"])
+        summary["mean_ms"] = summary["total_seconds"] / summary["calls"] * 1e3
+        return summary.sort_values("total_seconds", ascending=False, ignore_index=True)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+            self.seconds.clear()
+
+
+collector = StageCollector()
+
+
+class _Stage:
+    __slots__ = ("name", "collector", "start")
+
+    def __init__(self, name, collector):
+        self.name = name
+        self.collector = collector
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.collector.record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+def stage(name):
+    '''function to time a block as a named stage when profiling is enabled, e.g.
+        with stage("create_cashflow.components"):
+            ...'''
+
+    target = _recording.get()
+    if target is None:
+        return _Stage(name, collector) if _enabled else _NO_OP
+    return _Stage(name, target) if target else _NO_OP
+
+
+def enable(reset=False):
+    global _enabled
+    if reset:
+        collector.reset()
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    '''function to check whether stages run in the current context are recorded'''
+
+    target = _recording.get()
+    return _enabled if target is None else bool(target)
+
+
+@contextmanager
+def recording(target=None, enabled=True):
+    '''context manager to record the stages run by the enclosed code to target (a StageCollector, the module's
+    collector by default), or not to record them if enabled is False, whatever enable/disable have set. It only
+    applies to the current thread or task, so e.g. each Streamlit session can profile itself without timing the
+    sessions running alongside it.'''
+
+    token = _recording.set((target or collector) if enabled else False)
+    try:
+        yield target or collector
+    finally:
+        _recording.reset(token)
+
+
+@contextmanager
+def profile(reset=True):
+    '''context manager to record stage timings for the enclosed code, e.g.
+        with profile():
+            create_cashflow(**inputs)
+        print(report())'''
+
+    if reset:
+        collector.reset()
+    with recording(collector):
+        yield collector
+
+
+def report():
+    '''function to format the recorded stage timings as a text table'''
+
+    summary = collector.summary()
+    if summary.empty:
+        return "No stages recorded (is profiling enabled?)"
+    return summary.to_string(index=False, formatters={"total_seconds": "{:.4f}".format, "mean_ms": "{:.3f}".format})
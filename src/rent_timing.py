@@ -0,0 +1,79 @@
+import numpy as np
+
+# Rent payment conventions, whereby:
+# - period_months: the number of months of rent covered by each payment
+# - anchor_month: a calendar month (1-12) on which a payment period starts. English quarter days are offset
+#   by one month, assuming rent is received on day 1 of the month following the quarter day
+#   (25 Mar, 24 Jun, 29 Sep, 25 Dec -> Apr, Jul, Oct, Jan)
+# - in_advance: paid in the first month of the period if True, otherwise in the last month (in arrears)
+RENT_CONVENTIONS = {
+    "monthly_in_advance": {"period_months": 1, "anchor_month": 1, "in_advance": True},
+    "quarterly_in_advance": {"period_months": 3, "anchor_month": 1, "in_advance": True},
+    "quarterly_in_arrears": {"period_months": 3, "anchor_month": 1, "in_advance": False},
+    "half_yearly_in_advance": {"period_months": 6, "anchor_month": 4, "in_advance": True},
+}
+
+
+def get_convention(convention):
+    '''function to look up a rent payment convention by name, or pass through a spec dict with the same keys as RENT_CONVENTIONS'''
+
+    if isinstance(convention, str):
+        if convention not in RENT_CONVENTIONS:
+            raise ValueError(f"Unknown rent convention '{convention}', expected one of {list(RENT_CONVENTIONS)}")
+        return RENT_CONVENTIONS[convention]
+    return convention
+
+
+def payment_groups(months, convention, term=None):
+    '''function to split a grid of months into payment groups for a convention. months is a datetime64[M] array
+    whose last axis is time; each row is grouped independently. term is an optional number of months per row, any
+    months after it are padding and are kept out of the last payment group.
+
+    Returns the flat indices of the first month of every group. Months before the first payment period of a row:
+    - in advance: are paid as they fall, i.e. each one is its own group (the advance payment date is before the cashflow)
+    - in arrears: form a single group paid at the end of that part-period'''
+
+    spec = get_convention(convention)
+    months = np.asarray(months, dtype="datetime64[M]")
+    month_index = months.astype(np.int64)  # months since Jan 1970
+    period_start = (month_index - (spec["anchor_month"] - 1)) % spec["period_months"] == 0
+
+    if spec["in_advance"]:
+        after_first_payment = np.logical_or.accumulate(period_start, axis=-1)
+        group_start = period_start | ~after_first_payment
+    else:
+        group_start = period_start.copy()
+        group_start[..., 0] = True
+    if term is not None:
+        group_start |= np.arange(months.shape[-1]) == np.asarray(term)[..., None]
+    return np.flatnonzero(group_start)
+
+
+def retime_rent(monthly_rent, months, convention="quarterly_in_advance", term=None):
+    '''function to re-time a monthly rent array to the payment dates of a rent convention, so that each payment
+    month receives the sum of the rent for its payment period and the other months are set to 0.
+
+    Parameters:
+        monthly_rent: array of rent per month, with time on the last axis (one row per unit for a portfolio).
+        months: datetime64[M] array of the month of each period, broadcastable to monthly_rent.
+        convention: a name in RENT_CONVENTIONS or a spec dict with the same keys.
+        term: Optional; months per row when rows have different lengths, later months must hold 0 rent.
+    '''
+    spec = get_convention(convention)
+    rent = np.asarray(monthly_rent, dtype=float)
+    if spec["period_months"] == 1 or rent.size == 0:
+        return rent.copy()
+
+    months = np.broadcast_to(np.asarray(months, dtype="datetime64[M]"), rent.shape)
+    flat_rent = rent.reshape(-1)
+    starts = payment_groups(months, spec, term)
+
+    # Sum each payment group in one pass and place it in the payment month
+    group_sums = np.add.reduceat(flat_rent, starts)
+    retimed = np.zeros_like(flat_rent)
+    if spec["in_advance"]:
+        retimed[starts] = group_sums
+    else:
+        ends = np.append(starts[1:], flat_rent.size) - 1
+        retimed[ends] = group_sums
+    return retimed.reshape(rent.shape)
@@ -0,0 +1,284 @@
+import functools
+import hashlib
+import importlib.util
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+from lease import DATE_FIELDS, LEASE_FIELDS
+from npv_irr_calculations import CATEGORIES
+
+# Modules the cashflows and metrics come from, a change to any of them changes model_version()
+MODEL_MODULES = ["npv_irr_calculations", "portfolio", "batch_xirr", "date_arithmetic", "rent_timing", "lease"]
+# Series stored for each unit in the persistent cache, one row each over the entry, monthly and exit rows
+UNIT_SERIES = ["cashflow"] + CATEGORIES + ["total_rent", "category"]
+
+
+def canonical_key(inputs):
+    '''function to turn a dict of model inputs into a stable hash, so equal inputs give the same key whatever their
+    order or number type (e.g. 3 and 3.0), with dates as ISO strings'''
+
+    def normalise(value):
+        if value is None or isinstance(value, (bool, np.bool_)):
+            return None if value is None else bool(value)
+        if isinstance(value, (int, float, np.number)):
+            return float(value)
+        if isinstance(value, (date, np.datetime64)):
+            return str(np.datetime64(value, "D"))
+        return str(value)
+
+    payload = json.dumps({name: normalise(value) for name, value in inputs.items()}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class LRUCache:
+    '''Bounded cache that evicts the least recently used entry once maxsize is reached, counting hits and misses.
+    Lives at module level so it survives Streamlit reruns, and is locked as sessions run in separate threads.'''
+
+    def __init__(self, name, maxsize=64):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        '''function to return the cached value for key, calling compute() and caching its result on a miss'''
+
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        value = compute()
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self._entries),
+            "max_size": self.maxsize,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+
+# Caches for the Streamlit page: cashflows keyed on the cashflow inputs, IRR/NPV keyed on the cashflow key (plus the
+# discount rate for NPV), and the figures keyed on the cashflow key as they only depend on the cashflow
+cashflow_cache = LRUCache("cashflow", maxsize=64)
+metrics_cache = LRUCache("metrics", maxsize=256)
+figure_cache = LRUCache("figures", maxsize=32)
+CACHES = [cashflow_cache, metrics_cache, figure_cache]
+
+
+def cache_stats():
+    '''function to report the statistics of each of the page's caches, e.g. for a debug panel'''
+
+    return {cache.name: cache.stats() for cache in CACHES}
+
+
+@functools.lru_cache(maxsize=None)
+def model_version():
+    '''function to fingerprint the model code as a hash of the source of MODEL_MODULES, so results cached before a
+    change to the model are never reused'''
+
+    digest = hashlib.sha256()
+    for name in MODEL_MODULES:
+        with open(importlib.util.find_spec(name).origin, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()[:16]
+
+
+def lease_keys(leases, version=None):
+    '''function to give each unit of a LeaseArray a stable hash of its lease inputs and the model version (defaults
+    to model_version()), for DiskCache. Equal inputs give the same key however the portfolio table was built.'''
+
+    version = (model_version() if version is None else version).encode()
+    columns = leases.columns
+    numeric = np.column_stack([
+        columns[field].astype(np.int64) if field in DATE_FIELDS else columns[field]
+        for field in LEASE_FIELDS if field != "rent_convention"
+    ]).astype(float) + 0.0  # + 0.0 turns -0.0 into 0.0
+    numeric[np.isnan(numeric)] = np.nan  # and every NaN into the same bit pattern
+    return [hashlib.sha256(version + row.tobytes() + str(convention).encode()).hexdigest()
+            for row, convention in zip(numeric, columns["rent_convention"])]
+
+
+def encode_units(result):
+    '''function to pack each unit of a create_portfolio_cashflows result for DiskCache as one zlib compressed blob:
+    its dates (entry, months and exit, as datetime64[D]) followed by its UNIT_SERIES values over the same rows (NaN
+    on the entry and exit rows except for the cashflow, -1 for the category). The series are mostly runs of equal
+    amounts, so a unit packs to a few hundred bytes rather than ~10KB for a 10-year cashflow.'''
+
+    n_units, n_months = result["cashflow"].shape
+    # Every unit's rows on the units x (months + 2) grid, with each unit's exit row moved to just after its term
+    values = np.full((n_units, len(UNIT_SERIES), n_months + 2), np.nan)
+    values[:, 0, 1:-1] = result["cashflow"]
+    for row, name in enumerate(UNIT_SERIES[1:-1], start=1):
+        values[:, row, 1:-1] = result["components"][name]
+    values[:, -1, 1:-1] = result["category"]
+    values[:, 0, 0], values[:, -1, 0] = result["entry_cashflow"], -1
+    dates = np.column_stack([result["entry_date"], result["period_start"], result["exit_date"]]).astype("datetime64[D]")
+    exit_row = result["term"] + 1
+    units = np.arange(n_units)
+    dates[units, exit_row] = result["exit_date"]
+    values[units, :, exit_row] = np.nan
+    values[units, 0, exit_row], values[units, -1, exit_row] = result["exit_cashflow"], -1
+    return [zlib.compress(dates[unit, :rows].tobytes() + values[unit, :, :rows].tobytes(), 1)
+            for unit, rows in enumerate(exit_row + 1)]
+
+
+class DiskCache:
+    '''Persistent, content-addressed store of unit results in a SQLite file, so a portfolio run only revalues the
+    units that changed since the last one (see runner.run_portfolio). Each unit is keyed on lease_keys, i.e. its
+    lease inputs and the model code, and holds its dated cashflow rows and category components (encode_units), its
+    IRR, and its NPV with the discount rate it was valued at.
+
+    Entries are evicted by evict(): those last used more than max_age_days ago or cached by other model code, then
+    the least recently used until the results take up at most max_bytes. The file can be shared between processes.'''
+
+    def __init__(self, path, max_bytes=1 << 30, max_age_days=90):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_days = max_age_days
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # WAL lets other processes read while one writes, and a cache can lose its last writes in a power cut
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        # The metrics are in their own table, so looking up a portfolio doesn't page through the cashflows
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS units (key TEXT PRIMARY KEY, model_version TEXT, accessed REAL, size INTEGER, "
+            "irr REAL, npv REAL, npv_rate REAL) WITHOUT ROWID")
+        self._db.execute("CREATE TABLE IF NOT EXISTS cashflows (key TEXT PRIMARY KEY, packed BLOB)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS units_accessed ON units (accessed)")
+        self._db.execute("CREATE TEMP TABLE lookup_keys (key TEXT PRIMARY KEY)")
+        self._db.commit()
+
+    def lookup(self, keys):
+        '''function to find the cached units among keys, returning {key: (irr, npv, npv_rate)} for those found and
+        marking them as used'''
+
+        with self._lock:
+            self._db.execute("DELETE FROM lookup_keys")
+            self._db.executemany("INSERT OR IGNORE INTO lookup_keys VALUES (?)", ((key,) for key in keys))
+            rows = self._db.execute("SELECT key, irr, npv, npv_rate FROM lookup_keys JOIN units USING (key)").fetchall()
+            self._db.execute("UPDATE units SET accessed = ? WHERE key IN (SELECT key FROM lookup_keys)", (time.time(),))
+            self._db.commit()
+            found = {key: (_nan(irr), _nan(npv), npv_rate) for key, irr, npv, npv_rate in rows}
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def load(self, key):
+        '''function to return a cached unit's rows as a dict of arrays (period_start and UNIT_SERIES), or None'''
+
+        with self._lock:
+            row = self._db.execute("SELECT packed FROM cashflows WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        packed = zlib.decompress(row[0])
+        n_rows = len(packed) // 8 // (len(UNIT_SERIES) + 1)
+        dates = np.frombuffer(packed, dtype="datetime64[D]", count=n_rows)
+        series = np.frombuffer(packed, offset=8 * n_rows).reshape(len(UNIT_SERIES), n_rows)
+        return {"period_start": dates, **dict(zip(UNIT_SERIES, series))}
+
+    def store(self, keys, irr, npv, npv_rate, units, version=None):
+        '''function to cache units (from encode_units) under keys, with their irr and their npv at npv_rate'''
+
+        version = model_version() if version is None else version
+        now = time.time()
+        with self._lock:
+            self._db.executemany("INSERT OR REPLACE INTO units VALUES (?, ?, ?, ?, ?, ?, ?)", [
+                (key, version, now, len(packed), _sql_number(unit_irr), _sql_number(unit_npv), float(rate))
+                for key, unit_irr, unit_npv, rate, packed in zip(keys, irr, npv, npv_rate, units)
+            ])
+            self._db.executemany("INSERT OR REPLACE INTO cashflows VALUES (?, ?)", zip(keys, units))
+            self._db.commit()
+
+    def store_npv(self, keys, npv, npv_rate):
+        '''function to replace the cached NPV of units revalued at another discount rate'''
+
+        with self._lock:
+            self._db.executemany("UPDATE units SET npv = ?, npv_rate = ? WHERE key = ?",
+                                 [(_sql_number(value), float(rate), key) for key, value, rate in zip(keys, npv, npv_rate)])
+            self._db.commit()
+
+    def evict(self, version=None):
+        '''function to evict stale entries (last used more than max_age_days ago, or from other model code) and then
+        the least recently used until the cached results take up at most max_bytes, returning the number evicted'''
+
+        version = model_version() if version is None else version
+        with self._lock:
+            oldest = -np.inf if self.max_age_days is None else time.time() - self.max_age_days * 86400
+            evicted = self._db.execute(
+                "DELETE FROM units WHERE accessed < ? OR model_version != ?", (oldest, version)).rowcount
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM units").fetchone()[0]
+            if total > self.max_bytes:
+                keys, sizes = zip(*self._db.execute("SELECT key, size FROM units ORDER BY accessed DESC").fetchall())
+                keep = int(np.searchsorted(np.cumsum(sizes), self.max_bytes, side="right"))
+                self._db.executemany("DELETE FROM units WHERE key = ?", [(key,) for key in keys[keep:]])
+                evicted += len(keys) - keep
+            if evicted:
+                self._db.execute("DELETE FROM cashflows WHERE key NOT IN (SELECT key FROM units)")
+            self._db.commit()
+            self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            size, total = self._db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM units").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": size,
+            "bytes": total,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+        }
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM units")
+            self._db.execute("DELETE FROM cashflows")
+            self._db.commit()
+            self.hits = self.misses = self.evictions = 0
+
+    def close(self):
+        self._db.close()
+
+
+def _sql_number(value):
+    # SQLite stores NaN as NULL, e.g. for a unit whose cashflows have no IRR
+    return float(value) if np.isfinite(value) else None
+
+
+def _nan(value):
+    return np.nan if value is None else value
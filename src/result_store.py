@@ -0,0 +1,242 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lease import LeaseArray
+from npv_irr_calculations import CATEGORIES
+from portfolio import create_portfolio_cashflows, portfolio_columns
+from runner import shard_portfolio
+
+# File layout: MAGIC, the header length (8 bytes, little endian), the JSON header, then the values block and the unit
+# table, each starting on a PAGE boundary so they can be memory mapped
+MAGIC = b"CFSTORE1"
+PAGE = 4096
+# Monthly series stored for every unit, and the per unit fields of the unit table
+STORE_SERIES = ["cashflow"] + CATEGORIES + ["total_rent"]
+UNIT_FIELDS = ["cashflow_start", "term", "entry_cashflow", "exit_cashflow", "irr", "npv"]
+
+
+class ResultStore:
+    '''Binary store of portfolio results on disk, read and written through numpy.memmap so a portfolio doesn't have
+    to fit in memory. Holds a series x units x months block of monthly amounts (STORE_SERIES), on a calendar month
+    axis shared by every unit (a unit's months outside its cashflow are 0), and a table of UNIT_FIELDS per unit.
+
+    The header maps unit IDs to rows and the month axis to columns, so a unit, a series or a date window is read as a
+    view of the file (see select) and only the pages it covers are loaded. Several processes can write the rows of
+    different units at once, as write_portfolio does. Open an existing store with ResultStore(path), or mode="r+" to
+    write to it.
+    '''
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        with open(path, "rb") as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} isn't a result store")
+            header_length = int.from_bytes(file.read(8), "little")
+            self.header = json.loads(file.read(header_length))
+        header = self.header
+        self.series = header["series"]
+        self.unit_ids = np.array(header["unit_ids"])
+        self.months = np.datetime64(header["start_month"], "M") + np.arange(header["n_months"])
+        self.values = np.memmap(path, dtype=header["dtype"], mode=mode, offset=header["values_offset"],
+                                shape=(len(self.series), len(self.unit_ids), header["n_months"]))
+        self.units = np.memmap(path, dtype=np.float64, mode=mode, offset=header["units_offset"],
+                               shape=(len(UNIT_FIELDS), len(self.unit_ids)))
+        self._rows = None
+
+    @classmethod
+    def create(cls, path, unit_ids, start_month, n_months, series=STORE_SERIES, dtype="float64"):
+        '''function to create an empty store (all zeros, allocated sparsely where the file system allows) for
+        unit_ids on n_months calendar months from start_month, returning it open for writing'''
+
+        unit_ids = [str(unit_id) for unit_id in unit_ids]
+        if len(set(unit_ids)) != len(unit_ids):
+            raise ValueError("Unit IDs must be unique")
+        dtype = np.dtype(dtype)
+        header = {
+            "series": list(series),
+            "unit_fields": UNIT_FIELDS,
+            "start_month": str(np.datetime64(start_month, "M")),
+            "n_months": int(n_months),
+            "dtype": dtype.str,
+            "unit_ids": unit_ids,
+        }
+        # The offsets depend on the header's length, so it's measured with placeholders of their final width
+        header["values_offset"] = header["units_offset"] = 0
+        header_length = len(json.dumps(header).encode()) + 40
+        values_offset = _page_align(len(MAGIC) + 8 + header_length)
+        units_offset = _page_align(values_offset + len(series) * len(unit_ids) * int(n_months) * dtype.itemsize)
+        header["values_offset"], header["units_offset"] = values_offset, units_offset
+        encoded = json.dumps(header).encode().ljust(header_length)
+
+        with open(path, "wb") as file:
+            file.write(MAGIC + len(encoded).to_bytes(8, "little") + encoded)
+            file.truncate(units_offset + len(UNIT_FIELDS) * len(unit_ids) * 8)
+        return cls(path, mode="r+")
+
+    def row(self, unit_id):
+        '''function to find a unit's row from its ID'''
+
+        if self._rows is None:
+            self._rows = {unit_id: row for row, unit_id in enumerate(self.unit_ids)}
+        try:
+            return self._rows[str(unit_id)]
+        except KeyError:
+            raise KeyError(f"No unit '{unit_id}' in the result store") from None
+
+    def month_slice(self, start=None, end=None):
+        '''function to turn a date window (start up to but not including end, as dates, months or strings, either
+        left open) into a slice of the month axis'''
+
+        first = 0 if start is None else int(np.searchsorted(self.months, np.datetime64(start, "M")))
+        last = len(self.months) if end is None else int(np.searchsorted(self.months, np.datetime64(end, "M")))
+        return slice(first, last)
+
+    def select(self, series=None, unit=None, start=None, end=None):
+        '''function to read part of the store without copying it: series is a name (None for every series), unit a
+        unit ID or a slice of rows (None for every unit) and start/end a date window (see month_slice). Returns a
+        memmap view, indexed [series,] [unit,] month for the axes that aren't fixed to one entry.'''
+
+        series_index = slice(None) if series is None else self.series.index(series)
+        rows = slice(None) if unit is None else unit if isinstance(unit, slice) else self.row(unit)
+        return self.values[series_index, rows, self.month_slice(start, end)]
+
+    def unit(self, unit_id, start=None, end=None):
+        '''function to read a unit's monthly series over a date window, as a dict of series -> memmap views'''
+
+        rows = self.values[:, self.row(unit_id), self.month_slice(start, end)]
+        return dict(zip(self.series, rows))
+
+    def unit_fields(self, unit_id=None):
+        '''function to read the unit table (UNIT_FIELDS), for one unit or every unit, with cashflow_start as a date'''
+
+        columns = self.units if unit_id is None else self.units[:, self.row(unit_id)]
+        fields = dict(zip(UNIT_FIELDS, columns))
+        fields["cashflow_start"] = np.asarray(fields["cashflow_start"]).astype(np.int64).astype("datetime64[D]")
+        return fields
+
+    def monthly_totals(self, series, start=None, end=None, chunk_units=65536):
+        '''function to total a series over every unit for each month of a date window, reading chunk_units units at a
+        time so memory stays bounded however large the store. Returns (months, totals).'''
+
+        months = self.month_slice(start, end)
+        view = self.values[self.series.index(series), :, months]
+        totals = np.zeros(view.shape[1])
+        for first in range(0, view.shape[0], chunk_units):
+            totals += view[first:first + chunk_units].sum(axis=0)
+        return self.months[months], totals
+
+    def write(self, first_row, result):
+        '''function to write a create_portfolio_cashflows result for the units in rows first_row onwards, each
+        unit's months going to the calendar months of its period starts'''
+
+        n_units, n_months = result["cashflow"].shape
+        rows = np.arange(first_row, first_row + n_units)
+        first_month = (result["period_start"][:, 0].astype("datetime64[M]") - self.months[0]).astype(np.int64)
+        months = first_month[:, None] + np.arange(n_months)
+        valid = ~np.isnat(result["period_start"])
+        if n_units and (first_month.min() < 0 or months[valid].max() >= len(self.months)):
+            raise ValueError("Cashflows fall outside the result store's months")
+
+        unit_rows, columns = np.broadcast_to(rows[:, None], months.shape)[valid], months[valid]
+        # Units starting in the same month fill a block of the file, which is written as one slice
+        same_start = n_units > 0 and (first_month == first_month[0]).all()
+        for index, name in enumerate(self.series):
+            amounts = result["cashflow"] if name == "cashflow" else result["components"][name]
+            if same_start:
+                self.values[index, rows[0]:rows[-1] + 1, first_month[0]:first_month[0] + n_months] = np.where(valid, amounts, 0.0)
+            else:
+                self.values[index, unit_rows, columns] = amounts[valid]
+        self.units[:, rows] = [
+            result["period_start"][:, 0].astype("datetime64[D]").astype(np.int64),
+            result["term"],
+            result["entry_cashflow"],
+            result["exit_cashflow"],
+            result["irr"],
+            result["npv"],
+        ]
+
+    def flush(self):
+        self.values.flush()
+        self.units.flush()
+
+    def __len__(self):
+        return len(self.unit_ids)
+
+    def __repr__(self):
+        return f"ResultStore({self.path!r}, {len(self)} units x {len(self.months)} months)"
+
+
+def write_shard(path, first_row, shard):
+    '''function to value one shard of a portfolio and write it to rows first_row onwards of the store at path, so
+    only the row count goes back to the parent process. Runs in the worker processes.'''
+
+    shard = dict(shard)
+    discount_rate = shard.pop("discount_rate")
+    result = create_portfolio_cashflows(shard, discount_rate)
+    store = ResultStore(path, mode="r+")
+    store.write(first_row, result)
+    store.flush()
+    return len(result["term"])
+
+
+def write_portfolio(path, leases, discount_rate, unit_ids=None, workers=None, chunk_size=1000, dtype="float64"):
+    '''Value a portfolio straight into a ResultStore at path. The store is sized from the leases (the month axis runs
+    from the earliest cashflow start to the latest cashflow end), then the leases are valued in shards of chunk_size
+    units, as for runner.run_portfolio, and each worker writes its shard's rows into the file itself.
+
+    Parameters:
+        leases: a LeaseArray or columnar portfolio table, as for create_portfolio_cashflows.
+        discount_rate: discount rate for the NPVs, a single rate or one per unit.
+        unit_ids: Optional; an ID per unit, defaults to the unit's position in the portfolio.
+        workers: number of worker processes, defaults to the number of CPUs. 0 or 1 writes every shard in this
+            process.
+        dtype: dtype of the monthly series, e.g. float32 to halve the file size.
+
+    Returns the store, open for reading.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not isinstance(leases, LeaseArray):
+        leases = LeaseArray(leases)
+    n_units = len(leases)
+    if unit_ids is None:
+        unit_ids = range(n_units)
+
+    start_month = leases["cashflow_start"].astype("datetime64[M]")
+    end_month = start_month + leases["cashflow_term"].astype(np.int64)
+    first = start_month.min() if n_units else np.datetime64("2000-01", "M")
+    n_months = int((end_month.max() - first).astype(np.int64)) if n_units else 0
+    ResultStore.create(path, unit_ids, first, n_months, dtype=dtype)
+
+    lease = portfolio_columns(leases)
+    lease["discount_rate"] = np.broadcast_to(np.asarray(discount_rate, dtype=float), (n_units,))
+    shards = shard_portfolio(lease, chunk_size)
+    first_rows = range(0, n_units, chunk_size)
+    if workers <= 1 or len(shards) <= 1:
+        for first_row, shard in zip(first_rows, shards):
+            write_shard(path, first_row, shard)
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            list(pool.map(write_shard, [path] * len(shards), first_rows, shards))
+    return ResultStore(path)
+
+
+def _page_align(offset):
+    return -(-offset // PAGE) * PAGE
+
+
+if __name__ == "__main__":
+    import sys
+    import time
+
+    from benchmarks import synthetic_portfolio
+
+    # e.g. python result_store.py portfolio.cfstore 100000
+    path, n_units = sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    leases = synthetic_portfolio(n_units, cashflow_term=120)
+    t0 = time.perf_counter()
+    store = write_portfolio(path, leases, 0.1)
+    print(f"Wrote {store} ({os.path.getsize(path) / 1e6:,.0f} MB) in {time.perf_counter() - t0:.2f}s")
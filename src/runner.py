@@ -0,0 +1,114 @@
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from batch_xirr import xnpv_batch
+from lease import LeaseArray
+from portfolio import create_portfolio_cashflows, portfolio_columns
+from result_cache import encode_units, lease_keys
+
+
+def shard_portfolio(lease, chunk_size):
+    '''function to split a dict of portfolio columns into shards of at most chunk_size units, in input order'''
+
+    n_units = len(lease["cashflow_start"])
+    return [
+        {field: values[start:start + chunk_size] for field, values in lease.items()}
+        for start in range(0, n_units, chunk_size)
+    ]
+
+
+def value_shard(shard, encode=False):
+    '''function to value one shard of a portfolio, returning its per-unit IRR and NPV (and its units packed for the
+    persistent cache if encode). Runs in the worker processes.'''
+
+    shard = dict(shard)
+    discount_rate = shard.pop("discount_rate")
+    result = create_portfolio_cashflows(shard, discount_rate)
+    if encode:
+        return result["irr"], result["npv"], encode_units(result)
+    return result["irr"], result["npv"]
+
+
+def run_portfolio(leases, discount_rate, workers=None, chunk_size=250, cache=None):
+    '''Value a portfolio across a process pool. The leases are sharded into chunks of chunk_size units, each shard is
+    valued with create_portfolio_cashflows in a worker, and the results are put back together in input order.
+
+    Parameters:
+        leases: columnar table of leases, as for create_portfolio_cashflows.
+        discount_rate: discount rate for the NPVs, a single rate or one per unit.
+        workers: number of worker processes, defaults to the number of CPUs. 0 or 1 runs every shard in this
+            process, one after another, which gives the same results deterministically (e.g. for tests).
+        chunk_size: units per shard. Smaller chunks balance the load better, larger ones cost less to send.
+        cache: Optional; a result_cache.DiskCache. Units whose lease inputs (and the model code) are unchanged since
+            they were cached aren't revalued, only looked up, so a rerun takes time in proportion to the number of
+            changed units. Units cached at another discount rate have their NPV recalculated from the cached cashflow.
+
+    Returns a dict of per-unit irr and npv arrays, and with a cache, a dict of this run's cache hits, misses and
+    hit_ratio.
+    '''
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    if not isinstance(leases, LeaseArray):
+        leases = LeaseArray(leases)
+    n_units = len(leases)
+    rate = np.broadcast_to(np.asarray(discount_rate, dtype=float), (n_units,))
+    if cache is None:
+        irr, npv = _value_units(leases, rate, workers, chunk_size)
+        return {"irr": irr, "npv": npv}
+
+    keys = lease_keys(leases)
+    found = cache.lookup(keys)
+    irr, npv = np.full(n_units, np.nan), np.full(n_units, np.nan)
+    hits = np.array([key in found for key in keys], dtype=bool)
+    revalue_npv = []
+    for unit in np.flatnonzero(hits):
+        irr[unit], npv[unit], npv_rate = found[keys[unit]]
+        if npv_rate != rate[unit]:
+            revalue_npv.append(unit)
+    for unit in revalue_npv:
+        rows = cache.load(keys[unit])
+        npv[unit] = xnpv_batch(rate[unit], rows["period_start"], rows["cashflow"])
+    if revalue_npv:
+        cache.store_npv([keys[unit] for unit in revalue_npv], npv[revalue_npv], rate[revalue_npv])
+
+    misses = np.flatnonzero(~hits)
+    if len(misses):
+        irr[misses], npv[misses], units = _value_units(leases[misses], rate[misses], workers, chunk_size, encode=True)
+        cache.store([keys[unit] for unit in misses], irr[misses], npv[misses], rate[misses], units)
+    cache.evict()
+    return {
+        "irr": irr,
+        "npv": npv,
+        "cache": {"hits": int(hits.sum()), "misses": len(misses), "hit_ratio": float(hits.mean()) if n_units else 0.0},
+    }
+
+
+def _value_units(leases, rate, workers, chunk_size, encode=False):
+    '''function to value a LeaseArray in shards, across a process pool if there's more than one shard and worker,
+    returning the per-unit irr and npv (and the units packed for the persistent cache if encode)'''
+
+    lease = portfolio_columns(leases)
+    lease["discount_rate"] = rate
+    shards = shard_portfolio(lease, chunk_size)
+    value = functools.partial(value_shard, encode=encode)
+
+    if workers <= 1 or len(shards) <= 1:
+        results = [value(shard) for shard in shards]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(shards))) as pool:
+            # map hands back results in shard order, whichever worker finishes first
+            results = list(pool.map(value, shards))
+
+    if not results:
+        results = [(np.array([]), np.array([]), [])]
+    irr = np.concatenate([result[0] for result in results])
+    npv = np.concatenate([result[1] for result in results])
+    if encode:
+        return irr, npv, [unit for result in results for unit in result[2]]
+    return irr, npv
@@ -0,0 +1,211 @@
+import numpy as np
+
+from date_arithmetic import add_months, add_months_array
+from lease import Lease
+from npv_irr_calculations import (
+    CATEGORIES,
+    annual_exit_rent,
+    cashflow_components,
+    initial_yield_valuation,
+    lease_phase_dates,
+)
+from rent_timing import get_convention, retime_rent
+
+# pyxirr's day count for xnpv: actual days / 365, and the average length of a month on that basis
+DAYS_IN_YEAR = 365.0
+MONTH_YEARS = 365.25 / 12 / DAYS_IN_YEAR
+RENT_COLUMNS = ["contracted_rent", "reviewed_rent", "rf_period", "relet_rent"]
+COST_COLUMNS = ["refurbishment_period", "void_period"]
+
+
+def first_month_on_or_after(cashflow_start, cashflow_term, d):
+    '''function to find the index of the first period whose start (cashflow_start plus i months) is on or after d,
+    clamped to 0..cashflow_term, without building the month grid'''
+
+    months = (d.year - cashflow_start.year) * 12 + d.month - cashflow_start.month
+    if add_months(cashflow_start, months) < d:
+        months += 1
+    return min(max(months, 0), cashflow_term)
+
+
+def cashflow_segments(lease):
+    '''Run-length form of a unit's monthly cashflow: the months split into flat segments (contracted rent, reviewed
+    rent, refurbishment, void before and after the rates relief, rent free, relet) in which every monthly amount is
+    the same. A 25-year lease is a handful of segments rather than 300 rows.
+
+    The boundaries come from the phase dates (see lease_phase_dates), and each segment's amounts are those of
+    cashflow_components for its first month, so expand_segments gives back create_cashflow's rows exactly.
+
+    Parameters:
+        lease: a lease.Lease, or a dict of create_cashflow inputs.
+
+    Returns a dict of:
+        start, end: per segment first month and the month after its last (indices into the monthly rows)
+        category: per segment index into CATEGORIES (-1 where no category applies)
+        components: dict of category -> per segment monthly amount
+        rent, cost: per segment monthly rent (paid by the lease's rent convention) and costs (paid monthly)
+        lease: the Lease, for the month grid, rent convention and entry/exit rows
+        exit_price: the exit row, valued on the final month's rent if the lease's exit_price is None
+    '''
+    if not isinstance(lease, Lease):
+        lease = Lease(**lease)
+    start, term = lease.cashflow_start, lease.cashflow_term
+    refurb_end, void_end, rf_end, relet_date = lease_phase_dates(
+        lease.lease_termination, lease.refurb_duration, lease.void_period, lease.rf)
+    # The void costs step up once rates relief ends, i.e. 30 x rates_relief days into the void (see cashflow_components)
+    rates_start = np.datetime64(refurb_end, "D") + 30 * max(int(np.floor(lease.rates_relief)), 0)
+    phase_dates = [lease.review_date, lease.lease_termination, refurb_end, void_end, rf_end, relet_date, rates_start.item()]
+    bounds = np.unique([0, term] + [first_month_on_or_after(start, term, d) for d in phase_dates])
+
+    # Each month's mask is the same throughout a segment, so its first month gives the amounts for all of it
+    seg_start = bounds[:-1]
+    columns, category = cashflow_components(
+        add_months_array(np.datetime64(start, "D"), seg_start),
+        lease_termination=np.datetime64(lease.lease_termination, "D"),
+        review_date=np.datetime64(lease.review_date, "D"),
+        refurb_end=np.datetime64(refurb_end, "D"),
+        void_end=np.datetime64(void_end, "D"),
+        rf_end=np.datetime64(rf_end, "D"),
+        relet_date=np.datetime64(relet_date, "D"),
+        unit_area=lease.unit_area,
+        current_rent=lease.current_rent,
+        headline_erv=lease.headline_erv,
+        ner_discount=lease.ner_discount,
+        refurb_cost=lease.refurb_cost,
+        refurb_duration=lease.refurb_duration,
+        vacant_rates_percent=lease.vacant_rates_percent,
+        rates_relief=lease.rates_relief,
+        vacant_sc=lease.vacant_sc,
+        relet_rent=lease.relet_rent
+    )
+
+    # Merge neighbouring segments that ended up with the same category and amounts
+    values = np.column_stack([category] + [columns[cat] for cat in CATEGORIES])
+    keep = np.concatenate([[True], (values[1:] != values[:-1]).any(axis=1)])
+    segments = {
+        "start": seg_start[keep],
+        "end": np.append(seg_start[keep][1:], term),
+        "category": category[keep],
+        "components": {cat: columns[cat][keep] for cat in CATEGORIES},
+        "lease": lease,
+    }
+    segments["rent"] = sum(segments["components"][cat] for cat in RENT_COLUMNS)
+    segments["cost"] = sum(segments["components"][cat] for cat in COST_COLUMNS)
+
+    exit_price = lease.exit_price
+    if exit_price is None:
+        final = {cat: segments["components"][cat][-1] for cat in ["contracted_rent", "reviewed_rent", "relet_rent"]}
+        exit_rent = annual_exit_rent(final["contracted_rent"], final["reviewed_rent"], final["relet_rent"])
+        exit_price = initial_yield_valuation(exit_rent, lease.exit_cap, lease.purchasers_costs)
+    segments["exit_price"] = exit_price
+    return segments
+
+
+def _payment_group(month, first_period, term, spec):
+    '''function to return the (start, end) months of the rent payment group containing month, as payment_groups
+    splits a single unit's months: months before the first payment period are their own groups in advance, or one
+    group in arrears, and the final group is cut off at the end of the cashflow'''
+
+    period = spec["period_months"]
+    if period == 1:
+        return month, month + 1
+    if month < first_period:
+        return (month, month + 1) if spec["in_advance"] else (0, min(first_period, term))
+    group_start = first_period + (month - first_period) // period * period
+    return group_start, min(group_start + period, term)
+
+
+def segment_payments(segments):
+    '''function to turn the segments into the payment series they produce, each a run of equal payments at a fixed
+    step in months. Rent is paid by the lease's rent convention, as retime_rent would pay it: a segment's rent in a
+    payment group it only partly covers is one payment in that group's payment month, and the whole groups in between
+    are one series. Costs are paid monthly.
+
+    Returns a dict of per series arrays: month (of the first payment), count, step (months) and amount (per payment).
+    '''
+    lease = segments["lease"]
+    term = lease.cashflow_term
+    spec = get_convention(lease.rent_convention)
+    period = spec["period_months"]
+    month_index = np.datetime64(lease.cashflow_start, "M").astype(np.int64)  # months since Jan 1970
+    first_period = int((spec["anchor_month"] - 1 - month_index) % period)
+    pay = lambda group: group[0] if spec["in_advance"] or period == 1 else group[1] - 1
+
+    series = []
+    for start, end, rent, cost in zip(segments["start"], segments["end"], segments["rent"], segments["cost"]):
+        if cost != 0:
+            series.append((start, end - start, 1, cost))
+        if rent == 0:
+            continue
+        head = _payment_group(start, first_period, term, spec)
+        tail = _payment_group(end - 1, first_period, term, spec)
+        if head == tail:
+            series.append((pay(head), 1, 1, rent * (end - start)))
+            continue
+        series.append((pay(head), 1, 1, rent * (head[1] - start)))
+        # Whole groups in between: single months before the first payment period (in advance), then full periods
+        if head[1] < min(first_period, tail[0]):
+            series.append((head[1], min(first_period, tail[0]) - head[1], 1, rent))
+        regular_start = max(head[1], first_period)
+        if regular_start < tail[0]:
+            offset = 0 if spec["in_advance"] else period - 1
+            series.append((regular_start + offset, (tail[0] - regular_start) // period, period, rent * period))
+        series.append((pay(tail), 1, 1, rent * (end - tail[0])))
+
+    month, count, step, amount = (np.array(values) for values in zip(*series)) if series else [np.zeros(0)] * 4
+    return {"month": month.astype(np.int64), "count": count.astype(np.int64), "step": step.astype(np.int64), "amount": amount.astype(float)}
+
+
+def segments_npv(segments, discount_rate):
+    '''Closed-form NPV of a segmented cashflow, including the entry and exit rows, discounted to the entry date as
+    calculate_npv does. Each payment series is a geometric series, in the same way as the YP functions:
+        amount * v^t0 * (1 - v^(count * step * m)) / (1 - v^(step * m)),  v = 1 / (1 + discount_rate)
+    where t0 is the actual/365 year fraction of its first payment and m the average month (MONTH_YEARS). Only the
+    first payment of a series is dated exactly, so the result differs from the xnpv of the monthly rows by the spread
+    of month lengths around the average (at most about 2 parts in 10,000 of the gross present value).
+
+    discount_rate can be a single rate or an array of rates, the result has its shape.'''
+
+    lease = segments["lease"]
+    payments = segment_payments(segments)
+    rate = np.asarray(discount_rate, dtype=float)[..., None]
+    log_v = -np.log1p(rate)
+
+    entry_date = np.datetime64(lease.cashflow_start, "D") - 1
+    first_payment = add_months_array(np.datetime64(lease.cashflow_start, "D"), payments["month"])
+    t0 = (first_payment - entry_date).astype(np.int64) / DAYS_IN_YEAR
+    step_years = payments["step"] * MONTH_YEARS
+    with np.errstate(divide="ignore", invalid="ignore"):
+        annuity = np.where(log_v == 0, payments["count"], np.expm1(log_v * step_years * payments["count"]) / np.expm1(log_v * step_years))
+    months_npv = (payments["amount"] * np.exp(log_v * t0) * annuity).sum(axis=-1)
+
+    exit_date = add_months_array(np.datetime64(lease.cashflow_start, "M").astype("datetime64[D]"), lease.cashflow_term)
+    t_exit = (exit_date - entry_date).astype(np.int64) / DAYS_IN_YEAR
+    return -lease.entry_price + months_npv + segments["exit_price"] * np.exp(log_v[..., 0] * t_exit)
+
+
+def expand_segments(segments):
+    '''function to expand the segments to monthly rows, in the same form as create_cashflow(output="arrays")'''
+
+    lease = segments["lease"]
+    lengths = segments["end"] - segments["start"]
+    months = np.datetime64(lease.cashflow_start, "M") + np.arange(lease.cashflow_term)
+    period_start = add_months_array(np.datetime64(lease.cashflow_start, "D"), np.arange(lease.cashflow_term))
+    period_end = (months + 1).astype("datetime64[D]") - 1
+    columns = {cat: np.repeat(amounts, lengths) for cat, amounts in segments["components"].items()}
+    total_rent = retime_rent(np.repeat(segments["rent"], lengths), months, lease.rent_convention)
+    cashflow = total_rent + np.repeat(segments["cost"], lengths)
+
+    entry_date = np.datetime64(lease.cashflow_start, "D") - 1
+    exit_date = period_end[-1] + 1
+    no_value = np.array([np.nan])
+    rows = {
+        'month': np.arange(len(cashflow) + 2),
+        'cashflow': np.concatenate([[-lease.entry_price], cashflow, [segments["exit_price"]]]),
+        'period_start': np.concatenate([[entry_date], period_start, [exit_date]]),
+        'period_end': np.concatenate([[entry_date], period_end, [exit_date]]),
+    }
+    for cat in CATEGORIES:
+        rows[cat] = np.concatenate([no_value, columns[cat], no_value])
+    rows['total_rent'] = np.concatenate([no_value, total_rent, no_value])
+    return rows
@@ -0,0 +1,110 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from batch_xirr import xirr_batch, xnpv_batch
+from npv_irr_calculations import initial_yield_valuation
+from portfolio import exit_rent, portfolio_cashflow_matrix
+
+# Inputs that don't change the monthly cashflow, only the entry/exit rows or the discounting, so the cashflow is
+# generated once for all of their values (relet_term and lease_start aren't used by the monthly cashflow at all)
+TERMINAL_INPUTS = ["entry_price", "exit_price", "exit_cap", "purchasers_costs", "relet_term", "lease_start"]
+DISCOUNT_INPUTS = ["discount_rate"]
+
+
+def sensitivity_grid(base_inputs, ranges, discount_rate=0.1, purchasers_costs=0.068):
+    '''Calculate the IRR and NPV of one unit across a grid of input values, e.g. ERV x exit yield x void period.
+
+    Only the inputs that change the monthly cashflow are used to generate cashflows (all their combinations in one
+    batch run); entry/exit inputs and the discount rate are then applied to those shared cashflows by broadcasting.
+
+    Parameters:
+        base_inputs: create_cashflow keyword arguments for the unit. If exit_price isn't given (or is None) it's calculated from
+            the exit rent, exit_cap and purchasers_costs, so that the exit yield feeds through to the IRR.
+        ranges: dict of input name -> list of values to test. Any create_cashflow input can be varied, as can
+            discount_rate and purchasers_costs.
+        discount_rate, purchasers_costs: used where they aren't varied in ranges.
+
+    Returns a tidy DataFrame with one row per combination: a column for each varied input, then exit_price, irr, npv.
+    '''
+    inputs = dict({"entry_price": 0.0, "purchasers_costs": purchasers_costs}, **base_inputs, discount_rate=discount_rate)
+    inputs.update({name: values[0] for name, values in ranges.items()})
+    derive_exit = inputs.get("exit_price") is None and "exit_price" not in ranges
+
+    cashflow_names = [name for name in ranges if name not in TERMINAL_INPUTS + DISCOUNT_INPUTS]
+    terminal_names = [name for name in ranges if name in TERMINAL_INPUTS]
+    discount_rates = np.asarray(ranges.get("discount_rate", [inputs["discount_rate"]]), dtype=float)
+
+    # One cashflow per combination of the cashflow inputs, all generated in one batch
+    scenarios = list(itertools.product(*[ranges[name] for name in cashflow_names]))
+    table = {name: [inputs[name]] * len(scenarios) for name in base_inputs}
+    table.update({name: list(values) for name, values in zip(cashflow_names, zip(*scenarios))})
+    result = portfolio_cashflow_matrix(table)
+    rents = exit_rent(result)
+
+    # Entry and exit amounts for every combination of the terminal inputs, against every cashflow
+    terminal = list(itertools.product(*[ranges[name] for name in terminal_names]))
+    terminal_inputs = {name: np.array([inputs[name]] * len(terminal)) for name in ["entry_price", "exit_price", "exit_cap", "purchasers_costs"] if name in inputs}
+    terminal_inputs.update({name: np.array(values) for name, values in zip(terminal_names, zip(*terminal))})
+    entry = -np.broadcast_to(terminal_inputs["entry_price"], (len(scenarios), len(terminal)))
+    if derive_exit:
+        exit_price = initial_yield_valuation(rents[:, None], terminal_inputs["exit_cap"], terminal_inputs["purchasers_costs"])
+    else:
+        exit_price = np.broadcast_to(terminal_inputs["exit_price"], (len(scenarios), len(terminal)))
+
+    # scenarios x terminal x periods series sharing the same dates (and year fractions) for each scenario
+    monthly = np.broadcast_to(result["cashflow"][:, None, :], entry.shape + result["cashflow"].shape[1:])
+    flows = np.concatenate([entry[..., None], monthly, exit_price[..., None]], axis=-1)
+    dates = np.column_stack([result["entry_date"], result["period_start"], result["exit_date"]])[:, None, :]
+    irr = xirr_batch(dates, flows)
+    npv = xnpv_batch(discount_rates, dates, flows)  # discount rates x scenarios x terminal
+
+    # Tidy result, one row per scenario x terminal x discount rate
+    s, k, d = (index.ravel() for index in np.indices((len(scenarios), len(terminal), len(discount_rates))))
+    columns = {}
+    for name in ranges:
+        if name in cashflow_names:
+            columns[name] = np.asarray(table[name], dtype=object)[s]
+        elif name in terminal_names:
+            columns[name] = terminal_inputs[name][k]
+        else:
+            columns[name] = discount_rates[d]
+    columns["exit_price"] = exit_price[s, k]
+    columns["irr"] = irr[s, k]
+    columns["npv"] = npv[d, s, k]
+    return pd.DataFrame(columns)
+
+
+if __name__ == "__main__":
+    import time
+    from datetime import date
+
+    unit = dict(
+        cashflow_start=date(2025, 1, 1),
+        cashflow_term=60,
+        unit_area=10000,
+        lease_start=date(2020, 1, 1),
+        current_rent=50000,
+        review_date=date(2025, 7, 31),
+        lease_termination=date(2025, 12, 31),
+        headline_erv=20,
+        ner_discount=0.70,
+        refurb_cost=20,
+        refurb_duration=3,
+        void_period=12,
+        rf=8,
+        relet_term=6,
+        exit_cap=0.06,
+        vacant_rates_percent=0.5,
+        rates_relief=3,
+        vacant_sc=2,
+        entry_price=1000000)
+    t0 = time.perf_counter()
+    grid = sensitivity_grid(unit, {
+        "headline_erv": np.linspace(15, 25, 10),
+        "exit_cap": np.linspace(0.05, 0.095, 10),
+        "void_period": range(0, 20, 2),
+    })
+    print(f"{len(grid)} combinations in {time.perf_counter() - t0:.3f}s")
+    print(grid.pivot_table(index="headline_erv", columns="exit_cap", values="irr").round(4))
@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+
+import numpy as np
+
+from lease import DATE_FIELDS, Lease, LeaseArray
+from npv_irr_calculations import initial_yield_valuation
+from portfolio import create_portfolio_cashflows
+
+
+class Overloaded(Exception):
+    '''Raised when the service already has max_pending valuations waiting, the client should retry later'''
+
+
+def value_batch(leases, discount_rate, with_cashflows):
+    '''function to value a batch of leases (a LeaseArray) with create_portfolio_cashflows, returning one result dict
+    per unit. Units flagged in with_cashflows also get their dated cashflow (entry, monthly and exit rows), as in
+    create_cashflow. Runs in the worker processes.'''
+
+    result = create_portfolio_cashflows(leases, discount_rate)
+    units = []
+    for unit, term in enumerate(result["term"]):
+        valuation = {
+            "irr": _json_number(result["irr"][unit]),
+            "npv": _json_number(result["npv"][unit]),
+            "entry_price": -float(result["entry_cashflow"][unit]),
+            "exit_price": float(result["exit_cashflow"][unit]),
+        }
+        if with_cashflows[unit]:
+            dates = [result["entry_date"][unit], *result["period_start"][unit, :term], result["exit_date"][unit]]
+            flows = [result["entry_cashflow"][unit], *result["cashflow"][unit, :term], result["exit_cashflow"][unit]]
+            valuation["cashflow"] = {"dates": [str(d) for d in dates], "amounts": [float(f) for f in flows]}
+        units.append(valuation)
+    return units
+
+
+def _json_number(value):
+    # JSON has no NaN, e.g. for a unit whose cashflows have no IRR
+    return float(value) if np.isfinite(value) else None
+
+
+class MicroBatcher:
+    '''Coalesces single-unit valuation requests into batches. Requests that arrive within window seconds of the first
+    one waiting (up to max_batch of them) are valued together with value_batch on the executor.
+
+    Backpressure: at most max_in_flight batches are handed to the executor at once, and at most max_pending requests
+    wait for a batch. submit() raises Overloaded beyond that instead of queueing without bound.'''
+
+    def __init__(self, executor, window=0.002, max_batch=512, max_pending=20000, max_in_flight=4):
+        self.executor = executor
+        self.window = window
+        self.max_batch = max_batch
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        self.batches = 0
+        self.valued = 0
+        self._collector = None
+        self._dispatches = set()
+
+    def start(self):
+        self._collector = asyncio.create_task(self._collect())
+
+    async def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+
+    async def submit(self, lease, discount_rate, with_cashflow=False):
+        '''function to queue a Lease for the next batch and wait for its valuation'''
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((lease, discount_rate, with_cashflow, future))
+        except asyncio.QueueFull:
+            raise Overloaded(f"{self.queue.maxsize} valuations already waiting") from None
+        return await future
+
+    async def _collect(self):
+        while True:
+            batch = [await self.queue.get()]
+            # Let the requests arriving just behind the first one join its batch
+            if self.window:
+                await asyncio.sleep(self.window)
+            while len(batch) < self.max_batch and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            await self.in_flight.acquire()
+            # Hold on to the task until it's done, the event loop only keeps a weak reference to it
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch):
+        leases, rates, with_cashflows, futures = zip(*batch)
+        try:
+            units = await asyncio.get_running_loop().run_in_executor(
+                self.executor, value_batch, LeaseArray.from_leases(leases), np.array(rates), with_cashflows)
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+        else:
+            for future, valuation in zip(futures, units):
+                if not future.done():
+                    future.set_result(valuation)
+            self.batches += 1
+            self.valued += len(batch)
+        finally:
+            self.in_flight.release()
+
+
+def parse_lease(inputs):
+    '''function to build a Lease from JSON inputs, with the dates as ISO strings (e.g. "2025-01-01")'''
+
+    inputs = dict(inputs)
+    for field in DATE_FIELDS:
+        if isinstance(inputs.get(field), str):
+            inputs[field] = date.fromisoformat(inputs[field])
+    return Lease(**inputs)
+
+
+class ValuationService:
+    '''Local HTTP/JSON valuation service on asyncio. Routes:
+        POST /valuation       {"lease": {create_cashflow inputs}, "discount_rate": 0.1, "cashflow": false}
+                              -> {"irr", "npv", "entry_price", "exit_price"} (+ "cashflow" if asked for)
+        POST /initial-yield   {"current_rent", "net_initial_yield", "purchasers_costs"} -> {"value"}
+        GET  /health          -> batching statistics
+    Valuations are micro-batched (see MicroBatcher). Bad inputs get a 400, and a full queue a 503 with Retry-After.'''
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def handle_connection(self, reader, writer):
+        '''function to serve the HTTP/1.1 requests of one keep-alive connection'''
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                status, payload = await self.route(method, path, body)
+                content = json.dumps(payload).encode()
+                close = headers.get("connection", "").lower() == "close"
+                response = [f"HTTP/1.1 {status} {HTTP_REASONS[status]}", "Content-Type: application/json", f"Content-Length: {len(content)}"]
+                if status == 503:
+                    response.append("Retry-After: 1")
+                if close:
+                    response.append("Connection: close")
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode() + content)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def route(self, method, path, body):
+        '''function to handle one request, returning the HTTP status and the JSON payload'''
+
+        try:
+            if method == "GET" and path == "/health":
+                return 200, {"status": "ok", "batches": self.batcher.batches, "valued": self.batcher.valued,
+                             "pending": self.batcher.queue.qsize()}
+            if method != "POST" or path not in ("/valuation", "/initial-yield"):
+                return 404, {"error": f"No route for {method} {path}"}
+            request = json.loads(body)
+            if path == "/initial-yield":
+                value = initial_yield_valuation(float(request["current_rent"]), float(request["net_initial_yield"]),
+                                                float(request.get("purchasers_costs", 0.068)))
+                return 200, {"value": float(value)}
+            lease = parse_lease(request["lease"])
+            return 200, await self.batcher.submit(lease, float(request.get("discount_rate", 0.1)), bool(request.get("cashflow", False)))
+        except Overloaded as error:
+            return 503, {"error": str(error)}
+        except (KeyError, TypeError, ValueError) as error:
+            return 400, {"error": f"{type(error).__name__}: {error}"}
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+async def serve(host="127.0.0.1", port=8765, workers=None, window=0.002, max_batch=512, max_pending=20000, ready=None):
+    '''Run the valuation service until it gets a SIGINT/SIGTERM or is cancelled. workers is the number of worker processes (defaults to the number
+    of CPUs, 0 values the batches on a thread of this process). ready is an optional asyncio.Event set once it's
+    listening.'''
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    executor = None
+    if workers > 0:
+        # Spawned rather than forked, a forked worker would hold on to copies of the open client sockets
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        # Start the workers (and their imports) before taking requests
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*[loop.run_in_executor(executor, os.getpid) for _ in range(workers)])
+    batcher = MicroBatcher(executor, window, max_batch, max_pending, max_in_flight=max(2 * workers, 1))
+    service = ValuationService(batcher)
+    batcher.start()
+    server = await asyncio.start_server(service.handle_connection, host, port, backlog=1024)
+    print(f"Valuation service on http://{host}:{port} with {workers} workers", flush=True)
+    if ready is not None:
+        ready.set()
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows, or not the main thread: stop with Ctrl+C or by cancelling serve
+    try:
+        async with server:
+            await stop.wait()
+    finally:
+        await batcher.stop()
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP/JSON valuation service with request micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of CPUs")
+    parser.add_argument("--window", type=float, default=0.002, help="seconds to wait for more requests to join a batch")
+    parser.add_argument("--max-batch", type=int, default=512, help="most requests valued in one batch")
+    parser.add_argument("--max-pending", type=int, default=20000, help="most requests waiting before 503s are returned")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.window, args.max_batch, args.max_pending))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+'''The row by row create_cashflow from before the monthly engine was vectorised, kept unchanged (apart from its debug
+print) as the reference the vectorised version is tested against. It only supports quarterly in advance rent.'''
+import calendar
+from datetime import date, timedelta
+from typing import Optional
+
+import pandas as pd
+
+
+def add_months(d, months):
+    # Simple function to add months to a date
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    day = min(d.day, calendar.monthrange(year, month)[1])
+    return d.replace(year=year, month=month, day=day)
+
+
+def create_cashflow(
+    cashflow_start: date,
+    cashflow_term: float,
+    unit_area: float,
+    lease_start: date,
+    current_rent: float,
+    review_date: date,
+    lease_termination: date,
+    headline_erv: float,
+    ner_discount: float,
+    refurb_cost: float,
+    refurb_duration: float,
+    void_period: float,
+    rf: float,
+    relet_term: float,
+    exit_cap: float,
+    vacant_rates_percent: float,
+    rates_relief: float,
+    vacant_sc: float,
+    relet_rent: Optional[float] = None,
+    entry_price: float = 0.0,
+    exit_price: float = 0.0,
+    quarterly_in_advance: bool = True
+    ):
+    if not isinstance(review_date, date):
+        raise TypeError("review_date must be a datetime.date instance")
+    if not isinstance(lease_termination, date):
+        raise TypeError("lease_termination must be a datetime.date instance")
+
+    cashflows = []
+    # Define the distinct categories you want cashflow series for
+    categories = [
+        "contracted_rent",
+        "reviewed_rent",
+        "refurbishment_period",
+        "void_period",
+        "rf_period",
+        "relet_rent"
+    ]
+    # Calculate relet_date as lease_termination plus refurb_duration and void_period (in months)
+    relet_months = int(refurb_duration + void_period)
+    relet_date = add_months(lease_termination, relet_months)
+
+    # Monthly refurb cost per month (as a negative cashflow)
+    if refurb_duration == 0:
+        monthly_refurb_cost = 0
+    else:
+        monthly_refurb_cost = -(refurb_cost * unit_area) / refurb_duration
+
+    for i in range(int(cashflow_term)):
+        # Initialize a row with zero for each category
+        row = {cat: 0.0 for cat in categories}
+
+        period_start = add_months(cashflow_start, i)
+
+        rent_amount = 0.0
+        category = None
+
+        # Rental income from current rent until lease termination
+        if period_start < lease_termination:
+            # current_rent is annual; convert to monthly
+            monthly_rent = current_rent / 12
+            rent_amount = monthly_rent
+            category = "contracted_rent"
+            if review_date < lease_termination and period_start >= review_date and ((headline_erv * unit_area) * ner_discount) > current_rent:
+                reviewed_monthly_rent = ((headline_erv * unit_area) * ner_discount) / 12
+                rent_amount = reviewed_monthly_rent
+                category = "reviewed_rent"
+
+        refurb_cost_amount = 0.0
+        refurb_end = add_months(lease_termination, int(refurb_duration))
+        # Refurbishment costs apply for the refurb period (starting at lease_termination)
+        if lease_termination <= period_start < refurb_end:
+            refurb_cost_amount = monthly_refurb_cost
+            category = "refurbishment_period"
+
+        void_end = add_months(refurb_end, int(void_period))
+        # Void period after refurbishment and before relet
+        if refurb_end <= period_start < void_end:
+            category = "void_period"
+            # Calculate vacant service charge
+            vacant_sc_amount = -(unit_area * vacant_sc / 12)
+            rent_amount = vacant_sc_amount
+
+            # Calculate vacant rates if beyond rates relief period
+            void_month = (period_start - refurb_end).days // 30 + 1
+            if void_month > rates_relief:
+                vacant_rates_amount = -(vacant_rates_percent * (headline_erv * unit_area) / 12)
+                rent_amount = vacant_sc_amount + vacant_rates_amount
+
+        rf_end = add_months(void_end, int(rf))
+        annual_new_rent = relet_rent if relet_rent is not None else headline_erv * unit_area
+        monthly_new_rent = annual_new_rent / 12
+        if void_end <= period_start < rf_end:
+            rent_amount = -monthly_new_rent
+            category = "rf_period"
+        elif period_start >= relet_date:
+            rent_amount = monthly_new_rent
+            category = "relet_rent"
+
+        # Assign the computed cashflow to the corresponding category series
+        if category:
+            row[category] = rent_amount + refurb_cost_amount
+            row["category"] = category
+
+        # If rf_period is less than 0, update the relet_rent value in that row to be the inverse of the rf_period value
+        if row.get("rf_period", 0) < 0:
+            row["relet_rent"] = -row["rf_period"]
+
+        cashflows.append(row)
+
+    # Convert the list of cashflows to a DataFrame
+    cashflows_df = pd.DataFrame(cashflows)
+    # Set up a month index starting at 0 for the computed cashflows
+    cashflows_df['month'] = range(len(cashflows))
+
+    cashflows_df['period_start'] = cashflows_df['month'].apply(lambda m: add_months(cashflow_start, m))
+    cashflows_df['period_end'] = cashflows_df['period_start'].apply(lambda d: d.replace(day=calendar.monthrange(d.year, d.month)[1]))
+
+    # Transform rent columns to quarterly in advance
+    if quarterly_in_advance==True:
+        quarter_months = {4, 7, 10, 1} # offset quarters by one month (assuming rent received on day 1 of month following quarter date)
+        # Identify rent columns that need quarterly treatment
+        rent_columns = ["contracted_rent", "reviewed_rent", "rf_period", "relet_rent"]
+
+        # First sum all rent columns into a total_rent column
+        cashflows_df['total_rent'] = cashflows_df[rent_columns].sum(axis=1)
+
+        # Create a copy to store the original monthly rents
+        monthly_rents = cashflows_df['total_rent'].copy()
+
+        # Apply quarterly-in-advance logic
+        for i in range(len(cashflows_df)):
+            if cashflows_df.iloc[i]["period_start"].month in quarter_months:
+                # For a quarter-starting month, sum this month and the next two (if they exist)
+                quarter_sum = monthly_rents.iloc[i]
+                if i+1 < len(monthly_rents):
+                    quarter_sum += monthly_rents.iloc[i+1]
+                    cashflows_df.loc[cashflows_df.index[i+1], 'total_rent'] = 0
+                if i+2 < len(monthly_rents):
+                    quarter_sum += monthly_rents.iloc[i+2]
+                    cashflows_df.loc[cashflows_df.index[i+2], 'total_rent'] = 0
+
+                # Set the quarterly payment at the quarter-starting month
+                cashflows_df.loc[cashflows_df.index[i], 'total_rent'] = quarter_sum
+
+    # Calculate the total cashflow for each month
+    cashflows_df['cashflow'] = cashflows_df[['total_rent', 'refurbishment_period', 'void_period']].sum(axis=1)
+
+    # Incorporate entry_price and exit_price. Create an entry row one day before cashflow_start
+    entry_row = pd.DataFrame({
+        'month': [0],
+        'cashflow': [-entry_price],
+        'period_start': [cashflow_start - timedelta(days=1)],
+        'period_end': [cashflow_start - timedelta(days=1)],
+        'category': ['entry']
+    })
+
+    # Shift main cashflows by 1 month index so they come after the entry row
+    cashflows_df['month'] = cashflows_df['month'] + 1
+
+    # Create an exit row one day after the final period_end of the main cashflows
+    exit_row = pd.DataFrame({
+        'month': [cashflows_df['month'].max() + 1],
+        'cashflow': [exit_price],
+        'period_start': [cashflows_df.iloc[-1]['period_end'] + timedelta(days=1)],
+        'period_end': [cashflows_df.iloc[-1]['period_end'] + timedelta(days=1)],
+        'category': ['exit']
+    })
+
+    # Concatenate entry row, main cashflows, and exit row
+    cashflows_df = pd.concat([entry_row, cashflows_df, exit_row], ignore_index=True)
+
+    # First compute the basic cashflow line with entry/exit adjustments
+    cashflows_df['cashflow_line'] = cashflows_df.apply(
+        lambda row: row['cashflow'] + entry_price if row['category'] == 'entry' else
+                    (row['cashflow'] - exit_price if row['category'] == 'exit' else row['cashflow']),
+        axis=1
+    )
+
+    # Smooth rent categories with zero cashflow
+    for i in range(1, len(cashflows_df)):
+        current_cat = str(cashflows_df.iloc[i].get('category', ''))
+        if 'rent' in current_cat.lower() and cashflows_df.iloc[i]['cashflow'] == 0:
+            cashflows_df.at[i, 'cashflow_line'] = cashflows_df.at[i-1, 'cashflow_line']
+    return cashflows_df
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from batch_xirr import xirr_batch, xnpv_batch, xnpv_rows, year_fractions
+from benchmarks import synthetic_portfolio
+from lease import LeaseArray
+from portfolio import portfolio_cashflow_matrix, unit_cashflow_series
+
+pyxirr = pytest.importorskip("pyxirr")
+
+
+def random_portfolio(seed, n_units=400):
+    '''Random portfolio of leases with varied terms and entry prices from a fraction to several times the default,
+    so the IRRs run from distressed to high and some cashflows change sign more than once'''
+
+    rng = np.random.default_rng(seed)
+    leases = synthetic_portfolio(n_units, cashflow_term=240, seed=seed)
+    leases = LeaseArray(leases).replace(
+        cashflow_term=rng.integers(12, 241, n_units),
+        exit_price=np.nan,
+        entry_price=leases["entry_price"].values * rng.uniform(0.3, 4, n_units),
+    )
+    return unit_cashflow_series(portfolio_cashflow_matrix(leases))
+
+
+def distressed_cashflows(seed, n_units=200):
+    '''Random purchase, monthly income and sale cashflows that return a small fraction of the price, with IRRs down
+    to near -1'''
+
+    rng = np.random.default_rng(seed)
+    n_months = 12
+    dates = np.datetime64("2025-01-01") + (np.arange(n_months + 1) * 365.25 / 12).astype("timedelta64[D]")
+    recovered = 10.0 ** rng.uniform(-5, 0, n_units)
+    income = rng.uniform(0, 1, (n_units, n_months)) * recovered[:, None] / n_months
+    income[:, -1] += recovered * rng.uniform(0, 1, n_units)
+    flows = np.column_stack([np.full(n_units, -1.0), income])
+    return np.broadcast_to(dates, flows.shape), flows
+
+
+def reference_irr(dates, flows):
+    padding = np.isnat(dates)
+    irr = pyxirr.xirr(dates[~padding].astype(object), flows[~padding])
+    return np.nan if irr is None else irr
+
+
+def sign_changes(flows):
+    signs = np.sign(flows[flows != 0])
+    return int((signs[1:] != signs[:-1]).sum())
+
+
+def assert_roots(dates, flows, irr):
+    '''every finite IRR must make the unit's NPV 0, relative to the size of its discounted cashflows'''
+
+    finite = np.isfinite(irr)
+    assert finite.any()
+    npv = xnpv_rows(irr[finite], dates[finite], flows[finite])
+    scale = np.abs(flows[finite] * np.exp(-year_fractions(dates[finite]) * np.log1p(irr[finite])[:, None])).sum(axis=1)
+    np.testing.assert_array_less(np.abs(npv), 1e-6 * scale)
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_xirr_batch_matches_pyxirr(seed):
+    dates, flows = random_portfolio(seed)
+    irr = xirr_batch(dates, flows)
+    assert_roots(dates, flows, irr)
+
+    for unit in range(len(flows)):
+        expected = reference_irr(dates[unit], flows[unit])
+        if np.isnan(expected):
+            assert np.isnan(irr[unit])
+        elif sign_changes(flows[unit]) == 1:
+            assert irr[unit] == pytest.approx(expected, abs=1e-8)
+        else:
+            # Several IRRs can exist, xirr_batch returns one nearest the guess
+            assert np.isfinite(irr[unit])
+            assert abs(irr[unit] - 0.1) <= abs(expected - 0.1) + 1e-8
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_xirr_batch_distressed(seed):
+    dates, flows = distressed_cashflows(seed)
+    irr = xirr_batch(dates, flows)
+    assert_roots(dates, flows, irr)
+
+    expected = np.array([reference_irr(dates[unit], flows[unit]) for unit in range(len(flows))])
+    assert (expected < -0.999).any()
+    found = np.isfinite(expected)
+    np.testing.assert_allclose(irr[found], expected[found], rtol=1e-6, atol=1e-8)
+
+
+def test_xirr_batch_without_a_sign_change():
+    dates = np.datetime64("2025-01-01") + np.array([0, 365, 730])
+    flows = np.array([[100.0, 10.0, 110.0], [-100.0, -10.0, 0.0], [0.0, 0.0, 0.0]])
+    assert np.isnan(xirr_batch(dates, flows)).all()
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_xnpv_batch_matches_pyxirr(seed):
+    dates, flows = random_portfolio(seed, n_units=100)
+    rates = np.array([-0.5, 0.0, 0.07, 0.1, 0.25])
+    npv = xnpv_batch(rates, dates, flows)
+    assert npv.shape == (len(rates), len(flows))
+
+    for unit in range(len(flows)):
+        padding = np.isnat(dates[unit])
+        for index, rate in enumerate(rates):
+            expected = pyxirr.xnpv(rate, dates[unit][~padding].astype(object), flows[unit][~padding])
+            assert npv[index, unit] == pytest.approx(expected, rel=1e-9, abs=1e-6)
+
+    np.testing.assert_allclose(xnpv_rows(rates[3], dates, flows), npv[3])
@@ -0,0 +1,87 @@
+from datetime import date
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import legacy_cashflow
+from npv_irr_calculations import CATEGORIES, create_cashflow
+
+# Columns of the reference DataFrame the vectorised create_cashflow must reproduce, the amounts to rounding (the rent
+# columns are summed in a different order) and the rest exactly
+COLUMNS = ["month", "cashflow", "period_start", "period_end", "category"] + CATEGORIES + ["total_rent", "cashflow_line"]
+EXACT_COLUMNS = ["month", "period_start", "period_end", "category"]
+# The columns of create_cashflow(output="arrays")
+ARRAY_COLUMNS = ["month", "cashflow", "period_start", "period_end"] + CATEGORIES + ["total_rent"]
+
+
+def random_date(rng, first, last):
+    return date.fromordinal(int(rng.integers(first.toordinal(), last.toordinal() + 1)))
+
+
+def random_lease(rng):
+    '''Random create_cashflow inputs, with start and lease dates on any day of the month (including month ends) and
+    reviews and lease events before, during and after the cashflow'''
+
+    cashflow_start = random_date(rng, date(2023, 1, 1), date(2026, 12, 31))
+    lease_termination = random_date(rng, date(2022, 6, 1), date(2034, 12, 31))
+    return dict(
+        cashflow_start=cashflow_start,
+        cashflow_term=int(rng.integers(1, 121)),
+        unit_area=float(rng.integers(500, 20000)),
+        lease_start=random_date(rng, date(2015, 1, 1), date(2027, 12, 31)),
+        current_rent=float(rng.uniform(5000, 400000)),
+        review_date=random_date(rng, date(2022, 1, 1), lease_termination),
+        lease_termination=lease_termination,
+        headline_erv=float(rng.uniform(5, 40)),
+        ner_discount=float(rng.choice([0.6, 0.7, 0.8, 1.0])),
+        refurb_cost=float(rng.choice([0.0, 10.0, 25.0])),
+        refurb_duration=int(rng.integers(0, 7)),
+        void_period=int(rng.integers(0, 19)),
+        rf=int(rng.integers(0, 13)),
+        relet_term=5,
+        exit_cap=0.06,
+        vacant_rates_percent=float(rng.uniform(0, 1)),
+        rates_relief=int(rng.integers(0, 7)),
+        vacant_sc=float(rng.uniform(0, 5)),
+        relet_rent=None if rng.uniform() < 0.5 else float(rng.uniform(5000, 400000)),
+        entry_price=float(rng.uniform(0, 5e6)),
+        exit_price=float(rng.uniform(0, 5e6)),
+    )
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_dataframe_matches_row_loop(seed):
+    lease = random_lease(np.random.default_rng(seed))
+    expected = legacy_cashflow.create_cashflow(**lease)
+    result = create_cashflow(**lease)
+
+    for column in COLUMNS:
+        pd.testing.assert_series_equal(result[column], expected[column], check_dtype=False,
+                                       check_exact=column in EXACT_COLUMNS, rtol=1e-12, atol=1e-6)
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_arrays_match_row_loop(seed):
+    lease = random_lease(np.random.default_rng(seed))
+    expected = legacy_cashflow.create_cashflow(**lease)
+    result = create_cashflow(**lease, output="arrays")
+
+    assert set(result) == set(ARRAY_COLUMNS)
+    for column in ARRAY_COLUMNS:
+        values = expected[column].to_numpy()
+        if column in ("period_start", "period_end"):
+            values = values.astype("datetime64[D]")
+            np.testing.assert_array_equal(result[column], values, err_msg=column)
+        else:
+            np.testing.assert_allclose(result[column], values, rtol=1e-12, atol=1e-6, err_msg=column)
+
+
+def test_positional_arguments_keep_their_order():
+    # The arguments after exit_price in the order they were added, new ones only ever go at the end
+    lease = random_lease(np.random.default_rng(0))
+    positional = [lease[name] for name in list(lease)[:21]]
+    result = create_cashflow(*positional, False, None, None, "arrays")
+    expected = create_cashflow(**lease, quarterly_in_advance=False, output="arrays")
+    for column in ARRAY_COLUMNS:
+        np.testing.assert_array_equal(result[column], expected[column])
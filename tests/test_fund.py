@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_portfolio
+from fund import FUND_COLUMNS, fund_cashflow, fund_cashflow_from_units, fund_metrics, fund_series
+from lease import LeaseArray
+from npv_irr_calculations import create_cashflow
+from portfolio import create_portfolio_cashflows
+
+pyxirr = pytest.importorskip("pyxirr")
+
+
+@pytest.fixture(scope="module")
+def leases():
+    '''Units starting on staggered dates over two years, some on the 1st of a month and some mid-month, with
+    different terms'''
+
+    rng = np.random.default_rng(6)
+    first_of_month = (np.datetime64("2025-01", "M") + rng.integers(0, 24, 30)).astype("datetime64[D]")
+    starts = first_of_month + np.where(np.arange(30) % 3 == 0, rng.integers(1, 28, 30), 0)
+    portfolio = LeaseArray(synthetic_portfolio(30, cashflow_term=60, seed=6))
+    return portfolio.replace(cashflow_start=starts, cashflow_term=rng.integers(12, 61, 30), exit_price=np.nan)
+
+
+@pytest.fixture(scope="module")
+def units(leases):
+    return [create_cashflow(**lease, output="arrays") for lease in leases]
+
+
+def test_fund_series_are_the_sum_of_the_units(leases, units):
+    fund = fund_cashflow(create_portfolio_cashflows(leases, 0.1))
+    assert fund["units"] == 30
+    assert fund["months"][0] == min(leases["cashflow_start"]).astype("datetime64[M]")
+
+    # Each unit's months, entry and exit added up by the calendar month they fall in
+    expected = {name: defaultdict(float) for name in FUND_COLUMNS + ["entry", "exit"]}
+    for rows in units:
+        months = rows["period_start"].astype("datetime64[M]")
+        expected["entry"][months[1]] += rows["cashflow"][0]
+        expected["exit"][months[-1]] += rows["cashflow"][-1]
+        for name in FUND_COLUMNS:
+            for month, value in zip(months[1:-1], rows[name][1:-1]):
+                expected[name][month] += value
+
+    for name, totals in expected.items():
+        dense = np.array([totals.get(month, 0.0) for month in fund["months"]])
+        np.testing.assert_allclose(fund[name], dense, rtol=1e-12, atol=1e-6, err_msg=name)
+
+    from_units = fund_cashflow_from_units(units)
+    for name in FUND_COLUMNS + ["entry", "exit"]:
+        np.testing.assert_allclose(from_units[name], fund[name], rtol=1e-12, atol=1e-6, err_msg=name)
+
+
+def test_fund_metrics_match_pyxirr(leases, units):
+    fund = fund_cashflow(create_portfolio_cashflows(leases, 0.1))
+    dates, flows = fund_series(fund)
+
+    # Every unit's rows on the 1st of their month (entries the day before), mid-month starts included
+    expected = defaultdict(float)
+    for rows in units:
+        month_start = rows["period_start"].astype("datetime64[M]").astype("datetime64[D]")
+        expected[month_start[1] - 1] += rows["cashflow"][0]
+        for day, value in zip(month_start[1:], rows["cashflow"][1:]):
+            expected[day] += value
+    expected = {day: value for day, value in expected.items() if value != 0}
+    assert list(dates) == sorted(expected)
+    np.testing.assert_allclose(flows, [expected[day] for day in dates], rtol=1e-12, atol=1e-6)
+
+    metrics = fund_metrics(fund, 0.08)
+    assert metrics["irr"] == pytest.approx(pyxirr.xirr(dates.astype(object), flows), abs=1e-9)
+    assert metrics["npv"] == pytest.approx(pyxirr.xnpv(0.08, dates.astype(object), flows), rel=1e-9)
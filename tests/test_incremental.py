@@ -0,0 +1,74 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from batch_xirr import xirr_batch
+from incremental import IncrementalCashflow
+from npv_irr_calculations import CATEGORIES, create_cashflow
+from rent_timing import RENT_CONVENTIONS
+from test_create_cashflow import random_lease
+
+
+def shift_date(rng, value, months):
+    return value + timedelta(days=int(rng.integers(-months, months + 1)) * 30 + int(rng.integers(0, 30)))
+
+
+# A random new value for every create_cashflow input, given the current inputs
+UPDATES = {
+    "cashflow_start": lambda rng, inputs: shift_date(rng, inputs["cashflow_start"], 6),
+    "cashflow_term": lambda rng, inputs: int(rng.integers(1, 121)),
+    "unit_area": lambda rng, inputs: float(rng.integers(500, 20000)),
+    "lease_start": lambda rng, inputs: shift_date(rng, inputs["lease_start"], 24),
+    "current_rent": lambda rng, inputs: float(rng.uniform(5000, 400000)),
+    "review_date": lambda rng, inputs: min(shift_date(rng, inputs["review_date"], 24), inputs["lease_termination"]),
+    "lease_termination": lambda rng, inputs: max(shift_date(rng, inputs["lease_termination"], 24), inputs["review_date"]),
+    "headline_erv": lambda rng, inputs: float(rng.uniform(5, 40)),
+    "ner_discount": lambda rng, inputs: float(rng.choice([0.6, 0.7, 0.8, 1.0])),
+    "refurb_cost": lambda rng, inputs: float(rng.choice([0.0, 10.0, 25.0])),
+    "refurb_duration": lambda rng, inputs: int(rng.integers(0, 7)),
+    "void_period": lambda rng, inputs: int(rng.integers(0, 19)),
+    "rf": lambda rng, inputs: int(rng.integers(0, 13)),
+    "relet_term": lambda rng, inputs: int(rng.integers(1, 11)),
+    "exit_cap": lambda rng, inputs: float(rng.uniform(0.04, 0.1)),
+    "vacant_rates_percent": lambda rng, inputs: float(rng.uniform(0, 1)),
+    "rates_relief": lambda rng, inputs: int(rng.integers(0, 7)),
+    "vacant_sc": lambda rng, inputs: float(rng.uniform(0, 5)),
+    "relet_rent": lambda rng, inputs: None if rng.uniform() < 0.5 else float(rng.uniform(5000, 400000)),
+    "entry_price": lambda rng, inputs: float(rng.uniform(0, 5e6)),
+    "exit_price": lambda rng, inputs: None if rng.uniform() < 0.5 else float(rng.uniform(0, 5e6)),
+    "quarterly_in_advance": lambda rng, inputs: bool(rng.integers(2)),
+    "valuation_yield": lambda rng, inputs: None if rng.uniform() < 0.5 else float(rng.uniform(0.04, 0.1)),
+    "purchasers_costs": lambda rng, inputs: float(rng.uniform(0, 0.1)),
+}
+
+
+@pytest.mark.parametrize("convention", [None] + list(RENT_CONVENTIONS))
+@pytest.mark.parametrize("seed", range(3))
+def test_updates_match_create_cashflow(convention, seed):
+    rng = np.random.default_rng(seed)
+    inputs = dict(random_lease(rng), exit_price=None, rent_convention=convention)
+    cashflow = IncrementalCashflow(**inputs)
+
+    for _ in range(3):
+        for field in rng.permutation(list(UPDATES)):
+            inputs[field] = UPDATES[field](rng, inputs)
+            cashflow.update(**{field: inputs[field]})
+
+            expected = create_cashflow(**inputs, output="arrays")
+            rows = cashflow.arrays()
+            for column in ["month", "period_start", "period_end"]:
+                np.testing.assert_array_equal(rows[column], expected[column], err_msg=f"{field}: {column}")
+            for column in ["cashflow"] + CATEGORIES + ["total_rent"]:
+                np.testing.assert_allclose(rows[column], expected[column], rtol=1e-12, atol=1e-6, err_msg=f"{field}: {column}")
+
+            # The IRR is re-solved from the previous one rather than the default guess, it must reach the same root
+            expected_irr = xirr_batch(expected["period_start"], expected["cashflow"])
+            np.testing.assert_allclose(cashflow.irr, expected_irr, rtol=1e-9, atol=1e-12, err_msg=field)
+
+    # The DataFrame (whose valuation column is recalculated in full) must match as well
+    expected = create_cashflow(**inputs)
+    result = cashflow.dataframe()
+    for column in expected.columns:
+        pd.testing.assert_series_equal(result[column], expected[column], check_dtype=False, rtol=1e-12, atol=1e-6)
@@ -0,0 +1,60 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from lease import LeaseArray
+from npv_irr_calculations import create_cashflow
+from portfolio import create_portfolio_cashflows
+from rent_timing import RENT_CONVENTIONS
+from test_create_cashflow import random_lease
+
+pyxirr = pytest.importorskip("pyxirr")
+
+
+def random_portfolio(seed, n_units=200):
+    '''Random leases as for the create_cashflow tests, in a mix of rent conventions and with the exit price valued
+    on the exit rent'''
+
+    rng = np.random.default_rng(seed)
+    conventions = list(RENT_CONVENTIONS)
+    return [dict(random_lease(rng), exit_price=None, rent_convention=conventions[rng.integers(len(conventions))])
+            for _ in range(n_units)]
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_matches_create_cashflow(seed):
+    leases = random_portfolio(seed)
+    result = create_portfolio_cashflows(LeaseArray.from_leases(leases), 0.1)
+
+    for unit, lease in enumerate(leases):
+        rows = create_cashflow(**lease, output="arrays")
+        term = result["term"][unit]
+        assert term == lease["cashflow_term"]
+        np.testing.assert_array_equal(result["cashflow"][unit, :term], rows["cashflow"][1:-1])
+        np.testing.assert_array_equal(result["period_start"][unit, :term], rows["period_start"][1:-1])
+        assert np.isnat(result["period_start"][unit, term:]).all()
+        assert result["entry_cashflow"][unit] == rows["cashflow"][0]
+        assert result["exit_cashflow"][unit] == rows["cashflow"][-1]
+        npv = pyxirr.xnpv(0.1, rows["period_start"].astype(object), rows["cashflow"])
+        assert result["npv"][unit] == pytest.approx(npv, rel=1e-9, abs=1e-6)
+
+
+def test_irr_of_several_roots_is_nearest_the_guess():
+    # Income, then a void running to the end of the cashflow with no exit value, so the NPV changes sign twice.
+    # pyxirr finds the root at about -45%, xirr_batch the one nearer its guess (10%), which is the intended IRR.
+    lease = dict(
+        cashflow_start=date(2025, 1, 1), cashflow_term=154, unit_area=10042.0, lease_start=date(2020, 1, 1),
+        current_rent=141723.79, review_date=date(2034, 10, 1), lease_termination=date(2037, 6, 1), headline_erv=16.95,
+        ner_discount=0.7, refurb_cost=20.0, refurb_duration=1, void_period=8, rf=5, relet_term=5, exit_cap=0.06,
+        vacant_rates_percent=0.5, rates_relief=3, vacant_sc=2.0, entry_price=3720000.0, exit_price=None,
+    )
+    result = create_portfolio_cashflows(LeaseArray.from_leases([lease]), 0.1)
+    rows = create_cashflow(**lease, output="arrays")
+    reference = pyxirr.xirr(rows["period_start"].astype(object), rows["cashflow"])
+
+    assert result["irr"][0] == pytest.approx(-0.1415, abs=1e-3)
+    assert reference == pytest.approx(-0.4512, abs=1e-3)
+    for rate in [result["irr"][0], reference]:
+        npv = pyxirr.xnpv(rate, rows["period_start"].astype(object), rows["cashflow"])
+        assert abs(npv) < 1e-6 * np.abs(rows["cashflow"]).sum()
@@ -0,0 +1,40 @@
+import threading
+
+import profiling
+from benchmarks import example_lease
+from npv_irr_calculations import create_cashflow
+
+
+def test_recording_only_applies_to_its_thread():
+    # As two Streamlit sessions, one with profiling ticked and one without
+    ticked, other = profiling.StageCollector(), profiling.StageCollector()
+
+    def session(collector, enabled):
+        with profiling.recording(collector, enabled=enabled):
+            create_cashflow(**example_lease(60))
+
+    threads = [threading.Thread(target=session, args=(ticked, True)), threading.Thread(target=session, args=(other, False))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert ticked.calls["create_cashflow.components"] == 1
+    assert other.calls == {}
+    assert not profiling.is_enabled()
+
+
+def test_recording_overrides_the_process_flag():
+    collector = profiling.StageCollector()
+    profiling.enable(reset=True)
+    try:
+        with profiling.recording(collector, enabled=False):
+            create_cashflow(**example_lease(60))
+        assert profiling.collector.calls == {} and collector.calls == {}
+    finally:
+        profiling.disable()
+
+    with profiling.profile() as recorded:
+        create_cashflow(**example_lease(60))
+    assert recorded.calls["create_cashflow.retime_rent"] == 1
+    assert not profiling.is_enabled()
@@ -0,0 +1,90 @@
+import numpy as np
+import pytest
+
+from rent_timing import payment_groups, retime_rent
+
+# Calendar months each convention's payment periods start in, written out rather than taken from RENT_CONVENTIONS
+PERIOD_STARTS = {
+    "monthly_in_advance": (set(range(1, 13)), True),
+    "quarterly_in_advance": ({1, 4, 7, 10}, True),
+    "quarterly_in_arrears": ({1, 4, 7, 10}, False),
+    "half_yearly_in_advance": ({4, 10}, True),
+}
+CUSTOM = {"period_months": 2, "anchor_month": 2, "in_advance": False}
+
+
+def reference_payments(rent, start_month, period_starts, in_advance):
+    '''Rent paid per month, month by month: a payment period runs from one of period_starts to the next, and the
+    months before the first one are each paid as they fall in advance, or together at the end of them in arrears.
+    A period's rent is paid in its first month in advance and its last month (within the cashflow) in arrears.'''
+
+    calendar_months = [(start_month - 1 + i) % 12 + 1 for i in range(len(rent))]
+    groups = []
+    for i, month in enumerate(calendar_months):
+        started = any(m in period_starts for m in calendar_months[:i + 1])
+        if i == 0 or month in period_starts or (in_advance and not started):
+            groups.append([i])
+        else:
+            groups[-1].append(i)
+    paid = np.zeros(len(rent))
+    for group in groups:
+        paid[group[0] if in_advance else group[-1]] = sum(rent[i] for i in group)
+    return paid
+
+
+def month_axis(start_month, n_months, year=2025):
+    return np.datetime64(f"{year}-{start_month:02d}", "M") + np.arange(n_months)
+
+
+@pytest.mark.parametrize("start_month", range(1, 13))
+@pytest.mark.parametrize("convention", list(PERIOD_STARTS) + ["custom"])
+def test_retime_rent_pays_in_the_convention_months(convention, start_month):
+    period_starts, in_advance = PERIOD_STARTS.get(convention, ({2, 4, 6, 8, 10, 12}, False))
+    spec = CUSTOM if convention == "custom" else convention
+    # Distinct powers of 2, so each payment shows exactly which months it covers
+    rent = 2.0 ** np.arange(20)
+    expected = reference_payments(rent, start_month, period_starts, in_advance)
+    np.testing.assert_array_equal(retime_rent(rent, month_axis(start_month, 20), spec), expected)
+
+
+@pytest.mark.parametrize("convention, start_month, expected", [
+    # Feb and Mar are before the first quarter: paid as they fall in advance, together at the end of March in arrears
+    ("quarterly_in_advance", 2, [1, 2, 12, 0, 0, 6]),
+    ("quarterly_in_arrears", 2, [0, 3, 0, 0, 12, 6]),
+    # In arrears a quarter cut off by the end of the cashflow is paid in its final month (Apr and May from a Dec start)
+    ("quarterly_in_arrears", 1, [0, 0, 6, 0, 0, 15]),
+    ("quarterly_in_arrears", 12, [1, 0, 0, 9, 0, 11]),
+    ("half_yearly_in_advance", 1, [1, 2, 3, 15, 0, 0]),
+    ("monthly_in_advance", 11, [1, 2, 3, 4, 5, 6]),
+])
+def test_retime_rent_by_hand(convention, start_month, expected):
+    rent = np.arange(1.0, 7.0)
+    np.testing.assert_array_equal(retime_rent(rent, month_axis(start_month, 6), convention), expected)
+
+
+@pytest.mark.parametrize("convention", ["quarterly_in_advance", "quarterly_in_arrears", "half_yearly_in_advance"])
+def test_term_padding_on_a_portfolio(convention):
+    # Units x months with their own start months and terms, the months after a unit's term are padding
+    period_starts, in_advance = PERIOD_STARTS[convention]
+    start_months = np.array([1, 2, 3, 5, 11, 12])
+    terms = np.array([1, 2, 5, 7, 12, 13])
+    months = np.stack([month_axis(start, 13) for start in start_months])
+    rent = np.where(np.arange(13) < terms[:, None], 2.0 ** np.arange(13), 0.0)
+
+    retimed = retime_rent(rent, months, convention, terms)
+    for unit, (start, term) in enumerate(zip(start_months, terms)):
+        np.testing.assert_array_equal(retimed[unit, :term], reference_payments(rent[unit, :term], start, period_starts, in_advance))
+        assert (retimed[unit, term:] == 0).all()
+
+    # Each unit's first month starts a group, and so does the first padding month, wherever it falls
+    starts = payment_groups(months, convention, terms)
+    first_padding = np.flatnonzero(terms < 13) * 13 + terms[terms < 13]
+    assert set(np.arange(len(terms)) * 13) <= set(starts)
+    assert set(first_padding) <= set(starts)
+
+
+def test_unknown_convention():
+    with pytest.raises(ValueError, match="Unknown rent convention 'yearly'"):
+        retime_rent(np.ones(12), month_axis(1, 12), "yearly")
+    with pytest.raises(ValueError):
+        payment_groups(month_axis(1, 12), "yearly")
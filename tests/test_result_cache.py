@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+import pytest
+
+import result_cache
+from benchmarks import synthetic_portfolio
+from lease import LeaseArray
+from portfolio import create_portfolio_cashflows
+from result_cache import DiskCache, lease_keys
+from runner import run_portfolio
+
+
+@pytest.fixture
+def leases():
+    return LeaseArray(synthetic_portfolio(60, cashflow_term=120, seed=4))
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = DiskCache(str(tmp_path / "results.sqlite"))
+    yield cache
+    cache.close()
+
+
+def assert_fresh(result, leases, discount_rate):
+    expected = create_portfolio_cashflows(leases, discount_rate)
+    np.testing.assert_array_equal(result["irr"], expected["irr"])
+    np.testing.assert_allclose(result["npv"], expected["npv"], rtol=1e-12)
+
+
+def test_changed_lease_misses(leases, cache):
+    first = run_portfolio(leases, 0.1, workers=1, chunk_size=25, cache=cache)
+    assert first["cache"] == {"hits": 0, "misses": 60, "hit_ratio": 0.0}
+
+    changed = leases.replace(void_period=np.where(np.arange(60) == 7, leases["void_period"] + 3, leases["void_period"]))
+    keys, changed_keys = lease_keys(leases), lease_keys(changed)
+    assert [unit for unit in range(60) if keys[unit] != changed_keys[unit]] == [7]
+
+    rerun = run_portfolio(changed, 0.1, workers=1, chunk_size=25, cache=cache)
+    assert rerun["cache"]["hits"] == 59 and rerun["cache"]["misses"] == 1
+    assert_fresh(rerun, changed, 0.1)
+
+
+def test_other_model_version_misses(leases, cache, monkeypatch):
+    run_portfolio(leases, 0.1, workers=1, cache=cache)
+    assert set(lease_keys(leases, version="other")).isdisjoint(lease_keys(leases))
+
+    # As after a change to the model code: nothing cached by the old code is reused, and it's then evicted
+    monkeypatch.setattr(result_cache, "model_version", lambda: "other")
+    rerun = run_portfolio(leases, 0.1, workers=1, cache=cache)
+    assert rerun["cache"]["hits"] == 0 and rerun["cache"]["misses"] == 60
+    assert cache.stats()["size"] == 60
+    assert_fresh(rerun, leases, 0.1)
+
+
+def test_new_discount_rate_revalues_npv_from_cached_cashflow(leases, cache):
+    run_portfolio(leases, 0.1, workers=1, cache=cache)
+    rerun = run_portfolio(leases, 0.08, workers=1, cache=cache)
+    assert rerun["cache"]["hits"] == 60
+    assert_fresh(rerun, leases, 0.08)
+
+    # The NPV at the new rate is cached in turn
+    found = cache.lookup(lease_keys(leases))
+    assert {rate for _, _, rate in found.values()} == {0.08}
+    np.testing.assert_allclose([found[key][1] for key in lease_keys(leases)], rerun["npv"], rtol=1e-12)
+
+
+def test_eviction_by_age_and_size(cache, monkeypatch):
+    now = time.time()
+    blob = b"x" * 100
+    cache.max_age_days = 30
+    # Units last used 40 days ago, then units used a minute apart up to now
+    monkeypatch.setattr(result_cache.time, "time", lambda: now - 40 * 86400)
+    cache.store(["old1", "old2"], [0.1, 0.1], [1.0, 1.0], [0.1, 0.1], [blob, blob])
+    for minute, key in enumerate(["a", "b", "c", "d"]):
+        monkeypatch.setattr(result_cache.time, "time", lambda minute=minute: now - (3 - minute) * 60)
+        cache.store([key], [0.1], [1.0], [0.1], [blob])
+
+    assert cache.evict() == 2
+    assert set(cache.lookup(["old1", "old2", "a", "b", "c", "d"])) == {"a", "b", "c", "d"}
+
+    # The lookup just marked them all used now, so use "a" and "b" last to keep them
+    monkeypatch.setattr(result_cache.time, "time", lambda: now + 60)
+    cache.lookup(["a", "b"])
+    cache.max_bytes = 250
+    assert cache.evict() == 2
+    assert set(cache.lookup(["a", "b", "c", "d"])) == {"a", "b"}
+    assert cache.load("c") is None
+    assert cache.stats()["bytes"] == 200
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from benchmarks import synthetic_portfolio
+from lease import LeaseArray
+from portfolio import create_portfolio_cashflows
+from result_store import STORE_SERIES, ResultStore, write_portfolio
+
+
+@pytest.fixture(scope="module")
+def leases():
+    '''40 units in shards of 20: the first all start in the same month (written as one block), the second on
+    staggered mid-month dates with different terms (written unit by unit)'''
+
+    rng = np.random.default_rng(5)
+    starts = np.concatenate([np.full(20, np.datetime64("2025-01-01")),
+                             np.datetime64("2024-06-15") + rng.integers(0, 900, 20).astype("timedelta64[D]")])
+    portfolio = LeaseArray(synthetic_portfolio(40, cashflow_term=60, seed=5))
+    return portfolio.replace(cashflow_start=starts, cashflow_term=rng.integers(12, 61, 40), exit_price=np.nan)
+
+
+@pytest.fixture(scope="module")
+def store_path(leases, tmp_path_factory):
+    path = tmp_path_factory.mktemp("store") / "portfolio.cfstore"
+    write_portfolio(str(path), leases, 0.1, unit_ids=[f"U{unit}" for unit in range(40)], workers=1, chunk_size=20)
+    return path
+
+
+def dense_series(result, name, months):
+    '''function to place each unit's monthly series on the store's calendar month axis'''
+
+    values = result["cashflow"] if name == "cashflow" else result["components"][name]
+    dense = np.zeros((len(values), len(months)))
+    for unit, term in enumerate(result["term"]):
+        first = int((result["period_start"][unit, 0].astype("datetime64[M]") - months[0]).astype(np.int64))
+        dense[unit, first:first + term] = values[unit, :term]
+    return dense
+
+
+def test_workers_write_the_same_file(leases, store_path, tmp_path):
+    path = tmp_path / "parallel.cfstore"
+    write_portfolio(str(path), leases, 0.1, unit_ids=[f"U{unit}" for unit in range(40)], workers=2, chunk_size=20)
+    assert path.read_bytes() == store_path.read_bytes()
+
+
+def test_select_matches_create_portfolio_cashflows(leases, store_path):
+    store = ResultStore(str(store_path))
+    result = create_portfolio_cashflows(leases, 0.1)
+    assert len(store) == 40 and store.series == STORE_SERIES
+    assert store.months[0] == np.datetime64("2024-06") and store.values.offset % 4096 == 0
+
+    for unit in [0, 19, 20, 27, 39]:
+        term = result["term"][unit]
+        first_month = result["period_start"][unit, 0].astype("datetime64[M]")
+        for name in ["cashflow", "void_period", "total_rent"]:
+            view = store.select(name, f"U{unit}", first_month, first_month + term)
+            assert isinstance(view, np.memmap)
+            expected = result["cashflow"] if name == "cashflow" else result["components"][name]
+            np.testing.assert_array_equal(view, expected[unit, :term])
+        # Outside its cashflow a unit's months are 0
+        assert not store.select("cashflow", f"U{unit}", end=first_month).any()
+        assert not store.select("cashflow", f"U{unit}", start=first_month + term).any()
+
+        fields = store.unit_fields(f"U{unit}")
+        assert fields["cashflow_start"] == leases["cashflow_start"][unit]
+        assert fields["term"] == term and fields["exit_cashflow"] == result["exit_cashflow"][unit]
+        np.testing.assert_array_equal([fields["irr"], fields["npv"]], [result["irr"][unit], result["npv"][unit]])
+
+
+def test_monthly_totals(leases, store_path):
+    store = ResultStore(str(store_path))
+    result = create_portfolio_cashflows(leases, 0.1)
+    for name in ["cashflow", "relet_rent"]:
+        dense = dense_series(result, name, store.months).sum(axis=0)
+        months, totals = store.monthly_totals(name, chunk_units=7)
+        np.testing.assert_array_equal(months, store.months)
+        np.testing.assert_allclose(totals, dense, rtol=1e-12)
+
+        months, totals = store.monthly_totals(name, "2025-03", "2026-01", chunk_units=7)
+        window = store.month_slice("2025-03", "2026-01")
+        assert len(months) == 10
+        np.testing.assert_allclose(totals, dense[window], rtol=1e-12)
+
+
+def test_not_a_store(tmp_path):
+    path = tmp_path / "leases.csv"
+    path.write_text("unit_id,current_rent\n1,50000\n")
+    with pytest.raises(ValueError, match="isn't a result store"):
+        ResultStore(str(path))
@@ -0,0 +1,52 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from benchmarks import example_lease
+from npv_irr_calculations import calculate_npv, create_cashflow
+from rent_timing import RENT_CONVENTIONS
+from segments import cashflow_segments, segment_payments, segments_npv
+
+
+def payments_by_month(payments, term):
+    '''function to add up the payment series of segment_payments in the months they're paid'''
+
+    monthly = np.zeros(term)
+    for month, count, step, amount in zip(payments["month"], payments["count"], payments["step"], payments["amount"]):
+        months = month + step * np.arange(count)
+        assert ((months >= 0) & (months < term)).all()
+        np.add.at(monthly, months, amount)
+    return monthly
+
+
+def assert_matches_create_cashflow(lease):
+    rows = create_cashflow(**lease, output="arrays")
+    segments = cashflow_segments(lease)
+    np.testing.assert_allclose(payments_by_month(segment_payments(segments), lease["cashflow_term"]),
+                               rows["cashflow"][1:-1], rtol=1e-12, atol=1e-6)
+    gross = np.abs(rows["cashflow"]).sum()
+    assert segments_npv(segments, 0.1) == pytest.approx(
+        calculate_npv(0.1, rows["period_start"].astype(object), rows["cashflow"]), abs=2e-4 * gross)
+
+
+@pytest.mark.parametrize("start_month", range(1, 13))
+def test_one_month_in_arrears(start_month):
+    # A single month before the first quarter end is paid in that month, not after the cashflow has ended
+    lease = dict(example_lease(1), cashflow_start=date(2025, start_month, 1), rent_convention="quarterly_in_arrears")
+    assert_matches_create_cashflow(lease)
+
+
+@pytest.mark.parametrize("convention", RENT_CONVENTIONS)
+@pytest.mark.parametrize("seed", range(10))
+def test_segments_match_create_cashflow(convention, seed):
+    rng = np.random.default_rng(seed)
+    lease = dict(
+        example_lease(int(rng.integers(1, 121))),
+        cashflow_start=date(2025, int(rng.integers(1, 13)), int(rng.integers(1, 29))),
+        lease_termination=date(2027, int(rng.integers(1, 13)), int(rng.integers(1, 29))),
+        void_period=int(rng.integers(0, 13)),
+        rf=int(rng.integers(0, 7)),
+        rent_convention=convention,
+    )
+    assert_matches_create_cashflow(lease)